@@ -3,3 +3,4 @@ from empty import Empty
 from lights import *
 from sky import Sky
 from water import Water
+from terrain import Terrain
@@ -12,9 +12,13 @@ from direct.task import Task
 
 from azure.errors import *
 from azure.physics import AeroplanePhysics
+from azure.utils import sign
 from assetbase import AssetBase
 from azure.loaderglobal import loader
 
+# control surfaces deflected less than this don't move the flaps
+flap_dead_zone = 0.1
+
 #specs = ConfigParser.SafeConfigParser()
 #specs.read(os.path.abspath(os.path.join(sys.path[0], "etc/CraftSpecs.cfg")))
 
@@ -32,7 +36,9 @@ class Aeroplane(AssetBase):
                  expected.
                  0 or False = don't load a model
 
-        physics -- When True, makes this plane physical.
+        physics -- When True, makes this plane physical. The flight
+                   specs are taken from etc/aeroplanes.ini by the name of
+                   the model (or the aircraft name if there's no model).
 
         info:       invisible planes (without model) are for tracking only.
                     you should assign them models when they get into
@@ -56,6 +62,7 @@ class Aeroplane(AssetBase):
 
         if model is None:
             model = name
+        self.spec = model or name
         if model:
             self.model, self.animcontrols = self.loadPlaneModel(model)
             self.model.reparentTo(self.node)
@@ -116,7 +123,7 @@ class Aeroplane(AssetBase):
     def activatePhysics(self):
         if self.physics is not None:
             return 1
-        self.physics = AeroplanePhysics(self.node)
+        self.physics = AeroplanePhysics(self.node, self.spec)
         self.addTask(self._propellers,
                      "propeller animations",
                      taskChain="world")
@@ -141,11 +148,13 @@ class Aeroplane(AssetBase):
                   1: self.animcontrols["Pitch Up"]}
         head =  {-1: self.animcontrols["Head Right"],
                   1: self.animcontrols["Head Left"]}
-        for flaps, state in (
-                (roll, self.physics.ailerons),
-                (pitch, self.physics.elevator),
-                (head, self.physics.rudder)):
-            if state == 0.0:
+        # the controls are reset after each physics step, so show the ones
+        # the last step flew with. analog axes give fractions, only the
+        # direction counts here
+        for flaps, value in zip((roll, pitch, head),
+                                self.physics.appliedControls()):
+            state = sign(value) if abs(value) > flap_dead_zone else 0
+            if state == 0:
                 for f in flaps:
                     if (flaps[f].isPlaying() == 1) and \
                        (flaps[f].getPlayRate() > 0):
@@ -0,0 +1,276 @@
+from math import log
+import numpy
+
+from panda3d.core import Filename, getModelPath
+from panda3d.core import NodePath, GeomNode, Geom, GeomTriangles
+from panda3d.core import GeomVertexFormat, GeomVertexData
+from panda3d.core import Texture, TextureStage, TexturePool
+from panda3d.core import TPLow
+
+from azure.errors import ResourceLoadError
+from azure.terrain import Heightfield, FlatGround
+from azure.physics import Physical
+from managedasset import ManagedAsset
+
+# tile geometry is built in this task chain, off the main thread
+tile_chain = "terrain tiles"
+
+
+def tileIndices(cells):
+    """Return the triangle indices of a tile with cells x cells quads and a
+    skirt (as uint16 array). They are the same for all tiles of a level."""
+    side = cells + 3
+    row = numpy.arange(side - 1)
+    corners = (row[None,:] + row[:,None] * side).ravel()
+    quads = numpy.empty((len(corners), 6), numpy.uint16)
+    quads[:,0] = corners
+    quads[:,1] = corners + 1
+    quads[:,2] = corners + side + 1
+    quads[:,3] = corners
+    quads[:,4] = corners + side + 1
+    quads[:,5] = corners + side
+    return quads.ravel()
+
+
+def tileVertices(field, col, row, cells, step, skirt, tex_size):
+    """Return the vertices (position, normal, texcoord) of a tile as float32
+    array. The tile starts at sample col, row of the heightfield and spans
+    cells * step samples per side. A skirt hangs down around the tile, so no
+    gaps show between tiles of different detail."""
+    last_col = field.columns - 1
+    last_row = field.rows - 1
+    # -1 and cells + 1 are the skirt
+    offsets = numpy.arange(-1, cells + 2)
+    cols = numpy.clip(col + numpy.clip(offsets, 0, cells) * step, 0, last_col)
+    rows = numpy.clip(row + numpy.clip(offsets, 0, cells) * step, 0, last_row)
+    heights = numpy.asarray(field.heights[rows[:,None], cols[None,:]], float)
+
+    # normals from the neighbouring samples of the full resolution grid
+    h = field.heights
+    east = h[rows[:,None], numpy.minimum(cols + 1, last_col)[None,:]]
+    west = h[rows[:,None], numpy.maximum(cols - 1, 0)[None,:]]
+    north = h[numpy.minimum(rows + 1, last_row)[:,None], cols[None,:]]
+    south = h[numpy.maximum(rows - 1, 0)[:,None], cols[None,:]]
+
+    side = cells + 3
+    vertices = numpy.empty((side, side, 8), numpy.float32)
+    x = field.origin_x + cols * field.spacing
+    y = field.origin_y + rows * field.spacing
+    vertices[:,:,0] = x[None,:]
+    vertices[:,:,1] = y[:,None]
+    vertices[:,:,2] = heights
+    vertices[0,:,2] -= skirt
+    vertices[-1,:,2] -= skirt
+    vertices[1:-1,0,2] -= skirt
+    vertices[1:-1,-1,2] -= skirt
+    nx = (west - east) / (2.0 * field.spacing)
+    ny = (south - north) / (2.0 * field.spacing)
+    length = numpy.sqrt(nx * nx + ny * ny + 1.0)
+    vertices[:,:,3] = nx / length
+    vertices[:,:,4] = ny / length
+    vertices[:,:,5] = 1.0 / length
+    vertices[:,:,6] = x[None,:] / tex_size
+    vertices[:,:,7] = y[:,None] / tex_size
+    return vertices.reshape(-1, 8)
+
+
+class Terrain(ManagedAsset):
+    """Ground of the world made from a heightfield file (see
+    azure/terrain.py).
+
+    The heightfield is split into square tiles. Tiles near the camera use
+    every sample, each further level of detail uses every second sample of
+    the previous one. Only tiles within view_radius around the camera
+    exist. Their geometry is built in a task chain with its own thread and
+    swapped in when ready, so moving around doesn't stall frames. When the
+    tiles in range would have more vertices than vertex_budget, the
+    farthest tiles get coarser.
+
+    The heightfield also becomes the ground of the default physics world.
+    """
+    def __init__(self, name, resource, texture=None, tile_cells=64,
+                 levels=5, lod_distance=None, view_radius=8000.0,
+                 vertex_budget=300000, skirt=10.0, tex_size=100.0,
+                 physics=True):
+        """Arguments:
+        resource -- heightfield file, searched in the model path
+        texture -- texture repeated over the ground, every tex_size metres
+        tile_cells -- samples per tile side at full detail, power of 2
+        levels -- number of detail levels
+        lod_distance -- distance up to which tiles have full detail, each
+                        further doubling of it drops one level. Defaults
+                        to two tile lengths.
+        view_radius -- tiles further away from the camera are detached
+        vertex_budget -- maximum vertices of all attached tiles
+        skirt -- height of the skirts around each tile in metres
+        physics -- use the terrain as ground of the physics world
+        """
+        ManagedAsset.__init__(self, "terrain")
+        self.name = name
+        self.node = NodePath("terrain")
+
+        f = Filename(resource)
+        if not f.resolveFilename(getModelPath().getValue()):
+            raise ResourceLoadError(resource, "heightfield not found")
+        self.heightfield = Heightfield(f.toOsSpecific())
+
+        if texture is not None:
+            tex = TexturePool.loadTexture(texture)
+            tex.setWrapU(Texture.WMRepeat)
+            tex.setWrapV(Texture.WMRepeat)
+            tex.setMinfilter(Texture.FTLinearMipmapLinear)
+            self.node.setTexture(tex)
+
+        if tile_cells >> (levels - 1) < 1:
+            levels = int(log(tile_cells, 2)) + 1
+        self.tile_cells = tile_cells
+        self.levels = levels
+        self.tile_length = tile_cells * self.heightfield.spacing
+        self.lod_distance = lod_distance or 2 * self.tile_length
+        self.view_radius = view_radius
+        self.vertex_budget = vertex_budget
+        self.skirt = skirt
+        self.tex_size = tex_size
+        self.tiles_x = (self.heightfield.columns - 2) // tile_cells + 1
+        self.tiles_y = (self.heightfield.rows - 2) // tile_cells + 1
+
+        # triangle indices and vertices per tile of each level
+        self.indices = []
+        self.tile_vertices = []
+        for level in range(levels):
+            cells = tile_cells >> level
+            self.indices.append(tileIndices(cells).tobytes())
+            self.tile_vertices.append((cells + 3) ** 2)
+
+        # attached tiles. form: {(x, y): (level, NodePath)}
+        self.tiles = {}
+        # wanted tiles. form: {(x, y): level}
+        self.wanted = {}
+        # tiles being built. form: {(x, y): level}
+        self.building = {}
+        # tiles finished by the builder thread.
+        # form: [((x, y), level, NodePath)]
+        self.built = []
+        self.vertex_count = 0
+        self._last_focus = None
+
+        taskMgr.setupTaskChain(tile_chain, numThreads=1,
+                               threadPriority=TPLow, frameSync=False)
+        self.addTask(self.update, "terrain update", sort=5,
+                     taskChain="world")
+
+        self.physics = physics
+        if physics:
+            Physical.world.terrain = self.heightfield
+
+    def levelAt(self, distance):
+        """Level of detail for tiles at a distance from the camera."""
+        if distance <= self.lod_distance:
+            return 0
+        level = int(log(distance / self.lod_distance, 2)) + 1
+        return min(level, self.levels - 1)
+
+    def _wantedTiles(self, x, y):
+        """Return {(tile x, tile y): level} of all tiles in view range of a
+        point, within the vertex budget."""
+        field = self.heightfield
+        length = self.tile_length
+        cx = (x - field.origin_x) / length
+        cy = (y - field.origin_y) / length
+        reach = self.view_radius / length
+        tiles = []
+        for ty in range(max(int(cy - reach), 0),
+                        min(int(cy + reach) + 1, self.tiles_y)):
+            for tx in range(max(int(cx - reach), 0),
+                            min(int(cx + reach) + 1, self.tiles_x)):
+                # distance to the nearest point of the tile
+                dx = max(tx - cx, 0.0, cx - tx - 1.0)
+                dy = max(ty - cy, 0.0, cy - ty - 1.0)
+                distance = (dx * dx + dy * dy) ** 0.5 * length
+                if distance <= self.view_radius:
+                    tiles.append((distance, (tx, ty),
+                                  self.levelAt(distance)))
+        tiles.sort()
+        levels = [level for distance, key, level in tiles]
+        total = sum(self.tile_vertices[level] for level in levels)
+        # make the farthest tiles coarser until the budget is met
+        i = len(levels) - 1
+        while total > self.vertex_budget and i >= 0:
+            if levels[i] < self.levels - 1:
+                total -= self.tile_vertices[levels[i]]
+                levels[i] += 1
+                total += self.tile_vertices[levels[i]]
+            else:
+                i -= 1
+        return dict((key, level) for (d, key, l), level in zip(tiles, levels))
+
+    def buildTile(self, key, level, task):
+        """Build the geometry of a tile. Runs in the tile builder thread."""
+        cells = self.tile_cells >> level
+        step = 1 << level
+        vertices = tileVertices(self.heightfield, key[0] * self.tile_cells,
+                                key[1] * self.tile_cells, cells, step,
+                                self.skirt, self.tex_size)
+        vdata = GeomVertexData("terrain tile", GeomVertexFormat.getV3n3t2(),
+                               Geom.UHStatic)
+        vdata.uncleanSetNumRows(len(vertices))
+        vdata.modifyArray(0).modifyHandle().setData(vertices.tobytes())
+        triangles = GeomTriangles(Geom.UHStatic)
+        triangles.setIndexType(Geom.NTUint16)
+        triangles.modifyVertices().modifyHandle().setData(self.indices[level])
+        geom = Geom(vdata)
+        geom.addPrimitive(triangles)
+        node = GeomNode("tile {} {} level {}".format(key[0], key[1], level))
+        node.addGeom(geom)
+        self.built.append((key, level, NodePath(node)))
+        return task.done
+
+    def update(self, task):
+        """Request the tiles around the camera and attach finished ones."""
+        pos = base.cam.getPos(render)
+        focus = (int(pos.getX() / (self.tile_length / 4)),
+                 int(pos.getY() / (self.tile_length / 4)))
+        if focus != self._last_focus:
+            self._last_focus = focus
+            self.wanted = self._wantedTiles(pos.getX(), pos.getY())
+            for key in self.tiles.keys():
+                if key not in self.wanted:
+                    self._detach(key)
+            for key, level in self.wanted.items():
+                attached = self.tiles.get(key)
+                if (attached is None or attached[0] != level) and \
+                   self.building.get(key) != level:
+                    self.building[key] = level
+                    self.addTask(self.buildTile, "build terrain tile",
+                                 extraArgs=[key, level], appendTask=True,
+                                 taskChain=tile_chain)
+
+        while self.built:
+            key, level, node = self.built.pop(0)
+            if self.building.get(key) == level:
+                del self.building[key]
+            if self.wanted.get(key) != level:
+                continue
+            self._detach(key)
+            node.reparentTo(self.node)
+            self.tiles[key] = (level, node)
+            self.vertex_count += self.tile_vertices[level]
+        return task.cont
+
+    def _detach(self, key):
+        if key in self.tiles:
+            level, node = self.tiles.pop(key)
+            node.removeNode()
+            self.vertex_count -= self.tile_vertices[level]
+
+    def heightAt(self, x, y):
+        return self.heightfield.heightAt(x, y)
+
+    def destroy(self):
+        # the pending tile builds are tasks of this terrain only
+        self.removeAllTasks()
+        for key in self.tiles.keys():
+            self._detach(key)
+        if self.physics and Physical.world.terrain is self.heightfield:
+            Physical.world.terrain = FlatGround()
+        ManagedAsset.destroy(self)
@@ -1,2 +1,3 @@
-from planeflight import PlaneFlight
+from planeflight import PlaneFlight, FlightPlayback
 from debug import Debug
+from axes import Axis, JoystickAxis, MouseYoke, AnalogInput
@@ -0,0 +1,149 @@
+"""Analog input: joystick and gamepad axes, mouse yoke.
+
+An Axis reads a raw value in range -1.0 - 1.0 from its source and shapes it
+with a dead zone and a response curve. AnalogInput samples a set of axes
+once per physics step (as input hook of the physics world) and sets the
+control surfaces and throttle of a plane from them, so the response of the
+plane doesn't depend on the frame rate.
+
+Joystick and gamepad axes use the InputDevice API of Panda3D 1.10. With
+Panda3D 1.7, which the game is made for, JoystickAxis raises ParamError and
+only the mouse yoke is available.
+
+    stick = JoystickAxis(device, "x")
+    analog = AnalogInput(plane.physics, {"ailerons": Axis(stick, 0.05, 2.0)})
+    analog.activate()
+"""
+
+from math import copysign
+
+from azure.errors import *
+
+try:
+    from panda3d.core import InputDevice
+except ImportError:
+    # input devices came with Panda3D 1.10. Older versions only have the
+    # mouse yoke
+    InputDevice = None
+
+# controls an AnalogInput can set. throttle sets the thrust, -1.0 is idle
+controls = ("ailerons", "elevator", "rudder", "throttle")
+
+
+def setControl(physics, name, value):
+    """Set a control (see controls) of an AeroplanePhysics to an axis
+    value."""
+    if name == "throttle":
+        physics.setThrust((value + 1.0) / 2.0)
+    else:
+        setattr(physics, name, min(max(value, -1.0), 1.0))
+
+
+class Axis(object):
+    """Shapes the values of a source (any function returning -1.0 - 1.0).
+
+    Arguments:
+    source -- function returning the raw value
+    dead_zone -- raw values closer to 0 than this are 0. The rest of the range
+                 is stretched, so the output still starts at 0.
+    exponent -- response curve, 1.0 is linear. Higher values give finer
+                control around the centre.
+    scale -- factor applied last, negative to invert the axis
+    """
+    def __init__(self, source, dead_zone=0.05, exponent=1.0, scale=1.0):
+        if not 0.0 <= dead_zone < 1.0:
+            raise ParamError("dead zone must be in range 0.0 - 1.0")
+        self.source = source
+        self.dead_zone = dead_zone
+        self.exponent = exponent
+        self.scale = scale
+
+    def shape(self, raw):
+        """Return the shaped value of a raw value."""
+        magnitude = min(abs(raw), 1.0)
+        if magnitude <= self.dead_zone:
+            return 0.0
+        magnitude = (magnitude - self.dead_zone) / (1.0 - self.dead_zone)
+        return copysign(magnitude ** self.exponent, raw) * self.scale
+
+    def value(self):
+        return self.shape(self.source())
+
+
+class JoystickAxis(object):
+    """Source reading an axis of an input device (panda3d InputDevice, e.g.
+    from base.devices.getDevices()). axis is the name of the axis, like
+    "x", "y", "left_x" or "throttle". Needs Panda3D 1.10 or newer."""
+    def __init__(self, device, axis):
+        if InputDevice is None:
+            raise ParamError("Joystick axes need Panda3D 1.10 or newer")
+        code = getattr(InputDevice.Axis, axis, None)
+        if code is None or axis.startswith("_"):
+            raise ParamError("Unknown joystick axis: {}".format(axis))
+        # findAxis() asserts on missing axes instead of returning None. The
+        # axes may be enum members or plain ints, depending on the bindings
+        if code not in [state.axis for state in device.axes]:
+            raise ParamError("Device {} has no axis {}".format(device, axis))
+        self.device = device
+        self.axis = device.findAxis(code)
+
+    def __call__(self):
+        return self.axis.value
+
+
+class MouseYoke(object):
+    """Source reading the mouse position, the window centre is 0. axis is
+    "x" (right is positive) or "y" (up is positive)."""
+    def __init__(self, axis, watcher=None):
+        if axis not in ("x", "y"):
+            raise ParamError("Mouse axis must be x or y")
+        self.index = 0 if axis == "x" else 1
+        self.watcher = watcher or base.mouseWatcherNode
+
+    def __call__(self):
+        if not self.watcher.hasMouse():
+            return 0.0
+        return self.watcher.getMouse()[self.index]
+
+
+class AnalogInput(object):
+    """Sets the controls of a plane from axes once per physics step.
+
+    Arguments:
+    physics -- AeroplanePhysics of the plane
+    axes -- dict of control name (see controls): Axis
+    """
+    def __init__(self, physics, axes):
+        for name in axes:
+            if name not in controls:
+                raise ParamError("Unknown analog control: {}".format(name))
+        self.physics = physics
+        self.axes = axes
+        self.active = False
+        # values of the last sample, form: {control name: value}
+        self.values = dict((name, 0.0) for name in axes)
+        # physics step and simulation time of the last sample
+        self.step = None
+        self.time = None
+
+    def sample(self, step_size):
+        """Read all axes and set the controls of the plane. This is the
+        input hook."""
+        world = self.physics.world
+        self.step = world.steps
+        self.time = world.steps * step_size
+        physics = self.physics
+        for name, axis in self.axes.items():
+            value = axis.value()
+            self.values[name] = value
+            setControl(physics, name, value)
+
+    def activate(self):
+        if not self.active:
+            self.physics.world.addInputHook(self.sample)
+            self.active = True
+
+    def deactivate(self):
+        if self.active:
+            self.physics.world.removeInputHook(self.sample)
+            self.active = False
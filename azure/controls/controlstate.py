@@ -5,9 +5,23 @@ from panda3d.core import Filename
 from panda3d.core import ExecutionEnvironment as EE
 from direct.directnotify.DirectNotify import DirectNotify
 
+from inputrecording import InputRecorder
+
 # TODO: declare private attributes and outsource some functions
 class ControlState(DirectObject):
-    """Specific control state classes should inherit from this."""
+    """Specific control state classes should inherit from this.
+
+    keymap binds actions to keys, functionmap calls a function when the key
+    of an action is pressed and holdmap calls a function every frame while
+    it is held (see runHeldActions()).
+
+    activate() compiles the actions into integer ids (index in actions).
+    Held actions are the bits of the integer held, so checking them doesn't
+    depend on the number of bindings.
+
+    States running at the physics rate can record their input of every
+    step, see startRecording().
+    """
     conf_parser = SafeConfigParser()
     f = Filename(EE.expandString("$MAIN_DIR/etc/keybindings.ini"))
     conf_parser.read(f.toOsSpecific())
@@ -24,7 +38,17 @@ class ControlState(DirectObject):
         self.active = False
         self.keymap = {}
         self.functionmap = {}
+        self.holdmap = {}
         self.requested_actions = set()
+        # compiled by compileActions()
+        self.actions = ()
+        self.action_ids = {}
+        self.held = 0
+        self._hold_mask = 0
+        self._hold_table = []
+        # see startRecording()
+        self.input_recorder = None
+        self._recorded_steps = 0
 
     def __repr__(self):
         t = "ControlState: " + self.name
@@ -50,21 +74,81 @@ class ControlState(DirectObject):
             for a in self.keymap:
                 for action, key in keys_from_file:
                     if a == action:
-                        for k in map(str.strip, key.split(',')):
-                            self.keymap[a] = k
+                        keys = map(str.strip, key.split(','))
+                        self.keymap[a] = keys[0] if len(keys) == 1 else keys
         except NoSectionError:
             #notify.warning("".join("Keybindings for section {0} not found. ",
             #                      "Using built-in bindings").format(self.name))
             pass
 
+    def compileActions(self):
+        """Give every action an id and build the table of hold functions.
+        Called by activate()."""
+        self.actions = tuple(sorted(set(self.keymap) | set(self.functionmap)
+                                    | set(self.holdmap)))
+        self.action_ids = dict((a, i) for i, a in enumerate(self.actions))
+        self._hold_table = [self.holdmap.get(a) for a in self.actions]
+        self._hold_mask = 0
+        for i, function in enumerate(self._hold_table):
+            if function is not None:
+                self._hold_mask |= 1 << i
+        self.held = 0
+
+    def press(self, action_id):
+        """Mark an action as held."""
+        self.held |= 1 << action_id
+        self.requested_actions.add(self.actions[action_id])
+
+    def release(self, action_id):
+        self.held &= ~(1 << action_id)
+        self.requested_actions.discard(self.actions[action_id])
+
+    def isHeld(self, action):
+        """Return True if the action of a name is held."""
+        return bool(self.held >> self.action_ids[action] & 1)
+
+    def runHeldActions(self):
+        """Call the hold functions of all held actions, lowest id first."""
+        mask = self.held & self._hold_mask
+        table = self._hold_table
+        while mask:
+            low = mask & -mask
+            table[low.bit_length() - 1]()
+            mask ^= low
+
+    def startRecording(self, filename, analog=()):
+        """Record the held actions and the values of the analog controls
+        named in analog to a file, see controls/inputrecording.py. The state
+        calls recordInput() once per physics step. Only works while the
+        state is active."""
+        self.stopRecording()
+        self.input_recorder = InputRecorder(filename, self.actions, analog)
+        self._recorded_steps = 0
+
+    def recordInput(self, values=()):
+        """Record the input of one physics step, if recording."""
+        if self.input_recorder is not None:
+            self.input_recorder.record(self._recorded_steps, self.held,
+                                       values)
+            self._recorded_steps += 1
+
+    def stopRecording(self):
+        if self.input_recorder is not None:
+            self.input_recorder.close()
+            self.input_recorder = None
+
     def activate(self):
         if self.active is True:
             return False
         #notify.info("Activating %s" % self.name)
 
+        self.loadKeybindings()
+        self.compileActions()
+
         def assignKey(key, action):
-            self.accept(key, self.requested_actions.add, [action])
-            self.accept(key+"-up", self.requested_actions.discard, [action])
+            action_id = self.action_ids[action]
+            self.accept(key, self.press, [action_id])
+            self.accept(key+"-up", self.release, [action_id])
             if action in self.functionmap:
                 self.accept(key, self.functionmap[action])
 
@@ -75,8 +159,6 @@ class ControlState(DirectObject):
                 for k in key:
                     assignKey(k, action)
 
-        self.loadKeybindings()
-
         for task in self.tasks:
             if callable(task):
                 self.addTask(task, task.__name__, taskChain="world")
@@ -91,7 +173,9 @@ class ControlState(DirectObject):
             return False
         #notify.info("Deactivating %s" % self.name)
         self.ignoreAll()
+        self.stopRecording()
         self.requested_actions.clear()
+        self.held = 0
         #for task in self.tasks:
         #    self.removeTask(task)
         #self.removeAllTasks()
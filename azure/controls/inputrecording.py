@@ -0,0 +1,105 @@
+"""Recording of the input of a control state, one entry per physics step.
+
+File layout (little endian): magic "AZIR", version, number of actions,
+number of analog controls, length of the names; the action names and the
+analog control names, each comma separated, with ";" between them; then the
+records. A record is the
+physics step (counted from the start of the recording), the held actions as
+bitmask (bit i is action i) and the analog values as doubles. A record is only
+written when the input changed, and once more for the last step, so the input
+of a step is the one of the last record before it.
+"""
+
+import struct
+from bisect import bisect_right
+
+from azure.errors import *
+
+magic = "AZIR"
+version = 1
+_header = struct.Struct("<4sHHHI")
+_entry = struct.Struct("<IQ")
+
+
+class InputRecorder(object):
+    """Writes the input of a control state to a file.
+
+    Arguments:
+    filename -- file to write
+    actions -- names of the actions, in the order of their bits
+    analog -- names of the analog controls
+    """
+    def __init__(self, filename, actions, analog=()):
+        if len(actions) > 64:
+            raise ParamError("Can't record more than 64 actions")
+        self.file = open(filename, "wb")
+        names = ",".join(actions) + ";" + ",".join(analog)
+        self.file.write(_header.pack(magic, version, len(actions),
+                                     len(analog), len(names)))
+        self.file.write(names)
+        self.values = struct.Struct("<{}d".format(len(analog)))
+        self.last = None
+        self.last_step = None
+
+    def record(self, step, held, values=()):
+        """Record the input of a physics step. Steps must not decrease."""
+        entry = (held, tuple(values))
+        if entry != self.last:
+            self._write(step, held, values)
+            self.last = entry
+        self.last_step = step
+
+    def _write(self, step, held, values):
+        self.file.write(_entry.pack(step, held))
+        self.file.write(self.values.pack(*values))
+
+    def close(self):
+        """Write the last step and close the file."""
+        if self.last is not None:
+            self._write(self.last_step, *self.last)
+        self.file.close()
+
+
+class InputPlayback(object):
+    """Reads an input recording.
+
+    Attributes:
+    actions -- names of the recorded actions, in the order of their bits
+    analog -- names of the recorded analog controls
+    duration -- number of recorded steps
+    """
+    def __init__(self, filename):
+        try:
+            with open(filename, "rb") as f:
+                data = f.read()
+            tag, file_version, action_count, analog_count, names_length = \
+                    _header.unpack_from(data)
+        except (IOError, struct.error):
+            raise ResourceLoadError(filename, "can't read input recording")
+        if tag != magic or file_version != version:
+            raise ResourceLoadError(filename, "not an input recording")
+        offset = _header.size
+        actions, analog = data[offset:offset+names_length].split(";")
+        self.actions = tuple(actions.split(",")) if action_count else ()
+        self.analog = tuple(analog.split(",")) if analog_count else ()
+        offset += names_length
+
+        values = struct.Struct("<{}d".format(analog_count))
+        size = _entry.size + values.size
+        # form: steps [step], inputs [(held, values)]
+        self.steps = []
+        self.inputs = []
+        while offset + size <= len(data):
+            step, held = _entry.unpack_from(data, offset)
+            self.steps.append(step)
+            self.inputs.append((held, values.unpack_from(data,
+                                offset + _entry.size)))
+            offset += size
+        self.duration = self.steps[-1] + 1 if self.steps else 0
+
+    def at(self, step):
+        """Return held actions (bitmask) and analog values of a step."""
+        i = bisect_right(self.steps, step) - 1
+        if i < 0:
+            return 0, (0.0,) * len(self.analog)
+        return self.inputs[i]
@@ -1,9 +1,21 @@
+from functools import partial
+
 from direct.task import Task
 from controlstate import ControlState
+from axes import AnalogInput, setControl
+from inputrecording import InputPlayback
 
 class PlaneFlight(ControlState):
-    """A control state for flying a plane."""
-    def __init__(self, plane, view):
+    """A control state for flying a plane.
+
+    Keys and analog axes are read once per physics step, see
+    PhysicsWorld.addInputHook(). Held keys override the axes.
+    """
+    def __init__(self, plane, view, axes=None):
+        """Arguments:
+        axes -- dict of control name: Axis for analog control, see
+                controls/axes.py
+        """
         ControlState.__init__(self)
         self.keymap = {"move.roll-left":        "a",
                        "move.roll-right":       "d",
@@ -38,19 +50,76 @@ class PlaneFlight(ControlState):
                            }
 
         #self.tasks = (self.flightControl, self.updateHUD)
-        self.tasks = (self.flightControl,)
+        self.tasks = ()
         self.plane = plane
         self.plane_camera = view
+        self.axes = axes or {}
+        self.analog = None
+        self.world = None
+        # the physics the actions are bound to
+        self.physics = None
 
-    def flightControl(self, task):
-        """Move the plane acording to pressed keys."""
-        for action in self.requested_actions:
-            a = action.split(".")[0]
-            if a == "move":
-                self.plane.physics.move(action.split(".")[1])
-            elif a == "thrust":
-                self.plane.physics.chThrust(action.split(".")[1])
-        return Task.cont
+    def compileActions(self):
+        """Bind the move and thrust actions and the axes to the physics of
+        the plane."""
+        self.holdmap = {}
+        self.analog = None
+        physics = self.plane.physics
+        if physics is not None:
+            for action in self.keymap:
+                kind, argument = action.split(".")
+                if kind == "move" and argument in physics.movements:
+                    self.holdmap[action] = physics.movements[argument]
+                elif kind == "thrust":
+                    self.holdmap[action] = partial(physics.chThrust, argument)
+            if self.axes:
+                self.analog = AnalogInput(physics, self.axes)
+        self.physics = physics
+        ControlState.compileActions(self)
+
+    def checkPhysics(self):
+        """Bind the actions again if the plane got new physics (or lost
+        them) since activate(), so the old ones aren't flown any more.
+        Return the current physics."""
+        if self.plane.physics is not self.physics:
+            held = self.held
+            self.compileActions()
+            self.held = held
+        return self.physics
+
+    def activate(self):
+        if ControlState.activate(self) is False:
+            return False
+        if self.physics is not None:
+            self.world = self.physics.world
+            self.world.addInputHook(self.flightControl)
+
+    def deactivate(self):
+        if ControlState.deactivate(self) is False:
+            return False
+        if self.world is not None:
+            self.world.removeInputHook(self.flightControl)
+            self.world = None
+        self.analog = None
+        self.physics = None
+
+    def startRecording(self, filename):
+        """Record keys and axes of every physics step to a file, to fly the
+        same flight again with FlightPlayback."""
+        ControlState.startRecording(self, filename, sorted(self.axes))
+
+    def flightControl(self, step_size):
+        """Move the plane acording to the axes and pressed keys. This is an
+        input hook of the physics world."""
+        self.checkPhysics()
+        if self.analog is not None:
+            self.analog.sample(step_size)
+            if self.input_recorder is not None:
+                self.recordInput([self.analog.values[name] for name in
+                                  sorted(self.axes)])
+        else:
+            self.recordInput()
+        self.runHeldActions()
 
     # Function leaky! Slows down things at pause+resume
     def updateHUD(self, task):
@@ -71,3 +140,42 @@ class PlaneFlight(ControlState):
     #            actions_done.add(action)
     #    self.requested_actions -= actions_done
     #    return Task.cont
+
+
+class FlightPlayback(PlaneFlight):
+    """Flies a plane with the input recorded by PlaneFlight.startRecording(),
+    one recorded step per physics step. Started from the same state, the
+    flight is the same as the recorded one. Camera keys still work."""
+    def __init__(self, plane, view, filename):
+        PlaneFlight.__init__(self, plane, view)
+        self.playback = InputPlayback(filename)
+        self.step = 0
+
+    def compileActions(self):
+        PlaneFlight.compileActions(self)
+        # bits of the recording and the bits of the same actions here
+        self._bits = [(1 << i, 1 << self.action_ids[name]) for i, name in
+                      enumerate(self.playback.actions)
+                      if name in self.action_ids]
+
+    def finished(self):
+        return self.step >= self.playback.duration
+
+    def flightControl(self, step_size):
+        """Set held actions and analog controls of the next recorded step.
+        This is an input hook of the physics world."""
+        if self.finished():
+            self.held = 0
+            return
+        recorded, values = self.playback.at(self.step)
+        self.step += 1
+        held = 0
+        for bit, own_bit in self._bits:
+            if recorded & bit:
+                held |= own_bit
+        self.held = held
+        physics = self.checkPhysics()
+        if physics is not None:
+            for name, value in zip(self.playback.analog, values):
+                setControl(physics, name, value)
+        self.runHeldActions()
@@ -1,8 +1,6 @@
 """Azure's core FSM."""
 
 from direct.fsm.FSM import FSM
-from direct.gui.OnscreenText import OnscreenText
-from pandac.PandaModules import TextNode
 
 from preloader import scenarioPreloader
 #from menuproxy import MenuProxy
@@ -25,20 +23,17 @@ class Core(FSM):
         base.taskMgr.setupTaskChain("scenario", frameBudget=-1)
 
     def enterLoading(self, scenario):
-        # TODO: put this into gui package and add a black background
-        self.loading = OnscreenText(text="LOADING", pos=(0,0), scale=0.1,
-                               align=TextNode.ACenter, fg=(1,1,1,1))
+        import gui
         self.preloader = scenarioPreloader(scenario)
-        base.graphicsEngine.renderFrame()
-        base.graphicsEngine.renderFrame()
-        self.preloader.preloadFast()  # depends on the loading screen
-        # Other preloader methods would specify a callback that calls
-        # self.demand(scenario), but preloadFast() is executed in one frame, so
-        # we can safely demand that from here. Interactive loading screens
-        # might require special handling.
-        self.demand("Scenario", scenario)
+        self.loading = gui.LoadingScreen(lambda: self.preloader.progressFloat)
+        # The assets are loaded on the loader threads while the loading screen
+        # keeps rendering. The callback comes from the event handler once the
+        # last asset is in, or right away if there is nothing to load.
+        self.preloader.preloadBackgroundResponsive(
+                callback=lambda: self.demand("Scenario", scenario))
 
     def exitLoading(self):
+        self.preloader.cancel()
         self.loading.destroy()
         del self.loading
         del self.preloader
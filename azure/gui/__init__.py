@@ -1,4 +1,5 @@
 from indicator import Indicator
+from loadingscreen import LoadingScreen
 from mainmenu import MainMenu
 from osdebug import OSDebug
 from pausemenu import PauseMenu
@@ -0,0 +1,33 @@
+from pandac.PandaModules import TextNode
+from direct.gui.DirectGui import *
+from direct.showbase.DirectObject import DirectObject
+
+
+class LoadingScreen(DirectObject):
+    """Black screen with a progress bar that is redrawn every frame, so the
+    window stays responsive while assets are loaded in the background."""
+    def __init__(self, progress):
+        """Arguments:
+        progress -- a function returning the progress in range 0.0 - 1.0,
+                    e.g. Preloader.progressFloat
+        """
+        self.progress = progress
+        self.background = DirectFrame(frameColor=(0,0,0,1),
+                                      frameSize=(-1,1,-1,1),
+                                      parent=render2d)
+        self.text = OnscreenText(text="LOADING", pos=(0,0.1), scale=0.1,
+                                 align=TextNode.ACenter, fg=(1,1,1,1))
+        self.bar = DirectWaitBar(range=1.0, value=0.0, pos=(0,0,-0.1),
+                                 scale=(0.8,1,0.5), barColor=(1,1,1,1),
+                                 frameColor=(0.2,0.2,0.2,1))
+        self.addTask(self.update, "update loading screen", sort=-10)
+
+    def update(self, task):
+        self.bar["value"] = self.progress()
+        return task.cont
+
+    def destroy(self):
+        self.removeAllTasks()
+        self.bar.destroy()
+        self.text.destroy()
+        self.background.destroy()
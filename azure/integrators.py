@@ -0,0 +1,258 @@
+"""Rigid body integrators for the aeroplane batch (see physics.py).
+
+An integrator moves the planes of the full flight model through one step,
+given their forces and torques. The batch arrays hold the state of all
+planes; an integrator may keep a copy of it elsewhere (e.g. in ODE bodies),
+which it updates with writeBody() and reads back with readBodies().
+
+OdeIntegrator -- an ODE body per plane, stepped with quickStep()
+SemiImplicitIntegrator -- semi-implicit Euler directly on the batch arrays
+
+Both do the same integration (velocities first, then positions with the new
+velocities), so they fly the same trajectories up to rounding. ODE has to be
+fed and read plane by plane, which costs a few microseconds per plane; the
+NumPy integrator has a fixed overhead per step instead. See
+benchmarks/integrators.py for the break-even point.
+"""
+
+import numpy
+
+from pandac.PandaModules import OdeWorld, OdeBody, OdeMass, Quat
+
+from errors import *
+
+
+def _quatProduct():
+    """Return the constant (4, 4, 3) tensor that turns a quaternion q and an
+    angular velocity w into the product (0, w) * q, which is twice the time
+    derivative of q."""
+    t = numpy.zeros((4, 4, 3))
+    w, x, y, z = range(4)
+    t[0, x, 0] = t[0, y, 1] = t[0, z, 2] = -1.0
+    t[1, w, 0] = t[1, z, 1] = 1.0
+    t[1, y, 2] = -1.0
+    t[2, w, 1] = t[2, x, 2] = 1.0
+    t[2, z, 0] = -1.0
+    t[3, w, 2] = t[3, y, 0] = 1.0
+    t[3, x, 1] = -1.0
+    return t
+
+quat_product = _quatProduct()
+
+
+def integrateQuats(quat, angular_velocity, step_size, dq=None, norm=None):
+    """Turn the (n, 4) array of unit quaternions quat in place by the (n, 3)
+    array of angular velocities (world axes) for step_size seconds.
+    step_size may also be a column (n, 1) of step sizes. dq (n, 4) and norm
+    (n,) are buffers for the temporaries; without them every call
+    allocates its own."""
+    if dq is None:
+        dq = numpy.empty(quat.shape)
+    if norm is None:
+        norm = numpy.empty(len(quat))
+    numpy.einsum("abc,nb,nc->na", quat_product, quat, angular_velocity,
+                 out=dq)
+    dq *= step_size
+    dq *= 0.5
+    quat += dq
+    numpy.einsum("ij,ij->i", quat, quat, out=norm)
+    numpy.sqrt(norm, out=norm)
+    quat /= norm[:,None]
+
+
+class OdeIntegrator(object):
+    """Each plane gets an OdeBody (plane.ode_body), planes that are not in
+    the full model have their body disabled. All bodies are stepped by the
+    same step size, so there are no adaptive substeps."""
+    adaptive = False
+    # the state is kept in bodies too, see sync()
+    bodies = True
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.ode_world = OdeWorld()
+        self.ode_world.setGravity(0, 0, 0)
+
+    def addBody(self, plane):
+        """Create the body of a newly registered plane from its row."""
+        plane.ode_body = OdeBody(self.ode_world)
+        mass = OdeMass()
+        mass.setBox(plane.spec.mass, 1, 1, 1)
+        plane.ode_body.setMass(mass)
+        self.writeBody(plane.index)
+
+    def removeBody(self, plane):
+        plane.ode_body.destroy()
+        plane.ode_body = None
+
+    def writeBody(self, i):
+        """Copy the state of row i into its body."""
+        b = self.batch
+        body = b.planes[i].ode_body
+        body.setPosition(*b.position[i].tolist())
+        body.setQuaternion(Quat(*b.quat[i].tolist()))
+        body.setLinearVel(*b.velocity[i].tolist())
+        body.setAngularVel(*b.angular_velocity[i].tolist())
+
+    def enable(self, i):
+        """Row i enters the full model."""
+        self.writeBody(i)
+        self.batch.planes[i].ode_body.enable()
+
+    def disable(self, i):
+        """Row i leaves the full model."""
+        self.batch.planes[i].ode_body.disable()
+
+    def sync(self, n, rows=None):
+        """Write the first n rows into their bodies and enable them, disable
+        the bodies of all other rows. Used after the whole state changed.
+        rows limits this to the rows that changed, the bodies of all other
+        rows are known to be up to date."""
+        planes = self.batch.planes
+        if rows is None:
+            rows = range(len(planes))
+        for i in rows:
+            body = planes[i].ode_body
+            if i < n:
+                self.writeBody(i)
+                if not body.isEnabled():
+                    body.enable()
+            elif body.isEnabled():
+                body.disable()
+
+    def applyForces(self, n, force, torque, rotation):
+        """Apply force (world axes) and torque (about the right, forward and
+        up axis of the plane) to the first n rows. rotation holds the
+        rotation matrices of the planes."""
+        for plane, f, t in zip(self.batch.planes, force.tolist(),
+                               torque.tolist()):
+            plane.ode_body.addForce(*f)
+            plane.ode_body.addRelTorque(*t)
+
+    def step(self, step_size):
+        self.ode_world.quickStep(step_size)
+
+    def readBodies(self, n):
+        """Copy position, orientation and velocities of the first n rows
+        from their bodies."""
+        b = self.batch
+        position = b.position
+        quat = b.quat
+        velocity = b.velocity
+        angular_velocity = b.angular_velocity
+        # element-wise stores are a lot faster than letting numpy convert
+        # the Panda vectors as sequences
+        for i, plane in enumerate(b.planes[:n]):
+            body = plane.ode_body
+            v = body.getPosition()
+            position[i,0] = v[0]; position[i,1] = v[1]; position[i,2] = v[2]
+            q = body.getQuaternion()
+            quat[i,0] = q[0]; quat[i,1] = q[1]; quat[i,2] = q[2]
+            quat[i,3] = q[3]
+            v = body.getLinearVel()
+            velocity[i,0] = v[0]; velocity[i,1] = v[1]; velocity[i,2] = v[2]
+            v = body.getAngularVel()
+            angular_velocity[i,0] = v[0]; angular_velocity[i,1] = v[1]
+            angular_velocity[i,2] = v[2]
+
+
+class SemiImplicitIntegrator(object):
+    """Semi-implicit Euler on the batch arrays, no per-plane calls at all.
+    Planes are boxes of 1 x 1 x 1 metres like their ODE bodies, so their
+    moment of inertia is the same about every axis (mass / 6) and there is
+    no gyroscopic torque.
+
+    Each plane can be moved with a step size of its own, see advance().
+    """
+    adaptive = True
+    bodies = False
+
+    def __init__(self, batch):
+        self.batch = batch
+        # number of rows whose forces were applied, but that didn't move yet
+        self.pending = 0
+        self.acceleration = numpy.zeros((0, 3))
+        self._reserve(1)
+
+    def _reserve(self, n):
+        """Make the buffers hold at least n rows. They grow with the batch
+        and are reused, so a step allocates no arrays."""
+        if n <= len(self.acceleration):
+            return
+        capacity = max(n, 2 * len(self.acceleration))
+        self.acceleration = numpy.zeros((capacity, 3))
+        self.angular_acceleration = numpy.zeros((capacity, 3))
+        self._scratch = numpy.zeros((capacity, 3))
+        self._dq = numpy.zeros((capacity, 4))
+        self._norm = numpy.zeros(capacity)
+
+    def addBody(self, plane):
+        pass
+
+    def removeBody(self, plane):
+        pass
+
+    def writeBody(self, i):
+        pass
+
+    def enable(self, i):
+        pass
+
+    def disable(self, i):
+        pass
+
+    def sync(self, n, rows=None):
+        pass
+
+    def applyForces(self, n, force, torque, rotation):
+        self._reserve(n)
+        mass = self.batch.mass[:n,None]
+        numpy.divide(force, mass, out=self.acceleration[:n])
+        angular = self.angular_acceleration[:n]
+        numpy.einsum("nij,nj->ni", rotation, torque, out=angular)
+        angular *= 6.0
+        angular /= mass
+        self.pending = n
+
+    def step(self, step_size):
+        if self.pending:
+            self._integrate(step_size)
+
+    def advance(self, n, force, torque, rotation, step_sizes):
+        """Apply forces like applyForces() and move the first n rows right
+        away, each by its own step size from the array step_sizes. Rows with
+        a step size of 0 stay where they are."""
+        self.applyForces(n, force, torque, rotation)
+        self._integrate(step_sizes[:,None])
+
+    def _integrate(self, step_size):
+        n = self.pending
+        b = self.batch
+        scratch = self._scratch[:n]
+        velocity = b.velocity[:n]
+        angular_velocity = b.angular_velocity[:n]
+        numpy.multiply(self.acceleration[:n], step_size, out=scratch)
+        velocity += scratch
+        numpy.multiply(self.angular_acceleration[:n], step_size, out=scratch)
+        angular_velocity += scratch
+        numpy.multiply(velocity, step_size, out=scratch)
+        b.position[:n] += scratch
+        integrateQuats(b.quat[:n], angular_velocity, step_size,
+                       self._dq[:n], self._norm[:n])
+        self.pending = 0
+
+    def readBodies(self, n):
+        pass
+
+
+# form: {name: integrator class}, see azure-physics-integrator
+integrators = {"ode": OdeIntegrator,
+               "semi-implicit": SemiImplicitIntegrator}
+
+
+def getIntegrator(name):
+    """Return the integrator class of a name."""
+    try:
+        return integrators[name]
+    except KeyError:
+        raise ParamError("Unknown physics integrator: {}".format(name))
@@ -24,6 +24,7 @@ class ControlManager(object):
     def addAndActivate(self, control, *args, **kwargs):
         c = self.add(control, *args, **kwargs)
         c.activate()
+        return c
 
     def disable(self, id):
         self.controlstates[id].disable()
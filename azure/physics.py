@@ -4,421 +4,1497 @@ aircrafts."""
 import sys
 import os
 from math import cos, sin, radians, atan2, sqrt, pi, copysign, acos, asin, isnan
-import ConfigParser
+from collections import namedtuple
+import numpy
 
+# Only core modules here, the physics must run without ShowBase (headless).
 from pandac.PandaModules import ClockObject
-from pandac.PandaModules import OdeBody, OdeMass, Quat, OdeWorld
-from direct.showbase.ShowBase import Plane, Vec3
-from direct.actor.Actor import Actor
-from direct.task import Task
+from pandac.PandaModules import ConfigVariableInt, ConfigVariableString
+from pandac.PandaModules import ConfigVariableDouble
+from pandac.PandaModules import Quat, Point3, Vec3
 
 from errors import *
-from utils import ListInterpolator
+from specs import getSpec
+from terrain import FlatGround
+from integrators import getIntegrator, integrateQuats
 
-#specs = ConfigParser.SafeConfigParser()
-#specs.read(os.path.abspath(os.path.join(sys.path[0], "etc/CraftSpecs.cfg")))
 global_clock = ClockObject.getGlobalClock()
 
+# What to do with simulation time that doesn't fit into the maximum number of
+# steps per frame.
+# DISCARD - throw the time away, the simulation jumps over it
+# SLOW_MOTION - don't even accumulate it, the simulation runs slower
+# CARRY - keep it and catch up in the next frames
+DISCARD, SLOW_MOTION, CARRY = "discard", "slow-motion", "carry"
+# fraction of a step the accumulator may lack and still do the step
+step_tolerance = 1e-9
 
-class Physical(object):
-    world = OdeWorld()
-    world.setGravity(0,0,0)
+max_substeps_config = ConfigVariableInt("azure-physics-max-substeps", 5)
+overflow_config = ConfigVariableString("azure-physics-overflow", DISCARD)
+# integrator of the planes, see integrators.py
+integrator_config = ConfigVariableString("azure-physics-integrator", "ode")
 
-    def __init__(self):
-        self.world = Physical.world
+# Fidelity tiers of aeroplanes, see AeroplaneBatch.setTiers()
+# FULL - full aerodynamic model and ODE body, every step
+# POINT_MASS - thrust, drag, lift and gravity on a point mass, every
+#              point_mass_rate steps
+# DEAD_RECKONING - constant velocity and angular velocity
+# SLEEPING - not moved at all, see AeroplaneBatch.checkSleep()
+FULL, POINT_MASS, DEAD_RECKONING, SLEEPING = range(4)
+tier_names = ("full", "point mass", "dead reckoning", "sleeping")
+point_mass_rate_config = ConfigVariableInt("azure-physics-point-mass-rate", 5)
 
+# Planes fall asleep after sleep_time seconds below these speeds without
+# thrust and control input. Checked every sleep_check_rate steps.
+sleep_speed_config = ConfigVariableDouble("azure-physics-sleep-speed", 0.1)
+sleep_rotation_config = ConfigVariableDouble("azure-physics-sleep-rotation",
+                                             0.05)
+sleep_time_config = ConfigVariableDouble("azure-physics-sleep-time", 1.0)
+sleep_check_rate = 10
 
-class AeroplanePhysics(Physical):
-    def __init__(self, node):
+# change of thrust per second while the thrust keys are held
+thrust_rate_config = ConfigVariableDouble("azure-thrust-rate", 0.5)
 
-        Physical.__init__(self)
+# Adaptive substeps: each step, every plane with the full model is moved in
+# as many substeps as it needs to fly no more than substep-distance metres,
+# turn no more than substep-angle radians and change its velocity by no more
+# than substep-velocity m/s per substep, but in max-plane-substeps at most.
+# 1 turns them off. Needs an integrator that supports them.
+max_plane_substeps_config = ConfigVariableInt(
+        "azure-physics-max-plane-substeps", 1)
+substep_distance_config = ConfigVariableDouble(
+        "azure-physics-substep-distance", 5.0)
+substep_angle_config = ConfigVariableDouble("azure-physics-substep-angle",
+                                            0.05)
+substep_velocity_config = ConfigVariableDouble(
+        "azure-physics-substep-velocity", 0.5)
 
-        self.node = node
-        self.thrust = 0.0
-        self.loadSpecs()
 
-        # precalculated values for combinations of variables
-        self.setCalculationConstants()
+class PhysicsWorld(object):
+    """Owns the ODE world and steps it with a fixed step size, once per step
+    no matter how many bodies live in it.
 
-        # dynamic variables
-        self.acceleration = Vec3(0.0,0.0,0.0)
-        self.angle_of_attack = 0.0
-        
-        # state variables
-        self.rudder = 0.0
-        self.ailerons = 0.0
-        self.elevator = 0.0
-        
-        
-        self.ode_body = OdeBody(self.world)
-        # positions and orientation are set relative to render
-        self.ode_body.setPosition(self.node.getPos(render))
-        self.ode_body.setQuaternion(self.node.getQuat(render))
-        
-        self.ode_mass = OdeMass()
-        self.ode_mass.setBox(self.mass, 1, 1, 1)
-        self.ode_body.setMass(self.ode_mass)
-        
+    Bodies never step the world themselves. They register a force hook which
+    is called with the step size right before each world step and adds their
+    forces to the ODE bodies. Input hooks are called before the force hooks,
+    so controls are sampled once per step, no matter the frame rate. Step
+    hooks are called right after each world step and typically read back
+    the new state of the bodies.
+
+    Update hooks are called once per frame with the fraction of a step that
+    is left in the accumulator (0.0 - 1.0). Bodies keep their last two states
+    and blend between them by that fraction when moving their nodes, so
+    motion stays smooth at frame rates above the physics rate.
+
+    No more than max_substeps steps are done per frame, so a long frame
+    (e.g. after loading) doesn't make the next frames even longer. The
+    overflow policy decides what happens to the time that is left over. The
+    total simulation time that was dropped is counted in dropped_time.
+
+    A headless world never uses the task manager or the scene graph. It is
+    stepped from a plain loop with step() or simulate(), as fast as the CPU
+    allows, and works without ShowBase or a window:
+
+        world = PhysicsWorld(headless=True)
+        plane = AeroplanePhysics(None, "griffin", world)
+        world.simulate(60.0)
+
+    The ground is given by the terrain of the world, see terrain.py. Bodies
+    below it are put back on it.
+
+    The bodies of the planes are moved by the integrator of the world, see
+    integrators.py. With adaptive substeps, planes in violent manoeuvres are
+    moved in several smaller substeps within a step, calm ones in one, see
+    AeroplaneBatch.substepCounts(). Steps and hooks keep the fixed rate, so
+    the step size can be raised for calm flight without losing accuracy
+    where it matters.
+    """
+    def __init__(self, step_size=0.02, max_substeps=None, overflow=None,
+                 headless=False, terrain=None, integrator=None,
+                 max_plane_substeps=None):
+        """Arguments:
+        step_size -- simulated seconds per step
+        max_substeps -- maximum steps per frame, 0 for no limit. Defaults to
+                        azure-physics-max-substeps.
+        overflow -- DISCARD, SLOW_MOTION or CARRY. Defaults to
+                    azure-physics-overflow.
+        headless -- if True, no task is started. Step the world yourself.
+        terrain -- FlatGround or Heightfield. Defaults to flat ground at
+                   height 0.
+        integrator -- name of the integrator, "ode" or "semi-implicit".
+                      Defaults to azure-physics-integrator.
+        max_plane_substeps -- maximum adaptive substeps of a plane per step,
+                              1 for none. Defaults to
+                              azure-physics-max-plane-substeps.
+        """
+        self.step_size = step_size
         self.accumulator = 0.0
-        self.step_size = 0.02
-        taskMgr.add(self.simulationTask,
-                    "plane physics",
-                    sort=-1,
-                    taskChain="world")
-
-    def loadSpecs(self):
-        """Loads specifications for a plane. Force if already loaded."""
-
-        # TODO (gjmm): these are specifications and should be moved to a file
-
-        self.mass = 1000
-        self.max_thrust = 5000.0
-
-        self.wing_area = 48.0 # m^2
-        self.wing_span = 24.0 # m
-
-        self.drag_coef_x = 0.9
-        self.drag_coef_y = 0.1
-        self.drag_coef_z = 0.9
-        self.drag_area_x = 30.0
-        self.drag_area_y = 2.75
-        self.drag_area_z = 50.0
-        self.aspect_ratio = self.wing_span * self.wing_span /self.wing_area
-
-        # What the hell is this?! I still don't get it... :-(
-        # Does this need to be individual per plane?
-        # -Nemesis13
-        self.liftvsaoa = ListInterpolator([[radians(-10.0),-0.4],
-                                           [radians(-8.0),-0.45],
-                                           [radians(15.0),1.75],
-                                           [radians(18.0),1.05]],
-                                           0.0,0.0)
-        self.dragvsaoa = ListInterpolator([[radians(-10.0),-0.010],
-                                           [radians(0.0),0.006],
-                                           [radians(4.0),0.005],
-                                           [radians(8.0),0.0065],
-                                           [radians(12.0),0.012],
-                                           [radians(14.0),0.020],
-                                           [radians(16.0),0.028]],
-                                           0.03,0.1)
-
-        self.yaw_damping = -100
-        self.pitch_damping = -100
-        self.roll_damping = -100
-        
-        self.terminal_yaw = 3
-        self.terminal_pitch = 3
-        self.terminal_roll = 3
-        
-        self.rudder_coefficient = 1.0
-        self.elevator_coefficient = 4.5
-        self.ailerons_coefficient = 5.5
-        
-        self.pitch_force_coefficient = 4.0
-        self.heading_force_coefficient = 1.0
-        self.pitch_torque_coefficient = 0.1
-        self.heading_torque_coefficient = 12.0
-    
-    def move(self, movement):
-        """Plane movement management."""
-        if movement == "roll-left":
-            self.ailerons = -1.0
-        elif movement == "roll-right":
-            self.ailerons = 1.0
-        elif movement == "pitch-up":
-            self.elevator = 1.0
-        elif movement == "pitch-down":
-            self.elevator = -1.0
-        elif movement == "heading-left":
-            self.rudder = 1.0
-        elif movement == "heading-right":
-            self.rudder = -1.0
-
-    def chThrust(self, value):
-        delta_time = global_clock.getDt()
-        if value == "add" and self.thrust < 1.0:
-            self.thrust += 0.01
-        elif value == "subtract" and self.thrust > 0.0:
-            self.thrust -= 0.01
+        self.headless = headless
+        self.terrain = terrain or FlatGround()
+        # number of steps done since creation
+        self.steps = 0
 
-    def setThrust(self, value):
-        if value <= 0:
-            self.thrust = 0
-        elif value >= 1:
-            self.thrust = 1
+        if max_substeps is None:
+            max_substeps = max_substeps_config.getValue()
+        self.max_substeps = max_substeps
+        self.setOverflow(overflow or overflow_config.getValue())
+        # simulation time in seconds that was not simulated
+        self.dropped_time = 0.0
+        self.input_hooks = []
+        self.force_hooks = []
+        self.step_hooks = []
+        self.update_hooks = []
+        self.task = None
+
+        # all physical aeroplanes of this world
+        self.aeroplanes = AeroplaneBatch(self)
+        self.integrator = getIntegrator(integrator or
+                integrator_config.getValue())(self.aeroplanes)
+        if max_plane_substeps is not None:
+            self.aeroplanes.max_plane_substeps = max_plane_substeps
+        if self.aeroplanes.max_plane_substeps > 1 and \
+           not self.integrator.adaptive:
+            raise ParamError("Adaptive substeps need an integrator that "
+                             "supports them, like semi-implicit.")
+
+    def addInputHook(self, hook):
+        """Register a function hook(step_size) that sets the controls of
+        bodies before each step, before the force hooks."""
+        self.input_hooks.append(hook)
+        self._updateTask()
+
+    def removeInputHook(self, hook):
+        self.input_hooks.remove(hook)
+        self._updateTask()
+
+    def addForceHook(self, hook):
+        """Register a function hook(step_size) that applies forces before
+        each step."""
+        self.force_hooks.append(hook)
+        self._updateTask()
+
+    def removeForceHook(self, hook):
+        self.force_hooks.remove(hook)
+        self._updateTask()
+
+    def addStepHook(self, hook):
+        """Register a function hook(step_size) that is called after each
+        step."""
+        self.step_hooks.append(hook)
+        self._updateTask()
+
+    def removeStepHook(self, hook):
+        self.step_hooks.remove(hook)
+        self._updateTask()
+
+    def addUpdateHook(self, hook):
+        """Register a function hook(alpha) that is called once per frame.
+        alpha is the fraction of a step left in the accumulator."""
+        self.update_hooks.append(hook)
+        self._updateTask()
+
+    def removeUpdateHook(self, hook):
+        self.update_hooks.remove(hook)
+        self._updateTask()
+
+    def _updateTask(self):
+        """Run the simulation task only while there are hooks."""
+        if self.headless:
+            return
+        if self.input_hooks or self.force_hooks or self.step_hooks or \
+           self.update_hooks:
+            if self.task is None:
+                self.task = taskMgr.add(self.simulationTask,
+                                        "physics world",
+                                        sort=-1,
+                                        taskChain="world")
+        elif self.task is not None:
+            taskMgr.remove(self.task)
+            self.task = None
+
+    def step(self):
+        """Let all bodies apply their forces and step the world once."""
+        for hook in self.input_hooks:
+            hook(self.step_size)
+        for hook in self.force_hooks:
+            hook(self.step_size)
+        self.integrator.step(self.step_size)
+        self.steps += 1
+        for hook in self.step_hooks:
+            hook(self.step_size)
+
+    def simulate(self, duration):
+        """Do as many steps as needed to simulate duration seconds,
+        regardless of real time and max_substeps. Return the number of
+        steps done."""
+        steps = int(round(duration / self.step_size))
+        for i in range(steps):
+            self.step()
+        return steps
+
+    def snapshot(self, snapshot=None):
+        """Return a Snapshot of the state of all bodies and the clock of this
+        world. Pass an older snapshot to reuse its memory."""
+        return self.aeroplanes.snapshot(snapshot)
+
+    def restore(self, snapshot):
+        """Put the world back into the state of a snapshot."""
+        self.aeroplanes.restore(snapshot)
+
+    def setOverflow(self, overflow):
+        """Set the policy for time exceeding max_substeps per frame."""
+        if overflow not in (DISCARD, SLOW_MOTION, CARRY):
+            raise ParamError("Invalid physics overflow policy: {}".format(
+                             overflow))
+        self.overflow = overflow
+
+    def advance(self, delta_time):
+        """Add delta_time to the accumulator and do as many fixed steps as
+        fit into it, but not more than max_substeps. Return the number of
+        steps done."""
+        limit = self.max_substeps
+        if limit and self.overflow == SLOW_MOTION:
+            budget = limit * self.step_size
+            if delta_time > budget:
+                self.dropped_time += delta_time - budget
+                delta_time = budget
+        self.accumulator += delta_time
+        steps = 0
+        # the accumulator is summed from floats, a full step may fall short
+        # of step_size by a rounding error
+        full_step = self.step_size * (1.0 - step_tolerance)
+        while self.accumulator >= full_step:
+            if limit and steps == limit:
+                if self.overflow == DISCARD:
+                    # keep the fraction of a step for interpolation
+                    left = self.accumulator % self.step_size
+                    if left >= full_step:
+                        left = 0.0
+                    self.dropped_time += self.accumulator - left
+                    self.accumulator = left
+                break
+            self.accumulator = max(self.accumulator - self.step_size, 0.0)
+            self.step()
+            steps += 1
+        return steps
+
+    def interpolationFactor(self):
+        """Return how far the simulation time is between the last two steps,
+        in range 0.0 - 1.0."""
+        return min(self.accumulator / self.step_size, 1.0)
+
+    def simulationTask(self, task):
+        """Step the world according to the time passed since last frame."""
+        self.advance(global_clock.getDt())
+        alpha = self.interpolationFactor()
+        for hook in self.update_hooks:
+            hook(alpha)
+        return task.cont
+
+
+half_pi = pi / 2.0
+gravity_acceleration = 9.81
+
+def _rotationTensor():
+    """Return the constant (4, 4, 3, 3) tensor that turns the outer product
+    of a unit quaternion (r, i, j, k) with itself into its rotation matrix.
+    Column 0 of the matrix is the right vector, column 1 forward and 2 up,
+    same as getRight(), getForward() and getUp() of a Quat."""
+    t = numpy.zeros((4, 4, 3, 3))
+    w, x, y, z = range(4)
+    def add(row, col, a, b, factor):
+        t[a, b, row, col] += factor
+    for row, col, terms in (
+            (0, 0, ((w, w, 1), (x, x, 1), (y, y, -1), (z, z, -1))),
+            (0, 1, ((x, y, 2), (w, z, -2))),
+            (0, 2, ((x, z, 2), (w, y, 2))),
+            (1, 0, ((x, y, 2), (w, z, 2))),
+            (1, 1, ((w, w, 1), (x, x, -1), (y, y, 1), (z, z, -1))),
+            (1, 2, ((y, z, 2), (w, x, -2))),
+            (2, 0, ((x, z, 2), (w, y, -2))),
+            (2, 1, ((y, z, 2), (w, x, 2))),
+            (2, 2, ((w, w, 1), (x, x, -1), (y, y, -1), (z, z, 1)))):
+        for a, b, factor in terms:
+            add(row, col, a, b, factor)
+    return t
+
+rotation_tensor = _rotationTensor()
+# the same as matrix, for numpy.dot() with flattened outer products
+rotation_matrix = rotation_tensor.reshape(16, 9)
+
+# Levi-Civita symbol, cross products are einsum("ijk,nj,nk->ni", ...)
+levi_civita = numpy.zeros((3, 3, 3))
+levi_civita[0,1,2] = levi_civita[1,2,0] = levi_civita[2,0,1] = 1.0
+levi_civita[0,2,1] = levi_civita[2,1,0] = levi_civita[1,0,2] = -1.0
+
+def _dot(a, b, out=None):
+    """Row-wise dot product of two (n, m) arrays."""
+    return numpy.einsum("ij,ij->i", a, b, out=out)
+
+def _copy(a, out):
+    """Copy the array a into out. Unlike out[:] = a, this doesn't copy a to a
+    temporary array first when both are columns of the same array, like the
+    fields of AeroplaneBatch.state."""
+    numpy.multiply(a, 1.0, out=out)
+
+
+# Values of one plane after a physics step, see AeroplanePhysics.telemetry().
+# Vectors are tuples, body_rates are the heading, pitch and roll rates about
+# the body axes.
+Telemetry = namedtuple("Telemetry", "position quat velocity angular_velocity "
+                       "acceleration thrust angle_of_attack speed altitude "
+                       "g_force lateral_g axial_g g_force_total body_rates")
+
+
+class _Views(object):
+    """Views of the first n rows of all batch arrays, so the kernels don't
+    create them on every step."""
+    pass
+
+
+def _slerp(q0, q1, t):
+    """Spherical linear interpolation between two (n, 4) arrays of unit
+    quaternions."""
+    cos_omega = _dot(q0, q1)
+    # take the short way around
+    q1 = numpy.where((cos_omega < 0.0)[:,None], -q1, q1)
+    cos_omega = numpy.abs(cos_omega)
+    omega = numpy.arccos(numpy.minimum(cos_omega, 1.0))
+    sin_omega = numpy.sin(omega)
+    # nearly equal orientations would divide by ~0, lerp is exact enough
+    near = sin_omega < 1e-6
+    sin_omega[near] = 1.0
+    s0 = numpy.where(near, 1.0 - t, numpy.sin((1.0 - t) * omega) / sin_omega)
+    s1 = numpy.where(near, t, numpy.sin(t * omega) / sin_omega)
+    result = q0 * s0[:,None] + q1 * s1[:,None]
+    return result / numpy.sqrt(_dot(result, result))[:,None]
+
+
+class AeroplaneBatch(object):
+    """Holds the state of all physical aeroplanes in a structure of arrays
+    and moves them all at once. Row i of every array belongs to the plane
+    with index i. All planes get their forces from one force hook of the
+    world.
+
+    AeroplanePhysics instances register themselves here and read and write
+    their dynamic values through it.
+
+    Each plane has a fidelity tier (see setTiers()). The rows are kept
+    sorted by tier, so the full model works on the first rows only and the
+    cheaper models on the rest. The numbers of planes in each tier are in
+    tier_counts.
+
+    Planes that stand still without thrust and control input fall asleep.
+    They cost nothing until they get thrust or input, or wake() is called
+    (e.g. by collision handling).
+    """
+
+    # flight parameters copied from the spec of each plane on registration
+    parameters = ("mass", "max_thrust", "aspect_ratio", "lift_factor",
+                  "drag_factor_x", "drag_factor_y", "drag_factor_z",
+                  "yaw_damping", "pitch_damping", "roll_damping",
+                  "terminal_yaw", "terminal_pitch", "terminal_roll",
+                  "rudder_coefficient", "elevator_coefficient",
+                  "ailerons_coefficient",
+                  "pitch_force_coefficient", "heading_force_coefficient",
+                  "pitch_torque_coefficient", "heading_torque_coefficient")
+    # dynamic values, one float per plane
+    scalars = ("thrust", "ailerons", "elevator", "rudder", "angle_of_attack",
+               "idle_time")
+    # dynamic values, one vector per plane
+    vectors = ("position", "velocity", "angular_velocity", "acceleration",
+               "previous_position", "applied_controls")
+    # orientations, one quaternion per plane
+    quaternions = ("quat", "previous_quat")
+    # all the arrays above are columns of one contiguous array, state, so
+    # the whole state of a plane is a single row. form: (name, columns)
+    state_layout = (("position", 3), ("quat", 4), ("velocity", 3),
+                    ("angular_velocity", 3), ("thrust", 1),
+                    ("applied_controls", 3),
+                    ("ailerons", 1), ("elevator", 1), ("rudder", 1),
+                    ("angle_of_attack", 1), ("idle_time", 1),
+                    ("acceleration", 3), ("previous_position", 3),
+                    ("previous_quat", 4))
+    # the first fields of state, everything needed to replay a flight
+    flight_state = state_layout[:6]
+    # values derived from the state after each step, columns of the array
+    # telemetry. form: (name, columns)
+    telemetry_layout = (("speed", 1), ("lateral_g", 1), ("axial_g", 1),
+                        ("g_force", 1), ("g_force_total", 1),
+                        ("body_rates", 3))
+    # preallocated scratch buffers of the force kernels, so a step doesn't
+    # create temporary arrays. form: (name, shape per plane)
+    work = (("speed", ()), ("v_squared", ()), ("lift_coef", ()),
+            ("yawv", ()), ("pitchv", ()), ("rollv", ()),
+            ("tmp", ()), ("tmp2", ()),
+            ("norm_v", (3,)), ("vec", (3,)), ("force", (3,)), ("torque", (3,)),
+            ("ground", ()), ("normal", (3,)),
+            ("outer", (4, 4)), ("rotation", (3, 3)),
+            ("mask", ()), ("mask2", ()))
+
+    def __init__(self, world):
+        self.world = world
+        self.planes = []
+        self.capacity = 0
+        # incremented whenever planes are added, removed or reordered, so
+        # users of the indices know when to look them up again
+        self.revision = 0
+        # incremented whenever the state changes (every step and when a body
+        # is changed from outside), so the telemetry is computed again
+        self.frame = 0
+        self.telemetry_frame = None
+        self.tier_counts = [0, 0, 0, 0]
+        self.point_mass_rate = point_mass_rate_config.getValue()
+        self.sleep_speed = sleep_speed_config.getValue()
+        self.sleep_rotation = sleep_rotation_config.getValue()
+        self.sleep_time = sleep_time_config.getValue()
+        self.max_plane_substeps = max_plane_substeps_config.getValue()
+        self.substep_distance = substep_distance_config.getValue()
+        self.substep_angle = substep_angle_config.getValue()
+        self.substep_velocity = substep_velocity_config.getValue()
+        # substeps and steps done by planes with the full model since
+        # creation, see averageSubsteps()
+        self.substeps = 0
+        self.plane_steps = 0
+        # groups of planes that share the same lift table. form:
+        # [(ListInterpolator, indices), ...]
+        self._lift_groups = None
+        self._resize(16)
+
+    def __len__(self):
+        return len(self.planes)
+
+    def _resize(self, capacity):
+        """Grow (or shrink) all arrays to hold capacity planes."""
+        n = len(self.planes)
+        state = numpy.zeros((capacity, sum(c for name, c in
+                                           self.state_layout)))
+        if self.capacity:
+            state[:n] = self.state[:n]
+        self.state = state
+        column = 0
+        for name, columns in self.state_layout:
+            if columns == 1:
+                setattr(self, name, state[:,column])
+            else:
+                setattr(self, name, state[:,column:column+columns])
+            column += columns
+        in_state = dict(self.state_layout)
+        shapes = [(name, ()) for name in self.parameters + self.scalars]
+        shapes += [(name, (3,)) for name in self.vectors]
+        shapes += [(name, (4,)) for name in self.quaternions]
+        for name, shape in shapes:
+            if name in in_state:
+                continue
+            new = numpy.zeros((capacity,) + shape)
+            if self.capacity:
+                new[:n] = getattr(self, name)[:n]
+            setattr(self, name, new)
+        tiers = numpy.zeros(capacity, int)
+        telemetry = numpy.zeros((capacity, sum(c for name, c in
+                                               self.telemetry_layout)))
+        if self.capacity:
+            tiers[:n] = self.tiers[:n]
+            telemetry[:n] = self.telemetry[:n]
+        self.tiers = tiers
+        self.telemetry = telemetry
+        for name, shape in self.work:
+            dtype = bool if name.startswith("mask") else float
+            setattr(self, "_work_" + name,
+                    numpy.zeros((capacity,) + shape, dtype))
+        self.capacity = capacity
+        self._views = {}
+
+    def _viewsOf(self, n):
+        """Return the views of the first n rows of all arrays. Scalar arrays
+        also get a column view with suffix _c for broadcasting with vectors.
+        The views are kept until the arrays or the planes change.
+        """
+        if n in self._views:
+            return self._views[n]
+        v = _Views()
+        v.n = n
+        names = self.parameters + self.scalars + self.vectors + \
+                self.quaternions
+        for name in names:
+            setattr(v, name, getattr(self, name)[:n])
+        for name, shape in self.work:
+            setattr(v, name, getattr(self, "_work_" + name)[:n])
+        for name in self.parameters + self.scalars + tuple(
+                name for name, shape in self.work if shape == ()):
+            setattr(v, name + "_c", getattr(v, name)[:,None])
+        v.right = v.rotation[:,:,0]
+        v.forward = v.rotation[:,:,1]
+        v.up = v.rotation[:,:,2]
+        for i, axis in enumerate("xyz"):
+            setattr(v, "position_" + axis, v.position[:,i])
+            setattr(v, "force_" + axis, v.force[:,i])
+            setattr(v, "torque_" + axis, v.torque[:,i])
+        self._views[n] = v
+        return v
+
+    def _arrays(self):
+        """Return all arrays with one row per plane (except the work
+        buffers)."""
+        in_state = dict(self.state_layout)
+        names = self.parameters + self.scalars + self.vectors + \
+                self.quaternions
+        return [self.state, self.tiers, self.telemetry] + \
+               [getattr(self, name) for name in names if name not in in_state]
+
+    def add(self, plane):
+        """Register an AeroplanePhysics object. Its flight parameters are
+        copied into the batch and it gets an index."""
+        if len(self.planes) == self.capacity:
+            self._resize(self.capacity * 2)
+        plane.index = len(self.planes)
+        self.planes.append(plane)
+        self._views = {}
+        self.revision += 1
+        for name in self.scalars:
+            getattr(self, name)[plane.index] = 0.0
+        self.state[plane.index] = 0.0
+        self.quat[plane.index] = (1.0, 0.0, 0.0, 0.0)
+        self.previous_quat[plane.index] = (1.0, 0.0, 0.0, 0.0)
+        self.tiers[plane.index] = FULL
+        self.setParameters(plane)
+        self.world.integrator.addBody(plane)
+        self.frame += 1
+        self._sortTiers()
+        if len(self.planes) == 1:
+            self.world.addForceHook(self.applyForces)
+            self.world.addStepHook(self.readBodies)
+            self.world.addUpdateHook(self.updateNodes)
+
+    def remove(self, plane):
+        """Unregister a plane. The last plane takes over its index."""
+        self.world.integrator.removeBody(plane)
+        i = plane.index
+        last = len(self.planes) - 1
+        if i != last:
+            moved = self.planes[last]
+            for array in self._arrays():
+                array[i] = array[last]
+            self.planes[i] = moved
+            moved.index = i
+        self.planes.pop()
+        plane.index = None
+        self._views = {}
+        self.revision += 1
+        self._lift_groups = None
+        self._sortTiers()
+        if not self.planes:
+            self.world.removeForceHook(self.applyForces)
+            self.world.removeStepHook(self.readBodies)
+            self.world.removeUpdateHook(self.updateNodes)
+
+    def setTiers(self, tiers):
+        """Set the fidelity tier of each plane. tiers is a sequence with the
+        tier of the plane in each row. Planes keep their state when they
+        change tiers, so they move on without a jump. Planes leaving FULL
+        are no longer moved by the integrator, planes entering it get their
+        state written back to the integrator."""
+        n = len(self.planes)
+        tiers = numpy.asarray(tiers, int)
+        changed = numpy.nonzero(tiers != self.tiers[:n])[0]
+        if not len(changed):
+            return
+        integrator = self.world.integrator
+        for i in changed.tolist():
+            if tiers[i] == SLEEPING:
+                self.velocity[i] = 0.0
+                self.angular_velocity[i] = 0.0
+            else:
+                self.idle_time[i] = 0.0
+            if tiers[i] >= DEAD_RECKONING:
+                # they fly without forces, the telemetry must not keep the
+                # acceleration of their last integrated step
+                self.acceleration[i] = 0.0
+            if self.tiers[i] == FULL:
+                integrator.disable(i)
+            elif tiers[i] == FULL:
+                integrator.enable(i)
+        self.tiers[:n] = tiers
+        self.frame += 1
+        self._sortTiers()
+
+    def wake(self, plane):
+        """Wake a sleeping plane up, it gets the full model."""
+        self.idle_time[plane.index] = 0.0
+        if self.tiers[plane.index] == SLEEPING:
+            tiers = self.tiers[:len(self.planes)].copy()
+            tiers[plane.index] = FULL
+            self.setTiers(tiers)
+
+    def checkSleep(self, step_size):
+        """Send planes to sleep that have been idle for sleep_time. Called
+        every sleep_check_rate steps."""
+        n = len(self.planes) - self.tier_counts[SLEEPING]
+        if not n:
+            return
+        sq = self.sleep_speed * self.sleep_speed
+        idle = _dot(self.velocity[:n], self.velocity[:n]) < sq
+        sq = self.sleep_rotation * self.sleep_rotation
+        idle &= _dot(self.angular_velocity[:n],
+                     self.angular_velocity[:n]) < sq
+        idle &= self.thrust[:n] == 0.0
+        idle &= ~self.applied_controls[:n].any(axis=1)
+        idle_time = self.idle_time[:n]
+        idle_time += step_size * sleep_check_rate
+        idle_time *= idle
+        tired = idle_time >= self.sleep_time
+        if tired.any():
+            tiers = self.tiers[:len(self.planes)].copy()
+            tiers[:n][tired] = SLEEPING
+            self.setTiers(tiers)
+
+    def _wakeOnInput(self):
+        """Wake sleeping planes that got thrust or control input."""
+        s = slice(len(self.planes) - self.tier_counts[SLEEPING],
+                  len(self.planes))
+        woken = self.thrust[s] != 0.0
+        woken |= self.ailerons[s] != 0.0
+        woken |= self.elevator[s] != 0.0
+        woken |= self.rudder[s] != 0.0
+        if woken.any():
+            tiers = self.tiers[:len(self.planes)].copy()
+            tiers[s][woken] = FULL
+            self.setTiers(tiers)
+
+    def _sortTiers(self):
+        """Reorder the rows by tier and count the planes in each tier."""
+        n = len(self.planes)
+        tiers = self.tiers[:n]
+        self.tier_counts = numpy.bincount(tiers, minlength=4).tolist()
+        if (tiers[1:] >= tiers[:-1]).all():
+            return
+        self._reorder(numpy.argsort(tiers, kind="mergesort"))
+        for i, plane in enumerate(self.planes):
+            plane.index = i
+        self.revision += 1
+
+    def _reorder(self, order):
+        """Move the rows of all arrays and the planes into the order of the
+        index array order, which covers the first len(order) rows. The
+        indices of the planes are left alone."""
+        n = len(order)
+        for array in self._arrays():
+            array[:n] = array[order]
+        self.planes[:n] = [self.planes[i] for i in order.tolist()]
+        if self._lift_groups is not None and len(self._lift_groups) > 1:
+            new_rows = numpy.arange(len(self.planes))
+            new_rows[order] = numpy.arange(n)
+            self._lift_groups = [(table, numpy.sort(new_rows[indices]))
+                                 for table, indices in self._lift_groups]
+
+    def snapshot(self, snapshot=None):
+        """Copy the state of all planes and the clock of the world into a
+        Snapshot. The state array and the tiers are copied with two array
+        operations, no matter how many planes there are."""
+        n = len(self.planes)
+        width = self.state.shape[1]
+        if snapshot is None or snapshot.data.shape != (n, width + 1):
+            snapshot = Snapshot(numpy.empty((n, width + 1)))
+        snapshot.data[:,:width] = self.state[:n]
+        snapshot.data[:,width] = self.tiers[:n]
+        snapshot.planes = tuple(self.planes)
+        snapshot.revision = self.revision
+        world = self.world
+        snapshot.steps = world.steps
+        snapshot.accumulator = world.accumulator
+        snapshot.dropped_time = world.dropped_time
+        return snapshot
+
+    def restore(self, snapshot):
+        """Put all planes and the clock of the world back into the state of
+        a snapshot. The planes of the snapshot must still exist, planes
+        added since then are left as they are.
+
+        Integrators keeping bodies (ODE) have to be told about the new
+        state plane by plane, about 1.3 us per plane. Only planes whose row
+        differs from the snapshot are written, so planes that didn't move
+        since (e.g. sleeping ones) cost nothing.
+        """
+        n = len(snapshot.planes)
+        width = self.state.shape[1]
+        if snapshot.revision == self.revision:
+            rows = slice(0, n)
         else:
-            self.thrust = value
+            rows = [plane.index for plane in snapshot.planes]
+            if None in rows:
+                raise ParamError("Can't restore a snapshot of planes that "
+                                 "have been destroyed.")
+        integrator = self.world.integrator
+        if integrator.bodies:
+            differs = (self.state[rows] != snapshot.data[:,:width]).any(
+                    axis=1)
+            differs |= self.tiers[rows] != snapshot.data[:,width]
+            changed = [snapshot.planes[i] for i in numpy.nonzero(differs)[0]]
+        self.state[rows] = snapshot.data[:,:width]
+        self.tiers[rows] = snapshot.data[:,width]
+        self._sortTiers()
 
-    def getThrust(self):
-        return self.thrust
+        if integrator.bodies:
+            integrator.sync(self.tier_counts[FULL],
+                            [plane.index for plane in changed])
+        else:
+            integrator.sync(self.tier_counts[FULL])
+        self.frame += 1
 
-    def setCalculationConstants(self):
-        """pre-calculate some calculation constants from the
-        flight parameters"""
-        # density of air: rho = 1.2041 kg m-3
-        half_rho = 0.602
-        self.lift_factor = half_rho * self.wing_area
+        world = self.world
+        world.steps = snapshot.steps
+        world.accumulator = snapshot.accumulator
+        world.dropped_time = snapshot.dropped_time
 
-        # could modify lift_induced_drag by a factor of 1.05 to 1.15
-        self.lift_induced_drag_factor = (-1.0) * self.lift_factor / \
-                                        (pi*self.aspect_ratio)
-        self.drag_factor_x = (-1.0) * half_rho * self.drag_area_x * \
-                                                 self.drag_coef_x
-        self.drag_factor_y = (-1.0) * half_rho * self.drag_area_y * \
-                                                 self.drag_coef_y
-        self.drag_factor_z = (-1.0) * half_rho * self.drag_area_z * \
-                                                 self.drag_coef_z
+    def setParameters(self, plane):
+        """Copy the flight parameters of a registered plane into the batch.
+        Call this after changing the specs of a plane."""
+        for name in self.parameters:
+            getattr(self, name)[plane.index] = getattr(plane.spec, name)
+        self._lift_groups = None
 
-        self.gravity = Vec3(0.0,0.0,-9.81) 
-        self.gravityM = self.gravity * self.mass
+    def _liftGroups(self):
+        """Group planes by their lift tables, so each table is evaluated with
+        one call per step no matter how many planes use it. Planes of the
+        same type share one table."""
+        if self._lift_groups is None:
+            groups = {}
+            for i, plane in enumerate(self.planes):
+                table = plane.spec.liftvsaoa
+                groups.setdefault(id(table), (table, []))[1].append(i)
+            self._lift_groups = [(table, numpy.array(indices))
+                                 for table, indices in groups.values()]
+        return self._lift_groups
 
-    def _wingAngleOfAttack(self,v_norm,up):
-        """ calculate the angle between the wing and the relative motion of the air """
+    def _liftCoefficients(self, w):
+        """Look up the lift coefficient of every plane of the views w for
+        its angle of attack."""
+        groups = self._liftGroups()
+        if len(groups) == 1:
+            groups[0][0].evaluateMany(w.angle_of_attack, out=w.lift_coef)
+            return
+        # w may cover only the first rows, the indices are sorted
+        for table, indices in groups:
+            indices = indices[:numpy.searchsorted(indices, w.n)]
+            aoa = w.tmp[:len(indices)]
+            lift_coef = w.tmp2[:len(indices)]
+            numpy.take(w.angle_of_attack, indices, out=aoa, mode="clip")
+            table.evaluateMany(aoa, out=lift_coef)
+            numpy.put(w.lift_coef, indices, lift_coef, mode="clip")
 
-        #projected_v = v_norm - right * v_norm.dot(right)
-        #aoa = atan2(projected_v.dot(-up), projected_v.dot(forward))
-        #return aoa
+    def writeBody(self, plane):
+        """Hand position, orientation and velocities of one plane to the
+        integrator. Call this after changing them from outside."""
+        self.world.integrator.writeBody(plane.index)
+        self.frame += 1
 
-        # strangely enough, the above gets the same result as the below
-        # for these vectors it must be calculating the angle in the plane where
-        # right is the normal vector
+    def resetState(self, plane):
+        """Write the body of a plane and forget its previous state, so its
+        node jumps to the new state instead of blending into it."""
+        self.writeBody(plane)
+        self.previous_position[plane.index] = self.position[plane.index]
+        self.previous_quat[plane.index] = self.quat[plane.index]
 
-        return v_norm.angleRad(up) - pi/2.0
+    def readBodies(self, step_size):
+        """Copy the new position, orientation and velocities from the
+        integrator. Planes of the reduced tiers are moved here. This is the
+        step hook."""
+        if self.tier_counts[POINT_MASS] or self.tier_counts[DEAD_RECKONING]:
+            self._stepReduced(step_size)
+        self.world.integrator.readBodies(self.tier_counts[FULL])
+        if self.world.steps % sleep_check_rate == 0:
+            self.checkSleep(step_size)
+        self.frame += 1
 
+    def updateTelemetry(self):
+        """Compute the telemetry of all planes from their state, if it
+        changed since the last time. This is done on demand, a step costs
+        nothing extra if nobody reads the telemetry."""
+        if self.telemetry_frame == self.frame:
+            return
+        self.telemetry_frame = self.frame
+        n = len(self.planes)
+        quat = self.quat[:n]
+        outer = (quat[:,:,None] * quat[:,None,:]).reshape(-1, 16)
+        rotation = numpy.dot(outer, rotation_matrix).reshape(-1, 3, 3)
+        t = self.telemetry[:n]
+        t[:,0] = numpy.sqrt(_dot(self.velocity[:n], self.velocity[:n]))
+        # acceleration felt by the pilot, along the right, forward and up
+        # axes
+        acc = self.acceleration[:n].copy()
+        acc[:,2] += gravity_acceleration
+        numpy.einsum("ni,nij->nj", acc, rotation, out=t[:,1:4])
+        t[:,1:4] /= gravity_acceleration
+        t[:,4] = numpy.sqrt(_dot(acc, acc)) / gravity_acceleration
+        # rotation about the up, right and forward axes
+        rates = numpy.einsum("ni,nij->nj", self.angular_velocity[:n],
+                             rotation)
+        t[:,5] = rates[:,2]
+        t[:,6] = rates[:,0]
+        t[:,7] = rates[:,1]
 
-    def _lift(self,v_norm,v_squared,right,aoa):
-        """return the lift force vector generated by the wings"""
-        # lift direction is always perpendicular to the airflow
-        lift_vector = right.cross(v_norm)
-        return lift_vector * v_squared * self.lift_factor * self.liftvsaoa[aoa]
+    def _stepReduced(self, step_size):
+        """Move the planes of the POINT_MASS and DEAD_RECKONING tiers. Their
+        velocity changes only every point_mass_rate steps (POINT_MASS) or
+        not at all, but they move every step, so they stay smooth."""
+        full, point_mass, dead_reckoning, sleeping = self.tier_counts
+        if point_mass and self.world.steps % self.point_mass_rate == 0:
+            self._pointMass(slice(full, full + point_mass),
+                            step_size * self.point_mass_rate)
+        s = slice(full, full + point_mass + dead_reckoning)
+        self.position[s] += self.velocity[s] * step_size
+        # integrate the orientation with constant angular velocity
+        integrateQuats(self.quat[s], self.angular_velocity[s], step_size)
+
+        # keep them above the ground
+        position = self.position[s]
+        ground = numpy.empty(len(position))
+        normal = numpy.empty((len(position), 3))
+        self.world.terrain.sample(position[:,0], position[:,1], ground,
+                                  normal)
+        below = numpy.nonzero(position[:,2] < ground)[0]
+        if len(below):
+            position[below,2] = ground[below]
+            v = self.velocity[s][below]
+            v -= normal[below] * _dot(v, normal[below])[:,None]
+            self.velocity[s][below] = v
+
+    def _pointMass(self, s, dt):
+        """Accelerate the planes in rows s as point masses: thrust along the
+        nose, drag against the motion and lift carrying their weight as far
+        as the wings are level."""
+        rotation = numpy.einsum("na,nb,abij->nij", self.quat[s], self.quat[s],
+                                rotation_tensor)
+        forward = rotation[:,:,1]
+        up = rotation[:,:,2]
+        v = self.velocity[s]
+        speed = numpy.sqrt(_dot(v, v))
+        mass = self.mass[s]
+        acc = forward * (self.thrust[s] * self.max_thrust[s] / mass)[:,None]
+        acc += v * (speed * self.drag_factor_y[s] / mass)[:,None]
+        acc += up * (gravity_acceleration * up[:,2])[:,None]
+        acc[:,2] -= gravity_acceleration
+        self.acceleration[s] = acc
+        v += acc * dt
+
+    # The kernels below work on the views of a step (see _viewsOf()) and
+    # write into the preallocated buffers only.
 
-    def _drag(self,v,v_squared,right,up,forward,aoa):
-        """return the drag force"""
+    def _lift(self, w):
+        """add the lift forces generated by the wings to w.force"""
+        # lift direction is always perpendicular to the airflow
+        numpy.einsum("ijk,nj,nk->ni", levi_civita, w.right, w.norm_v,
+                     out=w.vec)
+        numpy.multiply(w.v_squared, w.lift_factor, out=w.tmp)
+        w.tmp *= w.lift_coef
+        w.vec *= w.tmp_c
+        w.force += w.vec
 
+    def _drag(self, w):
+        """add the drag forces to w.force"""
         # get the induced drag coefficient
         # Cdi = (Cl*Cl)/(pi*AR*e)
-
-        lift_coef = self.liftvsaoa[aoa]
-        ind_drag_coef = lift_coef * lift_coef / (pi * self.aspect_ratio * 1.10)
+        numpy.multiply(w.lift_coef, w.lift_coef, out=w.tmp)
+        w.tmp /= w.aspect_ratio
+        w.tmp *= 1.0 / (pi * 1.10)
 
         # and calculate the drag induced by the creation of lift
-        induced_drag =  -v * sqrt(v_squared) * self.lift_factor * ind_drag_coef
-        #induced_drag = Vec3(0.0,0.0,0.0)
-        profile_drag = self._simpleProfileDrag(v,right,up,forward)
-
-        return induced_drag + profile_drag
-
-    def _simpleProfileDrag(self,v,right,up,forward):
-        """return the force vector due to the shape of the aircraft"""
-        speed_x = right.dot(v)
-        speed_y = forward.dot(v)
-        speed_z = up.dot(v)
-
-        drag_x = right*speed_x*abs(speed_x)*self.drag_factor_x
-        drag_y = forward*speed_y*abs(speed_y)*self.drag_factor_y
-        drag_z = up*speed_z*abs(speed_z)*self.drag_factor_z
-        return drag_x + drag_y + drag_z
-
-    def _thrust(self,thrust_vector):
-        """return the force vector produced by the aircraft engines"""
-        return thrust_vector * self.thrust * self.max_thrust
-
-    def _force(self,p,v,right,up,forward):
-        """calculate the forces due to the velocity and orientation of the aircraft"""
-        v_squared = v.lengthSquared()
-        v_norm = v + v.zero()
-        v_norm.normalize()
-
-        aoa = self._wingAngleOfAttack(v_norm,up)
-        lift = self._lift(v_norm,v_squared,right,aoa)
-        drag = self._drag(v,v_squared,right,up,forward,aoa)
-        thrust = self._thrust(forward)
-        self.angle_of_attack = aoa
-
-        force = lift + drag + self.gravityM + thrust
-
-        # if the plane is on the ground, the ground reacts to the downward force
-        # TODO (gjmm): need to modify in order to consider reaction to objects
-        #              at different altitudes.
-        if p.getZ() == 0.0:
-            if force[2] < 0.0:
-                force.setZ(0.0)
-        
-        return force
-    
+        w.tmp *= w.speed
+        w.tmp *= w.lift_factor
+        numpy.multiply(w.velocity, w.tmp_c, out=w.vec)
+        w.force -= w.vec
+
+        self._simpleProfileDrag(w)
+
+    def _simpleProfileDrag(self, w):
+        """add the forces due to the shape of the aircrafts to w.force"""
+        for axis, factor in ((w.right, w.drag_factor_x),
+                             (w.forward, w.drag_factor_y),
+                             (w.up, w.drag_factor_z)):
+            _dot(axis, w.velocity, out=w.tmp)
+            numpy.absolute(w.tmp, out=w.tmp2)
+            w.tmp *= w.tmp2
+            w.tmp *= factor
+            numpy.multiply(axis, w.tmp_c, out=w.vec)
+            w.force += w.vec
+
+    def _force(self, w):
+        """calculate the forces due to the velocity and orientation of the
+        aircrafts into w.force"""
+        # angle between the wing and the relative motion of the air
+        aoa = w.angle_of_attack
+        _dot(w.norm_v, w.up, out=aoa)
+        numpy.clip(aoa, -1.0, 1.0, out=aoa)
+        numpy.arccos(aoa, out=aoa)
+        aoa -= half_pi
+        self._liftCoefficients(w)
+
+        w.force.fill(0.0)
+        self._lift(w)
+        self._drag(w)
+        # thrust
+        numpy.multiply(w.thrust, w.max_thrust, out=w.tmp)
+        numpy.multiply(w.forward, w.tmp_c, out=w.vec)
+        w.force += w.vec
+        # gravity
+        numpy.multiply(w.mass, gravity_acceleration, out=w.tmp)
+        w.force_z -= w.tmp
+
+        # if a plane is on the ground, the ground reacts to the force into it
+        self.world.terrain.sample(w.position_x, w.position_y, w.ground,
+                                  w.normal)
+        numpy.less_equal(w.position_z, w.ground, out=w.mask)
+        _dot(w.force, w.normal, out=w.tmp)
+        numpy.less(w.tmp, 0.0, out=w.mask2)
+        w.mask &= w.mask2
+        if w.mask.any():
+            numpy.logical_not(w.mask, out=w.mask2)
+            numpy.putmask(w.tmp, w.mask2, 0.0)
+            numpy.multiply(w.normal, w.tmp_c, out=w.vec)
+            w.force -= w.vec
+
+    def _controlRotForce(self, w, out, control, coeff, rspeed, max_rspeed):
+        """ generic control rotation force, written to out as amount of
+        torque about the control axis
+        control - positive or negative amount of elevator/rudder/ailerons
+        coeff - the conversion of the amount of the control to a rotational force
+        rspeed - the current rotational speed about the axis
+        max_rspeed - a cut-off for the rotational speed
+        """
+        numpy.multiply(control, rspeed, out=w.tmp)
+        # as floats, multiplying by bools would convert them to a new array
+        numpy.less(w.tmp, max_rspeed, out=w.tmp2)
+        numpy.multiply(control, coeff, out=out)
+        out *= w.speed
+        out *= w.tmp2
+
+    def _rotDamping(self, w, out, rotv, damping_factor):
+        """ generic damping, added to out as amount of torque about the axis
+        """
+        # rather than trusting that we have the sign right at any point
+        # the damping always works against the rotation
+        numpy.absolute(damping_factor, out=w.tmp)
+        w.tmp *= rotv
+        out -= w.tmp
+
+    def _forwardAndVelocityVectorForces(self, w):
+        """ adds torques and forces resulting from deviation of the
+        velocity vectors from the forward vectors """
+
+        # get the projection of the normalised velocity onto the up and
+        # right vectors to find relative pitch and heading angles
+        for axis, torque, coeff_t, force, coeff_f, sign in (
+                (w.up, w.torque_x, w.pitch_torque_coefficient,
+                 w.force_x, w.pitch_force_coefficient, -1.0),
+                (w.right, w.torque_z, w.heading_torque_coefficient,
+                 w.force_z, w.heading_force_coefficient, 1.0)):
+            angle = w.tmp2
+            _dot(axis, w.norm_v, out=angle)
+            numpy.clip(angle, -1.0, 1.0, out=angle)
+            numpy.arccos(angle, out=angle)
+            angle -= half_pi
+            angle *= w.speed
+            if sign < 0.0:
+                numpy.negative(angle, out=angle)
+            numpy.multiply(angle, coeff_t, out=w.tmp)
+            torque += w.tmp
+            numpy.multiply(angle, coeff_f, out=w.tmp)
+            force += w.tmp
+
+    def applyForces(self, step_size):
+        """Apply aerodynamic forces to all planes. This is the force hook
+        called by the world before each step."""
+        if self.tier_counts[SLEEPING]:
+            self._wakeOnInput()
+        # keep the current state as previous one, integrators working on
+        # the arrays move the planes right after this hook
+        count = len(self.planes)
+        _copy(self.position[:count], self.previous_position[:count])
+        _copy(self.quat[:count], self.previous_quat[:count])
+        n = self.tier_counts[FULL]
+        if n == 0:
+            self._resetControls(len(self.planes))
+            return
+        if self.max_plane_substeps > 1:
+            self._substep(n, step_size)
+        else:
+            w = self._viewsOf(n)
+            self._forcesAndTorques(w)
+            self.world.integrator.applyForces(n, w.force, w.torque,
+                                              w.rotation)
+            self._clampToGround(w)
+            self.substeps += n
+        self.plane_steps += n
+        self._resetControls(len(self.planes))
+
+    def _substep(self, n, step_size):
+        """Move the first n planes through a step in their own number of
+        substeps. The rows are ordered by that number for the step, so the
+        planes still moving in a substep are the first rows and only they
+        get their forces evaluated."""
+        counts = self.substepCounts(n, step_size)
+        order = numpy.argsort(-counts, kind="mergesort")
+        reordered = (order[1:] < order[:-1]).any()
+        if reordered:
+            self._reorder(order)
+            counts = counts[order]
+        step_sizes = step_size / counts
+        # number of planes still moving in each substep
+        moving = numpy.bincount(counts)[::-1].cumsum()[::-1][1:].tolist()
+        integrator = self.world.integrator
+        for m in moving:
+            w = self._viewsOf(m)
+            self._forcesAndTorques(w)
+            self._clampToGround(w)
+            integrator.advance(m, w.force, w.torque, w.rotation,
+                               step_sizes[:m])
+        if reordered:
+            self._reorder(numpy.argsort(order))
+        self.substeps += int(counts.sum())
+
+    def substepCounts(self, n, step_size):
+        """Return an int array with the number of substeps each of the first
+        n planes needs for the next step, see azure-physics-substep-*."""
+        need = numpy.sqrt(_dot(self.velocity[:n], self.velocity[:n]))
+        need /= self.substep_distance
+        rotation = numpy.sqrt(_dot(self.angular_velocity[:n],
+                                   self.angular_velocity[:n]))
+        numpy.maximum(need, rotation / self.substep_angle, out=need)
+        # the acceleration of the last step tells how fast the velocity
+        # changes
+        acceleration = numpy.sqrt(_dot(self.acceleration[:n],
+                                       self.acceleration[:n]))
+        numpy.maximum(need, acceleration / self.substep_velocity, out=need)
+        need *= step_size
+        counts = numpy.ceil(need)
+        numpy.clip(counts, 1, self.max_plane_substeps, out=counts)
+        return counts.astype(int)
+
+    def averageSubsteps(self):
+        """Return the average number of substeps per step of planes with
+        the full model, 1.0 without adaptive substeps. Every substep is one
+        evaluation of the forces of the plane."""
+        if not self.plane_steps:
+            return 1.0
+        return float(self.substeps) / self.plane_steps
+
+    def _forcesAndTorques(self, w):
+        """Compute force, torque and acceleration of the planes of the
+        views w from their current state."""
+        _dot(w.velocity, w.velocity, out=w.v_squared)
+        numpy.sqrt(w.v_squared, out=w.speed)
+        # planes at rest get a zero direction of motion
+        numpy.maximum(w.speed, 1e-12, out=w.tmp)
+        numpy.divide(w.velocity, w.tmp_c, out=w.norm_v)
+
+        # right, forward and up vectors are the columns of the rotation
+        numpy.einsum("na,nb->nab", w.quat, w.quat, out=w.outer)
+        numpy.einsum("nab,abij->nij", w.outer, rotation_tensor,
+                     out=w.rotation)
+        _dot(w.angular_velocity, w.up, out=w.yawv)
+        _dot(w.angular_velocity, w.right, out=w.pitchv)
+        _dot(w.angular_velocity, w.forward, out=w.rollv)
+
+        self._force(w)
+
+        # Control and damping torques about the body axes
+        self._controlRotForce(w, w.torque_x, w.elevator,
+                              w.elevator_coefficient, w.pitchv,
+                              w.terminal_pitch)
+        self._controlRotForce(w, w.torque_y, w.ailerons,
+                              w.ailerons_coefficient, w.rollv,
+                              w.terminal_roll)
+        self._controlRotForce(w, w.torque_z, w.rudder,
+                              w.rudder_coefficient, w.yawv,
+                              w.terminal_yaw)
+        self._rotDamping(w, w.torque_x, w.pitchv, w.pitch_damping)
+        self._rotDamping(w, w.torque_y, w.rollv, w.roll_damping)
+        self._rotDamping(w, w.torque_z, w.yawv, w.yaw_damping)
+
+        # Forces to rotate the forward vector towards the velocity vector
+        # and vice versa
+        self._forwardAndVelocityVectorForces(w)
+        numpy.divide(w.force, w.mass_c, out=w.acceleration)
+
+    def _clampToGround(self, w):
+        """Put planes below the ground back on it and stop their motion into
+        the ground. The ground under them is sampled by _force()."""
+        numpy.less(w.position_z, w.ground, out=w.mask)
+        if w.mask.any():
+            integrator = self.world.integrator
+            for i in numpy.nonzero(w.mask)[0].tolist():
+                normal = w.normal[i]
+                w.velocity[i] -= normal * numpy.dot(w.velocity[i], normal)
+                w.position_z[i] = w.ground[i]
+                integrator.writeBody(i)
+
+    def _resetControls(self, n):
+        """Keep the control surfaces of this step (ailerons, elevator,
+        rudder) for recorders and reset them for the next step."""
+        self.applied_controls[:n,0] = self.ailerons[:n]
+        self.applied_controls[:n,1] = self.elevator[:n]
+        self.applied_controls[:n,2] = self.rudder[:n]
+        self.rudder[:n] = 0.0
+        self.elevator[:n] = 0.0
+        self.ailerons[:n] = 0.0
+
+    def updateNodes(self, alpha):
+        """Move the nodes of all planes to a blend of their previous and
+        current state. This is the update hook."""
+        n = len(self.planes)
+        position = self.previous_position[:n] + \
+                   (self.position[:n] - self.previous_position[:n]) * alpha
+        quat = _slerp(self.previous_quat[:n], self.quat[:n], alpha)
+        for plane, p, q in zip(self.planes, position.tolist(), quat.tolist()):
+            if plane.node is not None:
+                plane.node.setPosQuat(render, Point3(*p), Quat(*q))
+
+
+class Snapshot(object):
+    """State of all planes of a physics world at one step, see
+    PhysicsWorld.snapshot().
+
+    data is one array with a row per plane: the columns of the state array
+    of the aeroplane batch (see AeroplaneBatch.state_layout) followed by
+    the tier. planes tells which plane each row belongs to. The snapshot
+    holds no other references into the world, so it can be kept around
+    (e.g. in a ring buffer for rewinding) as long as the planes live.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.planes = ()
+        self.revision = None
+        self.steps = 0
+        self.accumulator = 0.0
+        self.dropped_time = 0.0
+
+    def __len__(self):
+        return len(self.planes)
+
+
+class Physical(object):
+    # default world, used in game
+    world = PhysicsWorld()
+
+    def __init__(self, world=None):
+        self.world = world or Physical.world
+
+
+def _batchValue(name, doc=None):
+    """Create a property that reads and writes one float of a plane in the
+    batch arrays."""
+    def fget(self):
+        return float(getattr(self.batch, name)[self.row()])
+    def fset(self, value):
+        getattr(self.batch, name)[self.row()] = value
+    return property(fget, fset, doc=doc)
+
+
+class AeroplanePhysics(Physical):
+    """Physical representation of one aeroplane. The dynamic state lives in
+    the aeroplane batch of the world, this object is a view into it."""
+
+    thrust = _batchValue("thrust", "Thrust in range 0.0 - 1.0.")
+    ailerons = _batchValue("ailerons")
+    elevator = _batchValue("elevator")
+    rudder = _batchValue("rudder")
+    angle_of_attack = _batchValue("angle_of_attack")
+
+    gravity = Vec3(0.0,0.0,-9.81)
+
+    def __init__(self, node, spec="default", world=None):
+        """Arguments:
+        node -- NodePath of the plane. The plane starts at its position.
+                None for planes without scene graph representation (e.g. in
+                headless worlds). Those start at the origin.
+        spec -- aircraft type, see loadSpecs()
+        world -- PhysicsWorld to live in. Defaults to Physical.world.
+        """
+
+        Physical.__init__(self, world)
+
+        self.node = node
+        self.batch = self.world.aeroplanes
+        self.index = None
+        # bound methods of the movements, form: {"roll-left": method}
+        self.movements = {"roll-left": self.rollLeft,
+                          "roll-right": self.rollRight,
+                          "pitch-up": self.pitchUp,
+                          "pitch-down": self.pitchDown,
+                          "heading-left": self.headingLeft,
+                          "heading-right": self.headingRight}
+        self._telemetry = None
+        self._telemetry_frame = None
+        # the body of the plane (if the integrator uses bodies)
+        self.ode_body = None
+        self.loadSpecs(spec)
+
+        # dynamic variables and state variables (thrust, rudder, ailerons,
+        # elevator) are initialised by the batch
+        self.batch.add(self)
+        if self.node is not None:
+            # positions and orientation are set relative to render
+            self.batch.quat[self.index] = self.node.getQuat(render)
+            self.setPosition(self.node.getPos(render))
+
+    def loadSpecs(self, spec):
+        """Loads specifications for a plane. Force if already loaded.
+        Arguments:
+        spec -- name of an aircraft type from etc/aeroplanes.ini or an
+                AeroplaneSpec. Planes of the same type share the same spec.
+        """
+        if isinstance(spec, basestring):
+            spec = getSpec(spec)
+        self.spec = spec
+        if self.index is not None:
+            self.batch.setParameters(self)
+
+    def row(self):
+        """Return the index of the plane in the batch arrays. Raises
+        ResourceHandleError after destroy(); indexing the arrays with None
+        would touch every plane."""
+        if self.index is None:
+            raise ResourceHandleError("aeroplane physics",
+                                      "used after destroy()")
+        return self.index
+
+    def move(self, movement):
+        """Plane movement management."""
+        try:
+            move = self.movements[movement]
+        except KeyError:
+            raise ParamError("Unknown movement: {}".format(movement))
+        move()
+
+    def rollLeft(self):
+        self.ailerons = -1.0
+
+    def rollRight(self):
+        self.ailerons = 1.0
+
+    def pitchUp(self):
+        self.elevator = 1.0
+
+    def pitchDown(self):
+        self.elevator = -1.0
+
+    def headingLeft(self):
+        self.rudder = 1.0
+
+    def headingRight(self):
+        self.rudder = -1.0
+
+    def chThrust(self, value, delta_time=None):
+        """Change the thrust by azure-thrust-rate per second. value is "add"
+        or "subtract". delta_time defaults to one physics step, for calls
+        from input hooks."""
+        if delta_time is None:
+            delta_time = self.world.step_size
+        change = thrust_rate_config.getValue() * delta_time
+        if value == "add":
+            self.setThrust(self.thrust + change)
+        elif value == "subtract":
+            self.setThrust(self.thrust - change)
+
+    def appliedControls(self):
+        """Return ailerons, elevator and rudder the last physics step was
+        flown with. The control attributes themselves are 0.0 between
+        steps, because controls are only held for one step."""
+        return tuple(self.batch.applied_controls[self.row()].tolist())
+
+    def setThrust(self, value):
+        if value <= 0:
+            self.thrust = 0
+        elif value >= 1:
+            self.thrust = 1
+        else:
+            self.thrust = value
+
+    def getThrust(self):
+        return self.thrust
+
     def angleOfAttack(self):
         return self.angle_of_attack
+
+    @property
+    def acceleration(self):
+        """Acceleration due to all forces of the last physics step."""
+        return Vec3(*self.telemetry().acceleration)
+
+    def telemetry(self):
+        """Return the Telemetry of the last physics step. The record is
+        built once per step, later calls return the same object."""
+        batch = self.batch
+        if self._telemetry_frame != batch.frame:
+            i = self.row()
+            batch.updateTelemetry()
+            speed, lateral_g, axial_g, g_force, g_force_total, h, p, r = \
+                    batch.telemetry[i].tolist()
+            position = tuple(batch.position[i].tolist())
+            self._telemetry = Telemetry(
+                    position=position,
+                    quat=tuple(batch.quat[i].tolist()),
+                    velocity=tuple(batch.velocity[i].tolist()),
+                    angular_velocity=tuple(batch.angular_velocity[i].tolist()),
+                    acceleration=tuple(batch.acceleration[i].tolist()),
+                    thrust=float(batch.thrust[i]),
+                    angle_of_attack=float(batch.angle_of_attack[i]),
+                    speed=speed, altitude=position[2], g_force=g_force,
+                    lateral_g=lateral_g, axial_g=axial_g,
+                    g_force_total=g_force_total, body_rates=(h, p, r))
+            self._telemetry_frame = batch.frame
+        return self._telemetry
+
     def gForceTotal(self):
-        acc = self.acceleration - self.gravity
-        return acc.length()/9.81
+        return self.telemetry().g_force_total
+
     def gForce(self):
-        up = self.node.getQuat().getUp()
-        acc = self.acceleration - self.gravity
-        gf = acc.dot(up) / 9.81
-        return gf
+        return self.telemetry().g_force
 
     def lateralG(self):
-        right = self.node.getQuat().getRight()
-        acc = self.acceleration - self.gravity
-        gf = acc.dot(right) / 9.81
-        return gf
+        return self.telemetry().lateral_g
 
     def axialG(self):
-        forward = self.node.getQuat().getForward()
-        acc = self.acceleration - self.gravity
-        gf = acc.dot(forward) / 9.81
-        return gf
+        return self.telemetry().axial_g
 
     def velocity(self):
         """ return the current velocity """
-        #return self.physics_object.getVelocity()
-        return Vec3(self.ode_body.getLinearVel())
+        return Vec3(*self.telemetry().velocity)
     def setVelocity(self,v):
-        self.ode_body.setLinearVel(v)
+        self.wake()
+        self.batch.velocity[self.row()] = v
+        self.batch.writeBody(self)
     
     def angVelVector(self):
         """ return the current angular velocity as a vector """
-        return self.ode_body.getAngularVel()
+        return Vec3(*self.telemetry().angular_velocity)
     
     def angVelBodyHpr(self):
         """ return the heading, pitch and roll values about the body axis """
-        angv = self.angVelVector()
-        quat = self.quat()
-        h = angv.dot(quat.getUp())
-        p = angv.dot(quat.getRight())
-        r = angv.dot(quat.getForward())
-        return h,p,r
+        return self.telemetry().body_rates
     
     def setAngularVelocity(self,v):
-        self.ode_body.setAngularVel(v)
+        self.wake()
+        self.batch.angular_velocity[self.row()] = v
+        self.batch.writeBody(self)
     
     def speed(self):
         """ returns the current velocity """
-        return self.velocity().length()
+        return self.telemetry().speed
         
     def position(self):
         """ return the current position """
-        return self.ode_body.getPosition()
+        return Point3(*self.telemetry().position)
     def setPosition(self,p):
-        self.ode_body.setPosition(p)
+        self.wake()
+        self.batch.position[self.row()] = p
+        self.batch.resetState(self)
     
     def altitude(self):
         """ returns the current altitude """
-        return self.position().getZ()
+        return self.telemetry().altitude
     
     def quat(self):
         """ return the current quaternion representation of the attitude """
-        return Quat(self.ode_body.getQuaternion())
-    
-    def _controlRotForce(self,control,axis,coeff,speed,rspeed,max_rspeed):
-        """ generic control rotation force
-        control - positive or negative amount of elevator/rudder/ailerons
-        axis - vector about which the torque is applied
-        coeff - the conversion of the amount of the control to a rotational force
-        speed - the speed of the plane
-        rspeed - the current rotational speed about the axis
-        max_rspeed - a cut-off for the rotational speed
-        """
-        if control * rspeed < max_rspeed:
-            return axis * control * coeff * speed
-        else:
-            return Vec3(0.0,0.0,0.0)
-    
-    def _rotDamping(self,vector,rotv,damping_factor):
-        """ generic damping """
-        damp = damping_factor * rotv
-        
-        # rather than trusting that we have the sign right at any point
-        # decide sign of the returned value based on the speed
-        if rotv < 0.0:
-            return vector * abs(damp)
-        else:
-            return vector * -abs(damp)
-    
-    def _forwardAndVelocityVectorForces(self,up,right,norm_v,speed):
-        """ calculates torque and force resulting from deviation of the
-        velocity vector from the forward vector """
-        
-        # could do with a better name for this method
-        
-        # get the projection of the normalised velocity onto the up and
-        # right vectors to find relative pitch and heading angles
-        p_angle = acos(up.dot(norm_v)) - pi/2
-        h_angle = acos(right.dot(norm_v)) - pi/2
-        
-        torque_p = p_angle*self.pitch_torque_coefficient*speed
-        torque_h = h_angle*self.heading_torque_coefficient*speed
-        force_p = p_angle*self.pitch_force_coefficient*speed
-        force_h = h_angle*self.heading_force_coefficient*speed
-        
-        return Vec3(-torque_p, 0.0, torque_h), Vec3(-force_p, 0.0, force_h)
-    
-    def simulationTask(self,task):
-        """Update position and velocity based on aerodynamic forces."""
-        delta_time = global_clock.getDt()
-        self.accumulator += delta_time
-        updated = False
-        #print self.accumulator, delta_time
-        while self.accumulator > self.step_size:
-            self.accumulator -= self.step_size
-            updated = True
-            
-            position = self.position()
-            velocity = self.velocity()
-            speed = velocity.length()
-            norm_v = velocity + Vec3(0.0,0.0,0.0)
-            norm_v.normalize()
-            
-            yawv,pitchv,rollv = self.angVelBodyHpr()
-            
-            quat = self.quat()
-            forward = quat.getForward()
-            up = quat.getUp()
-            right = quat.getRight()
-            
-            linear_force = self._force(position,velocity,right,up,forward)
-            
-            self.ode_body.addForce(linear_force)
-
-            # Control forces:
-            elevator_af = self._controlRotForce(self.elevator,Vec3(1.0,0.0,0.0),
-                                                self.elevator_coefficient,
-                                                speed,pitchv,self.terminal_pitch)
-            ailerons_af = self._controlRotForce(self.ailerons,Vec3(0.0,1.0,0.0),
-                                                self.ailerons_coefficient,
-                                                speed,rollv,self.terminal_roll)
-            rudder_af = self._controlRotForce(self.rudder,Vec3(0.0,0.0,1.0),
-                                                self.rudder_coefficient,
-                                                speed,yawv,self.terminal_yaw)
-
-            # Damping forces
-            pitch_damping_avf = self._rotDamping(Vec3(1.0,0.0,0.0),pitchv,self.pitch_damping)
-            roll_damping_avf = self._rotDamping(Vec3(0.0,1.0,0.0),rollv,self.roll_damping)
-            yaw_damping_avf = self._rotDamping(Vec3(0.0,0.0,1.0),yawv,self.yaw_damping)
-
-            self.ode_body.addRelTorque(elevator_af + ailerons_af + rudder_af +
-                                     roll_damping_avf + pitch_damping_avf + yaw_damping_avf)
-
-            # Forces to rotate the forward vector towards the velocity vector
-            # and vice versa
-            fvv_torque, fvv_force = self._forwardAndVelocityVectorForces(up,right,norm_v,speed)
-            self.ode_body.addRelTorque(fvv_torque)
-            self.ode_body.addForce(fvv_force)
-
-            if position.getZ() < 0:
-                position.setZ(0)
-                velocity.setZ(0)
-                self.setPosition(position)
-                self.setVelocity(velocity)
-            self.rudder = 0.0
-            self.elevator = 0.0
-            self.ailerons = 0.0
-            self.world.quickStep(self.step_size)
-        if updated:
-            self.node.setPosQuat(render, self.position(), quat)
-        return task.cont
+        return Quat(*self.telemetry().quat)
+
+    def wake(self):
+        """Wake the plane up if it sleeps, e.g. after a collision."""
+        self.row()
+        self.batch.wake(self)
+
+    def sleeping(self):
+        return bool(self.batch.tiers[self.row()] == SLEEPING)
 
-    def destroy():
+    def destroy(self):
         """Call this while deactivating physics on a plane."""
-        # TODO: clean up stuff
-        pass
+        if self.index is not None:
+            self.batch.remove(self)
+
+
+# Test
+if __name__ == "__main__":
+    import time
+    world = PhysicsWorld(headless=True)
+    planes = [AeroplanePhysics(None, "griffin", world) for i in range(100)]
+    for i, plane in enumerate(planes):
+        plane.setPosition(Vec3(i * 100.0, 0, 1000))
+        plane.setVelocity(Vec3(0, 60, 0))
+        plane.setThrust(1.0)
+    start = time.time()
+    steps = world.simulate(60.0)
+    duration = time.time() - start
+    print "{} steps of {} planes in {:.2f}s ({:.0f} steps/s)".format(
+            steps, len(planes), duration, steps / duration)
+    print "first plane:", planes[0].position(), planes[0].speed()
+
+    # the telemetry must match the values computed from Panda vectors
+    for plane in planes[:5]:
+        quat = plane.quat()
+        acc = plane.acceleration - plane.gravity
+        angv = plane.angVelVector()
+        expected = (acc.dot(quat.getUp()) / 9.81,
+                    acc.dot(quat.getRight()) / 9.81,
+                    acc.dot(quat.getForward()) / 9.81, acc.length() / 9.81,
+                    angv.dot(quat.getUp()), angv.dot(quat.getRight()),
+                    angv.dot(quat.getForward()))
+        actual = (plane.gForce(), plane.lateralG(), plane.axialG(),
+                  plane.gForceTotal()) + plane.angVelBodyHpr()
+        assert numpy.allclose(expected, actual, atol=1e-4), (expected, actual)
+        assert plane.telemetry() is plane.telemetry()
+
+    # rolling back must give the same flight again
+    snapshot = world.snapshot()
+    world.simulate(5.0)
+    first = planes[0].position(), planes[0].quat()
+    world.restore(snapshot)
+    world.simulate(5.0)
+    assert planes[0].position() == first[0] and planes[0].quat() == first[1]
+    count = 1000
+    start = time.time()
+    for i in range(count):
+        world.snapshot(snapshot)
+    taken = time.time() - start
+    world.simulate(1.0)
+    later = world.snapshot()
+    # every plane moved between the two snapshots
+    start = time.time()
+    for i in range(count):
+        world.restore((snapshot, later)[i % 2])
+    restored = time.time() - start
+    # nothing changed since the last restore
+    start = time.time()
+    for i in range(count):
+        world.restore(later)
+    unchanged = time.time() - start
+    print "snapshot {:.1f}us, restore {:.1f}us ({:.1f}us unchanged)".format(
+            taken / count * 1e6, restored / count * 1e6,
+            unchanged / count * 1e6)
+
+    # adaptive substeps against small fixed steps, with planes rolling hard
+    def roll(world):
+        planes = []
+        for i in range(100):
+            plane = AeroplanePhysics(None, "griffin", world)
+            plane.setPosition(Vec3(i * 100.0, 0, 1000))
+            plane.setVelocity(Vec3(0, 60, 0))
+            plane.setThrust(1.0)
+            planes.append(plane)
+        start = time.time()
+        for step in range(int(round(10.0 / world.step_size))):
+            for i, plane in enumerate(planes[::2]):
+                plane.move("roll-left")
+            world.step()
+        return time.time() - start, world.aeroplanes.position[:100].copy()
+
+    fine, reference = roll(PhysicsWorld(0.005, headless=True,
+                                        integrator="semi-implicit"))
+    for max_substeps in (1, 8):
+        world = PhysicsWorld(0.04, headless=True, integrator="semi-implicit",
+                             max_plane_substeps=max_substeps)
+        duration, positions = roll(world)
+        error = numpy.sqrt(((positions - reference) ** 2).sum(axis=1)).max()
+        print "step 0.04s, up to {} substeps: {:.2f} force evaluations "\
+              "per plane and step, {:.2f}s ({:.2f}s with 0.005s steps), {:.2f}m off".format(
+              max_substeps, world.aeroplanes.averageSubsteps(), duration,
+              fine, error)
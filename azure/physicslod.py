@@ -0,0 +1,181 @@
+"""Level of detail for the physics: planes far away from the camera, or not
+in view at all, get cheaper flight models."""
+
+import numpy
+
+from pandac.PandaModules import Point2, Point3
+
+from errors import *
+from physics import Physical, FULL, POINT_MASS, DEAD_RECKONING, SLEEPING
+from physics import tier_names
+
+
+class PhysicsLOD(object):
+    """Assigns the planes of a physics world a fidelity tier by their
+    distance to the camera:
+
+    nearer than near -- FULL
+    nearer than far -- POINT_MASS
+    further away -- DEAD_RECKONING
+
+    Planes outside of the view of the camera drop one more tier. Sleeping
+    planes are left alone, they wake up by themselves. Planes
+    only change tiers once they are a fraction (hysteresis) beyond the
+    border, so planes on a border don't flip back and forth. Tiers are
+    updated every interval seconds.
+
+    For headless worlds, give a focus point instead of a camera and call
+    update() yourself.
+    """
+    def __init__(self, world=None, camera=None, near=1500.0, far=6000.0,
+                 interval=0.5, hysteresis=0.1):
+        """Arguments:
+        world -- PhysicsWorld, defaults to Physical.world
+        camera -- NodePath of a camera, defaults to base.cam unless the
+                  world is headless
+        """
+        self.world = world or Physical.world
+        self.batch = self.world.aeroplanes
+        if camera is None and not self.world.headless:
+            camera = base.cam
+        self.camera = camera
+        self.focus = Point3(0, 0, 0)
+        if far < near:
+            raise ParamError("far must not be nearer than near")
+        self.near = near
+        self.far = far
+        self.hysteresis = hysteresis
+        # plane-steps done in each tier since creation
+        self.tier_steps = [0, 0, 0, 0]
+        # number of tier changes since creation
+        self.transitions = 0
+        self._last_step = self.world.steps
+        self.task = None
+        if not self.world.headless:
+            self.task = taskMgr.doMethodLater(interval, self.updateTask,
+                                              "physics lod",
+                                              taskChain="world")
+
+    def setFocus(self, point):
+        """Point to measure distances from when there is no camera."""
+        self.focus = Point3(point)
+
+    def _visible(self, positions):
+        """Return a bool array telling which of the planes at positions are
+        in the view of the camera."""
+        lens = self.camera.node().getLens()
+        visible = numpy.ones(len(positions), bool)
+        p2 = Point2()
+        for j, p in enumerate(positions.tolist()):
+            p3 = self.camera.getRelativePoint(render, Point3(*p))
+            visible[j] = lens.project(p3, p2)
+        return visible
+
+    def update(self):
+        """Assign the tiers and count the plane-steps since last update."""
+        batch = self.batch
+        steps = self.world.steps - self._last_step
+        self._last_step = self.world.steps
+        for tier, count in enumerate(batch.tier_counts):
+            self.tier_steps[tier] += count * steps
+
+        n = len(batch)
+        if not n:
+            return
+        if self.camera is not None:
+            focus = self.camera.getPos(render)
+        else:
+            focus = self.focus
+        offsets = batch.position[:n] - numpy.array(focus)
+        distances = numpy.sqrt((offsets * offsets).sum(axis=1))
+        current = batch.tiers[:n]
+
+        # borders move outwards for planes that are in a finer tier, so
+        # they have to go a bit further to drop a tier than to get it back
+        tiers = numpy.zeros(n, int)
+        for tier, border in ((POINT_MASS, self.near),
+                             (DEAD_RECKONING, self.far)):
+            factor = numpy.where(current < tier, 1.0 + self.hysteresis,
+                                 1.0 - self.hysteresis)
+            tiers += distances > border * factor
+
+        if self.camera is not None:
+            rows = numpy.nonzero(tiers < DEAD_RECKONING)[0]
+            hidden = ~self._visible(batch.position[rows])
+            tiers[rows[hidden]] += 1
+        tiers[current == SLEEPING] = SLEEPING
+
+        self.transitions += int((tiers != current).sum())
+        batch.setTiers(tiers)
+
+    def updateTask(self, task):
+        self.update()
+        return task.again
+
+    def stats(self):
+        """Return a dict with the number of planes and the plane-steps done
+        in each tier, by tier name."""
+        return dict((name, {"planes": self.batch.tier_counts[tier],
+                            "plane_steps": self.tier_steps[tier]})
+                    for tier, name in enumerate(tier_names))
+
+    def destroy(self):
+        """Stop scheduling and give all planes the full model again, except
+        the sleeping ones."""
+        if self.task is not None:
+            taskMgr.remove(self.task)
+            self.task = None
+        current = self.batch.tiers[:len(self.batch)]
+        self.batch.setTiers(numpy.where(current == SLEEPING, SLEEPING, FULL))
+
+
+# Test
+if __name__ == "__main__":
+    import time
+    from pandac.PandaModules import Vec3
+    from physics import PhysicsWorld, AeroplanePhysics
+
+    def makeWorld():
+        world = PhysicsWorld(headless=True)
+        planes = []
+        for i in range(300):
+            plane = AeroplanePhysics(None, "griffin", world)
+            plane.setPosition(Vec3((i % 20) * 500.0, (i // 20) * 500.0,
+                                   1000.0))
+            plane.setVelocity(Vec3(0, 70, 0))
+            plane.setThrust(0.8)
+            planes.append(plane)
+        return world, planes
+
+    def fly(near, far):
+        world, planes = makeWorld()
+        scheduler = PhysicsLOD(world, near=near, far=far)
+        start = time.time()
+        for second in range(20):
+            scheduler.update()
+            world.simulate(1.0)
+        duration = time.time() - start
+        scheduler.update()
+        return duration, scheduler
+
+    full, scheduler = fly(1e9, 1e9)
+    reduced, scheduler = fly(1500.0, 4000.0)
+    print "300 planes for 20s: {:.2f}s with full physics, {:.2f}s with "\
+          "lod".format(full, reduced)
+    for name, stats in sorted(scheduler.stats().items()):
+        print "{:>15}: {planes:4} planes, {plane_steps:7} plane-steps".\
+              format(name, **stats)
+
+    # move the focus across the field, planes must not jump when they
+    # change tiers
+    world, planes = makeWorld()
+    scheduler = PhysicsLOD(world, near=1500.0, far=4000.0)
+    for second in range(40):
+        scheduler.setFocus(Point3(second * 250.0, second * 250.0, 1000.0))
+        before = [plane.position() for plane in planes]
+        scheduler.update()
+        world.step()
+        for plane, position in zip(planes, before):
+            assert (plane.position() - position).length() < 3.0
+        world.simulate(0.5)
+    print scheduler.transitions, "tier changes without jumps"
@@ -1,12 +1,39 @@
 from direct.showbase.DirectObject import DirectObject
+from pandac.PandaModules import FontPool, TexturePool, ConfigVariableInt
 
 from azure.loaderglobal import loader
+from errors import ScenarioLoadingError
+
+# number of threads loading the assets that are not models (see
+# pool_loaders) in the background. models use the loader threads
+threads_config = ConfigVariableInt("loader-num-threads", 1)
+
+
+def _loadSound(name):
+    # the loader threads of Panda load sounds the same way
+    return base.sfxManagerList[0].getSound(name)
+
+# functions loading one asset into the pool that hands it out later (e.g.
+# TexturePool.loadTexture() in Water), form: {name of asset list: function}
+pool_loaders = {"fonts": FontPool.loadFont,
+                "sounds": _loadSound,
+                "textures": TexturePool.loadTexture,
+                "textures3d": TexturePool.load3dTexture,
+                "cubemaps": TexturePool.loadCubeMap}
+
 
 def scenarioPreloader(scenario):
     """Create a preloader and attach values from a scenario file to it, then
     return it."""
     preloader = Preloader()
-    s = scenario
+    if isinstance(scenario, basestring):
+        import scenarios
+        try:
+            scenario = getattr(scenarios, scenario)
+        except AttributeError:
+            raise ScenarioLoadingError(scenario)
+    # the asset lists are set up by the constructor of a scenario
+    s = scenario()
     preloader.models = s.models if hasattr(s, "models") else []
     preloader.fonts = s.fonts if hasattr(s, "fonts") else []
     preloader.sounds = s.sounds if hasattr(s, "sounds") else []
@@ -35,6 +62,15 @@ class Preloader(DirectObject):
         self._preloaded = 0
         self._progress_cached = -1
         self._progress_f_cached = -1.0
+        # pending asynchronous model requests, assets left for
+        # preloadPerFrame() and the function to call when done
+        self._requests = []
+        self._pending = []
+        self._callback = None
+        # assets from the preloading threads that are not counted yet, and
+        # the number of load tasks that didn't report back
+        self._finished = []
+        self._finished_tasks = 0
 
     @property
     def progress(self):
@@ -43,12 +79,7 @@ class Preloader(DirectObject):
         # through the multiplication we save ourselves a floating point
         # division
         if self._progress_cached < 0:
-            items_len = len(self.models)+\
-                        len(self.fonts)+\
-                        len(self.sounds)+\
-                        len(self.textures)+\
-                        len(self.textures3d)+\
-                        len(self.cubemaps)
+            items_len = self._count()
             if items_len != 0:
                 result = self._preloaded  * 100 / items_len
             else:
@@ -64,12 +95,7 @@ class Preloader(DirectObject):
         (range 0.0 - 1.0). This is slightly slower than the upper function.
         """
         if self._progress_f_cached < 0:
-            items_len = len(self.models)+\
-                        len(self.fonts)+\
-                        len(self.sounds)+\
-                        len(self.textures)+\
-                        len(self.textures3d)+\
-                        len(self.cubemaps)
+            items_len = self._count()
             if items_len != 0:
                 result = self._preloaded / float(items_len)
             else:
@@ -79,72 +105,163 @@ class Preloader(DirectObject):
         else:
             return self._progress_f_cached
 
+    def _count(self):
+        return len(self.models)+\
+               len(self.fonts)+\
+               len(self.sounds)+\
+               len(self.textures)+\
+               len(self.textures3d)+\
+               len(self.cubemaps)
+
+    @property
+    def done(self):
+        """True when all assets are loaded."""
+        return self._preloaded >= self._count()
+
     # Convenience functions.
-    def preloadFast(self, *args):
-        """Load everything in one frame. This uses doMethodLater for loading in
-        next frame, so wen can show a loading screen in the meanwhile."""
-        return self.preload(async=False, atonce=True)
+    def preloadFast(self, callback=None):
+        """Load everything at once. Blocks until all assets are loaded, so
+        the window doesn't redraw in the meanwhile."""
+        return self.preload(async=False, atonce=True, callback=callback)
 
-    def preloadPerFrame(self):
+    def preloadPerFrame(self, callback=None):
         """Every frame one asset is loaded. Frames might last long."""
-        return self.addTask(self.preload, "preloading",
-                            extraArgs={"async":False, "atonce":False})
+        return self.preload(async=False, atonce=False, callback=callback)
 
     def preloadBackground(self, callback=None):
         """Progress indicator will jump after each batch.
         Arguments:
         callback -- a function to call upon finish
         """
-        return self.addTask(self.preload, "preloading",
-                            extraArgs={"async":True, "atonce":True})
+        return self.preload(async=True, atonce=True, callback=callback)
 
     def preloadBackgroundResponsive(self, callback=None):
         """Progress indicator will raise after each loaded asset.
         Arguments:
         callback -- a function to call upon finish
         """
-        return self.addTask(self.preload, "preloading",
-                            extraArgs={"async":True, "atonce":False})
-
+        return self.preload(async=True, atonce=False, callback=callback)
 
-    def preload(self, task=None, async=False, atonce=False, force=False):
+    def preload(self, async=False, atonce=False, callback=None, force=False):
         """Preload 3d models, fonts and other assets that are assigned to self
         as lists.
-        
+
         Arguments:
-        task -- when using async, this function is passed to a task manager.
-                this arg will be filled by a task manager in such a case
-        async -- load asynchronously (in a new thread). this keeps the whole
-                 program responsive
-        atonce -- load all models at once, which is slightly faster, or one by
-                  one, which can be used for better verbosity
+        async -- load asynchronously (on the loader threads). this keeps the
+                 whole program responsive
+        atonce -- load all assets of a kind at once, which is slightly faster,
+                  or one by one, which can be used for better verbosity.
+                  without async, one by one means one per frame. with async,
+                  the kinds are loaded in parallel
+        callback -- a function to call (without arguments) when all assets
+                    are loaded. it is called right away when there is nothing
+                    to load, otherwise from a later task or event
         force -- load models even if the indicator says they already are.
                  this resets the loading progress var
         """
-        # TODO: preload not only models, but also other assets
-
-        if self.progress == 1:
-            if force:
-                self._preloaded = 0
-            else:
-                return
-
-        def setStatus(*args):
-            self._progress_cached = -1
-            self._progress_f_cached = -1.0
-            self._preloaded += len(args)
+        self.cancel()
+        if force:
+            self._setStatus(reset=True)
+        if self.done:
+            if callback is not None:
+                callback()
+            return
+        self._callback = callback
 
         if async:
             if atonce:
-                self.loader.loadModel(self.models, callback=setStatus)
+                if self.models:
+                    self._requests.append(self.loader.loadModel(self.models,
+                                          callback=self._loaded))
+                for kind, load in pool_loaders.items():
+                    names = getattr(self, kind)
+                    if names:
+                        self._addLoadTask(load, names)
             else:
                 for model in self.models:
-                    self.loader.loadModel(model, callback=setStatus)
-                    yield
+                    self._requests.append(self.loader.loadModel(model,
+                                          callback=self._loaded))
+                for kind, load in pool_loaders.items():
+                    for name in getattr(self, kind):
+                        self._addLoadTask(load, [name])
+            if self._finished_tasks:
+                self.addTask(self._collect, "collect preloaded assets")
         else:
             if atonce:
-                setStatus(self.loader.loadModel(self.models))
+                if self.models:
+                    self._loaded(self.loader.loadModel(self.models))
+                for kind, load in pool_loaders.items():
+                    names = getattr(self, kind)
+                    if names:
+                        self._loaded([load(name) for name in names])
             else:
-                for model in self.models:
-                    setStatus(self.loader.loadModel(model))
-                    yield
+                self._pending = [(self.loader.loadModel, model)
+                                 for model in self.models]
+                for kind, load in pool_loaders.items():
+                    self._pending.extend((load, name)
+                                         for name in getattr(self, kind))
+                self.addTask(self._loadNext, "preloading")
+
+    def cancel(self):
+        """Stop loading. Assets loaded so far stay loaded, the callback is not
+        called."""
+        for request in self._requests:
+            self.loader.cancelRequest(request)
+        self._requests = []
+        self._pending = []
+        self._finished = []
+        self._finished_tasks = 0
+        self._callback = None
+        self.removeAllTasks()
+
+    def _loadNext(self, task):
+        """Task loading one asset per frame."""
+        load, name = self._pending.pop(0)
+        self._loaded(load(name))
+        if self._pending:
+            return task.cont
+        return task.done
+
+    def _addLoadTask(self, load, names):
+        """Load assets with a pool function on the preloading threads."""
+        base.taskMgr.setupTaskChain("preloading",
+                                    numThreads=threads_config.getValue())
+        # a thread that finishes after cancel() appends to a list that is no
+        # longer looked at
+        self.addTask(self._loadInThread, "preloading",
+                     extraArgs=[load, names, self._finished],
+                     taskChain="preloading")
+        self._finished_tasks += 1
+
+    @staticmethod
+    def _loadInThread(load, names, finished):
+        # appending is atomic, the assets are counted by _collect()
+        finished.append([load(name) for name in names])
+
+    def _collect(self, task):
+        """Task counting the assets loaded by the preloading threads. It runs
+        on the main thread, so the callback does as well."""
+        while self._finished:
+            self._finished_tasks -= 1
+            self._loaded(self._finished.pop(0))
+        if self._finished_tasks:
+            return task.cont
+        return task.done
+
+    def _loaded(self, assets):
+        """Called with a loaded asset or a list of loaded assets."""
+        if not isinstance(assets, list):
+            assets = [assets]
+        self._setStatus(len(assets))
+        if self.done and self._callback is not None:
+            callback = self._callback
+            self._requests = []
+            self._callback = None
+            callback()
+
+    def _setStatus(self, loaded=0, reset=False):
+        if reset:
+            self._preloaded = 0
+        self._preloaded += loaded
+        self._progress_cached = -1
+        self._progress_f_cached = -1.0
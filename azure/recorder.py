@@ -0,0 +1,379 @@
+"""Flight recorder. Records the state of aeroplanes every physics step into a
+binary file and replays it by moving their nodes, without simulating them.
+
+File layout (all numbers little endian):
+
+    header  -- magic "AZFR", version, flags, number of planes, number of
+               fields per record, steps per chunk, step size, length of the
+               plane names; followed by the comma separated spec names
+    chunks  -- each: number of steps, stored size in bytes, data.
+               data is steps * planes * fields float32 values, zlib
+               compressed if the compression flag is set
+    footer  -- number of chunks, number of steps, offset of each chunk's
+               data
+    trailer -- offset of the footer
+
+Every chunk except the last one holds the same number of steps, so finding
+the chunk of a time is a division and a lookup in the footer. Only that
+chunk is read from the memory mapped file, so replays of long sessions
+don't load the whole file into memory. Files of interrupted recordings have
+no footer, the replayer then finds the chunks by reading their headers.
+"""
+
+import mmap
+import struct
+import zlib
+import threading
+from Queue import Queue
+import numpy
+
+from pandac.PandaModules import Point3, Quat
+
+from errors import *
+from physics import AeroplaneBatch
+
+magic = "AZFR"
+version = 1
+COMPRESSED = 1
+
+# a record is the first part of a row of the state array of the aeroplane
+# batch
+fields = AeroplaneBatch.flight_state
+record_size = sum(width for name, width in fields)
+
+_header = struct.Struct("<4sHHIIIdI")
+_chunk_header = struct.Struct("<II")
+_footer = struct.Struct("<IQ")
+_trailer = struct.Struct("<Q")
+
+
+class FlightRecorder(object):
+    """Samples position, quaternion, velocity, angular velocity, thrust and
+    control surfaces of planes after each step of a physics world. Records
+    are collected in memory and written in chunks, so a step only costs one
+    copy of the state array of the aeroplane batch. Chunks are compressed
+    and written by a thread of their own (zlib doesn't hold the GIL).
+
+        recorder = FlightRecorder("flight.azr", world)
+        ...
+        recorder.close()
+    """
+    def __init__(self, filename, world, planes=None, chunk_steps=500,
+                 compress=True):
+        """Arguments:
+        filename -- file to write to. An existing file is overwritten.
+        world -- PhysicsWorld to record
+        planes -- list of AeroplanePhysics, defaults to all planes in world
+        chunk_steps -- steps per chunk
+        compress -- zlib compress the chunks
+        """
+        self.world = world
+        self.batch = world.aeroplanes
+        if planes is None:
+            planes = list(self.batch.planes)
+        if not planes:
+            raise ParamError("Nothing to record.")
+        self.planes = planes
+        self.chunk_steps = chunk_steps
+        self.compress = compress
+        self.steps = 0
+        self.chunk_offsets = []
+
+        self._buffer = numpy.zeros((chunk_steps, len(planes), record_size))
+        self._row = 0
+        self._revision = None
+        self._rows = None
+
+        self.file = open(filename, "wb")
+        names = ",".join(p.spec.name for p in planes)
+        self.file.write(_header.pack(magic, version,
+                                     COMPRESSED if compress else 0,
+                                     len(planes), record_size, chunk_steps,
+                                     world.step_size, len(names)))
+        self.file.write(names)
+
+        self._chunks = Queue()
+        self._writer = threading.Thread(target=self._writeChunks,
+                                        name="flight recorder")
+        self._writer.daemon = True
+        self._writer.start()
+        world.addStepHook(self.record)
+
+    def _lookUpRows(self):
+        """Find the batch rows of the recorded planes. None if they are
+        exactly the first rows in order."""
+        self._revision = self.batch.revision
+        rows = [p.index for p in self.planes]
+        if rows == list(range(len(rows))):
+            self._rows = None
+        else:
+            self._rows = rows
+
+    def record(self, step_size):
+        """Sample the recorded planes. This is the step hook."""
+        if self._revision != self.batch.revision:
+            self._lookUpRows()
+        rows = self._rows
+        if rows is None:
+            self._buffer[self._row] = self.batch.state[:len(self.planes),
+                                                       :record_size]
+        else:
+            out = self._buffer[self._row]
+            for j, i in enumerate(rows):
+                # planes destroyed in the meantime are recorded as NaN
+                if i is None:
+                    out[j] = numpy.nan
+                else:
+                    out[j] = self.batch.state[i,:record_size]
+        self._row += 1
+        self.steps += 1
+        if self._row == self.chunk_steps:
+            self.flush()
+
+    def flush(self):
+        """Hand the collected records to the writer thread as a chunk."""
+        if not self._row:
+            return
+        self._chunks.put((self._row, self._buffer[:self._row].astype("<f4")))
+        self._row = 0
+
+    def _writeChunks(self):
+        """Compress and write chunks until None is queued. This runs in the
+        writer thread."""
+        while True:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return
+            steps, records = chunk
+            data = records.tobytes()
+            if self.compress:
+                data = zlib.compress(data, 1)
+            self.file.write(_chunk_header.pack(steps, len(data)))
+            self.chunk_offsets.append(self.file.tell())
+            self.file.write(data)
+
+    def close(self):
+        """Stop recording and finish the file."""
+        if self.file is None:
+            return
+        self.world.removeStepHook(self.record)
+        self.flush()
+        self._chunks.put(None)
+        self._writer.join()
+        footer = self.file.tell()
+        self.file.write(_footer.pack(len(self.chunk_offsets), self.steps))
+        self.file.write(struct.pack("<{}Q".format(len(self.chunk_offsets)),
+                                    *self.chunk_offsets))
+        self.file.write(_trailer.pack(footer))
+        self.file.close()
+        self.file = None
+
+
+class FlightReplay(object):
+    """Plays back a recorded flight. The file is memory mapped and only the
+    chunk needed for the current time is decoded.
+
+    Either call setTime() yourself or start() a task which plays the flight
+    in real time. The nodes are moved in render coordinates, blending
+    between the two records around the time.
+    """
+    def __init__(self, filename, nodes=()):
+        """Arguments:
+        filename -- recorded file
+        nodes -- NodePaths to move, one per recorded plane, in the order of
+                 recording. None entries are skipped.
+        """
+        self.file = open(filename, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            raise ResourceLoadError(filename, "empty or unreadable file")
+        (tag, file_version, flags, self.plane_count, self.fields,
+         self.chunk_steps, self.step_size, names_length) = \
+                _header.unpack_from(self.map, 0)
+        if tag != magic or file_version != version:
+            raise ResourceLoadError(filename, "not a flight recording")
+        start = _header.size
+        self.names = self.map[start:start+names_length].split(",")
+        self.compressed = bool(flags & COMPRESSED)
+        self.chunks = self._readFooter(start + names_length)
+        self.steps = sum(steps for offset, steps, size in self.chunks)
+
+        self.nodes = list(nodes)
+        self.time = 0.0
+        self.task = None
+        self._chunk_index = None
+        self._chunk = None
+
+    def _readFooter(self, first_chunk):
+        """Return a list of (offset, steps, size) for each chunk."""
+        end = len(self.map)
+        footer = -1
+        if end >= first_chunk + _footer.size + _trailer.size:
+            footer, = _trailer.unpack_from(self.map, end - _trailer.size)
+        if first_chunk <= footer <= end - _footer.size - _trailer.size:
+            count, steps = _footer.unpack_from(self.map, footer)
+            # the trailer of a complete file follows right after the footer
+            if footer + _footer.size + count * 8 + _trailer.size == end:
+                offsets = struct.unpack_from("<{}Q".format(count), self.map,
+                                             footer + _footer.size)
+                chunks = []
+                for offset in offsets:
+                    steps, size = _chunk_header.unpack_from(self.map,
+                            offset - _chunk_header.size)
+                    chunks.append((offset, steps, size))
+                return chunks
+        # the recording was interrupted, walk the chunk headers instead
+        chunks = []
+        offset = first_chunk
+        while offset + _chunk_header.size <= end:
+            steps, size = _chunk_header.unpack_from(self.map, offset)
+            offset += _chunk_header.size
+            if offset + size > end:
+                break
+            chunks.append((offset, steps, size))
+            offset += size
+        return chunks
+
+    def duration(self):
+        """Length of the recording in seconds."""
+        return max(self.steps - 1, 0) * self.step_size
+
+    def _loadChunk(self, index):
+        """Return the records of a chunk as array (steps, planes, fields).
+        The last decoded chunk is kept."""
+        if index != self._chunk_index:
+            offset, steps, size = self.chunks[index]
+            if self.compressed:
+                data = numpy.frombuffer(zlib.decompress(
+                        self.map[offset:offset+size]), "<f4")
+            else:
+                data = numpy.frombuffer(self.map, "<f4",
+                        steps * self.plane_count * self.fields, offset)
+            self._chunk = data.reshape(steps, self.plane_count, self.fields)
+            self._chunk_index = index
+        return self._chunk
+
+    def records(self, step):
+        """Return the records of all planes at a step as array
+        (planes, fields). Columns are in the order of fields. The array is a
+        copy, it stays valid after close()."""
+        if not 0 <= step < self.steps:
+            raise ParamError("Step {} is not in the recording.".format(step))
+        chunk = self._loadChunk(step // self.chunk_steps)
+        # uncompressed chunks are views of the mapped file, which can't be
+        # closed while views of it exist
+        return chunk[step % self.chunk_steps].copy()
+
+    def sample(self, time):
+        """Return positions and quaternions of all planes at a time, blended
+        between the two records around it."""
+        time = min(max(time, 0.0), self.duration())
+        step = int(time / self.step_size)
+        alpha = time / self.step_size - step
+        current = self.records(step)
+        position = current[:,0:3].astype(float)
+        quat = current[:,3:7].astype(float)
+        if alpha > 0.0 and step + 1 < self.steps:
+            following = self.records(step + 1)
+            position += (following[:,0:3] - position) * alpha
+            # nlerp is close enough for the small rotation within a step
+            q = following[:,3:7]
+            sign = numpy.where((quat * q).sum(axis=1) < 0.0, -1.0, 1.0)
+            quat += (q * sign[:,None] - quat) * alpha
+            quat /= numpy.sqrt((quat * quat).sum(axis=1))[:,None]
+        return position, quat
+
+    def setTime(self, time):
+        """Move the nodes to where the planes were at a time."""
+        self.time = time
+        position, quat = self.sample(time)
+        for node, p, q in zip(self.nodes, position.tolist(), quat.tolist()):
+            if node is not None:
+                node.setPosQuat(render, Point3(*p), Quat(*q))
+
+    def start(self, time=None):
+        """Play the recording in real time from the current or the given
+        time."""
+        if time is not None:
+            self.time = time
+        if self.task is None:
+            self.task = taskMgr.add(self.replayTask, "flight replay")
+
+    def stop(self):
+        if self.task is not None:
+            taskMgr.remove(self.task)
+            self.task = None
+
+    def replayTask(self, task):
+        self.setTime(self.time + globalClock.getDt())
+        if self.time >= self.duration():
+            self.task = None
+            return task.done
+        return task.cont
+
+    def close(self):
+        self.stop()
+        # the only view of the mapped file
+        self._chunk = None
+        self._chunk_index = None
+        self.map.close()
+        self.file.close()
+
+
+# Test
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from timeit import repeat
+    from pandac.PandaModules import Vec3
+    from physics import PhysicsWorld, AeroplanePhysics
+
+    def makeWorld(count):
+        world = PhysicsWorld(headless=True)
+        planes = [AeroplanePhysics(None, "griffin", world)
+                  for i in range(count)]
+        for i, plane in enumerate(planes):
+            plane.setPosition(Vec3(i * 100.0, 0, 1000))
+            plane.setVelocity(Vec3(0, 60, 0))
+            plane.setThrust(1.0)
+        return world, planes
+
+    def fly(count, seconds, filename, compress=True):
+        world, planes = makeWorld(count)
+        recorder = FlightRecorder(filename, world, compress=compress)
+        for step in range(int(seconds / world.step_size)):
+            planes[0].move("roll-left")
+            world.step()
+        recorder.close()
+        return planes
+
+    filename = os.path.join(tempfile.gettempdir(), "azure-test.azr")
+    for count in (1, 100, 1000):
+        world, planes = makeWorld(count)
+        recorder = FlightRecorder(filename, world)
+        world.removeStepHook(recorder.record)
+        step = min(repeat(world.step, number=200, repeat=5))
+        record = min(repeat(lambda: recorder.record(world.step_size),
+                            number=200, repeat=5))
+        world.addStepHook(recorder.record)
+        recorder.close()
+        print "{} planes: recording overhead {:.2%}".format(count,
+                                                            record / step)
+
+    for compress in (True, False):
+        planes = fly(3, 30, filename, compress)
+        replay = FlightReplay(filename)
+        assert replay.steps == 1500 and len(replay.chunks) == 3
+        assert replay.names == ["griffin"] * 3
+        last = replay.records(replay.steps - 1)
+        assert numpy.allclose(last[1,0:3], planes[1].position(), atol=1e-2)
+        assert last[0,14] == -1.0
+        position, quat = replay.sample(12.345)
+        print "compressed" if compress else "raw", os.path.getsize(filename),\
+              "bytes, plane 0 at 12.345s:", position[0]
+        replay.close()
+        # records are copies, closing the file leaves them intact
+        assert last[0,14] == -1.0
+    os.remove(filename)
@@ -1,8 +1,18 @@
+from pandac.PandaModules import ConfigVariableString
+
+# file to record the input of the flight to, and file to fly a recorded
+# flight from instead of the keyboard (see controls/inputrecording.py)
+record_config = ConfigVariableString("azure-input-record", "")
+playback_config = ConfigVariableString("azure-input-playback", "")
+
+
 class Developmentenvironment(object):
     def __init__(self):
         self.name = "Development Environment"
         # having such long paths here is so suboptimal..
-        self.models = ["planes/griffin/griffin",]
+        self.models = ["planes/griffin/griffin", "misc/invcube"]
+        self.textures = ["textures/water.diffuse.png"]
+        self.cubemaps = ["skyboxes/bluesky/#.jpg"]
 
     def prepare(*args, **kwargs):
         pass
@@ -21,7 +31,15 @@ class Developmentenvironment(object):
         griffin.physics.setThrust(1)
 
         m.views.setView("PlaneView", griffin)
-        m.controls.addAndActivate("PlaneFlight", griffin, m.views.getView())
+        if playback_config.getValue():
+            m.controls.addAndActivate("FlightPlayback", griffin,
+                                      m.views.getView(),
+                                      playback_config.getValue())
+        else:
+            flight = m.controls.addAndActivate("PlaneFlight", griffin,
+                                               m.views.getView())
+            if record_config.getValue():
+                flight.startRecording(record_config.getValue())
         # alternative syntax:
         # pf = m.controls.add("PlaneFlight", griffin)
         # m.controls.activate(pf)
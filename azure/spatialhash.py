@@ -0,0 +1,182 @@
+"""Broad phase for questions like "which planes are near this one" or
+"which planes are close to each other", without comparing every plane with
+every other one."""
+
+from math import ceil
+from itertools import combinations, product
+import numpy
+
+
+class SpatialHash(object):
+    """Sorts the planes of a physics world into the cubic cells of a uniform
+    grid after each world step. Only planes that moved into another cell
+    are updated. Planes moved between steps (e.g. by setPosition()) are
+    sorted in by the next query. Queries then look at the cells in range
+    only and check the exact distance of the planes in them, which takes
+    roughly linear time in the number of planes as long as they don't all
+    crowd into a few cells.
+
+    cell_size should be about the distance of the most common query.
+
+        proximity = SpatialHash(world, 500.0)
+        world.step()
+        for a, b in proximity.pairsWithin(50.0):
+            ...
+    """
+    def __init__(self, world, cell_size=500.0):
+        self.world = world
+        self.batch = world.aeroplanes
+        self.cell_size = float(cell_size)
+        # planes (batch rows) in each cell. form: {(x, y, z): set([row])}
+        self.buckets = {}
+        # cell of each batch row
+        self.cells = numpy.zeros((0, 3), int)
+        self._revision = None
+        # frame of the aeroplane batch the cells were computed for
+        self._frame = None
+        self.update()
+        world.addStepHook(self.update)
+
+    def _cellsOf(self, positions):
+        return numpy.floor(positions / self.cell_size).astype(int)
+
+    def rebuild(self):
+        """Sort all planes into the grid again."""
+        self._revision = self.batch.revision
+        self._frame = self.batch.frame
+        n = len(self.batch)
+        self.cells = self._cellsOf(self.batch.position[:n])
+        self.buckets = {}
+        for row, cell in enumerate(map(tuple, self.cells.tolist())):
+            self.buckets.setdefault(cell, set()).add(row)
+
+    def update(self, step_size=None):
+        """Move planes that changed their cell. This is the step hook."""
+        if self._revision != self.batch.revision:
+            self.rebuild()
+            return
+        self._frame = self.batch.frame
+        n = len(self.batch)
+        cells = self._cellsOf(self.batch.position[:n])
+        moved = numpy.nonzero((cells != self.cells).any(axis=1))[0]
+        if len(moved):
+            old = self.cells[moved].tolist()
+            new = cells[moved].tolist()
+            buckets = self.buckets
+            for row, old_cell, new_cell in zip(moved.tolist(), old, new):
+                bucket = buckets[tuple(old_cell)]
+                bucket.discard(row)
+                if not bucket:
+                    del buckets[tuple(old_cell)]
+                buckets.setdefault(tuple(new_cell), set()).add(row)
+            self.cells = cells
+
+    def _refresh(self):
+        """Catch up with changes of the batch since the last update."""
+        if self._frame != self.batch.frame or \
+           self._revision != self.batch.revision:
+            self.update()
+
+    def _reach(self, distance):
+        return int(ceil(distance / self.cell_size))
+
+    def neighbors(self, plane, radius):
+        """Return the planes within radius of plane, nearest first."""
+        self._refresh()
+        i = plane.index
+        x, y, z = self.cells[i].tolist()
+        r = self._reach(radius)
+        rows = []
+        get = self.buckets.get
+        for dx, dy, dz in product(range(-r, r + 1), repeat=3):
+            bucket = get((x + dx, y + dy, z + dz))
+            if bucket:
+                rows.extend(bucket)
+        rows.remove(i)
+        if not rows:
+            return []
+        rows = numpy.array(rows)
+        offsets = self.batch.position[rows] - self.batch.position[i]
+        distances = (offsets * offsets).sum(axis=1)
+        within = distances <= radius * radius
+        rows = rows[within][numpy.argsort(distances[within])]
+        planes = self.batch.planes
+        return [planes[row] for row in rows.tolist()]
+
+    def pairsWithin(self, distance):
+        """Return a list of all pairs of planes (a, b) at most distance
+        apart. Each pair is listed once."""
+        self._refresh()
+        r = self._reach(distance)
+        # each pair of cells is visited once: the cell itself and the half of
+        # its neighbours that comes after it
+        forward = [o for o in product(range(-r, r + 1), repeat=3)
+                   if o > (0, 0, 0)]
+        first = []
+        second = []
+        get = self.buckets.get
+        for (x, y, z), bucket in self.buckets.items():
+            if len(bucket) > 1:
+                for a, b in combinations(bucket, 2):
+                    first.append(a)
+                    second.append(b)
+            for dx, dy, dz in forward:
+                other = get((x + dx, y + dy, z + dz))
+                if other:
+                    for a in bucket:
+                        for b in other:
+                            first.append(a)
+                            second.append(b)
+        if not first:
+            return []
+        first = numpy.array(first)
+        second = numpy.array(second)
+        offsets = self.batch.position[first] - self.batch.position[second]
+        within = (offsets * offsets).sum(axis=1) <= distance * distance
+        planes = self.batch.planes
+        return [(planes[a], planes[b]) for a, b in
+                zip(first[within].tolist(), second[within].tolist())]
+
+    def destroy(self):
+        self.world.removeStepHook(self.update)
+        self.buckets = {}
+
+
+# Test
+if __name__ == "__main__":
+    import random
+    from pandac.PandaModules import Vec3
+    from physics import PhysicsWorld, AeroplanePhysics
+
+    world = PhysicsWorld(headless=True)
+    planes = [AeroplanePhysics(None, "griffin", world) for i in range(300)]
+    r = random.Random(1)
+    for plane in planes:
+        plane.setPosition(Vec3(r.uniform(-3000, 3000), r.uniform(-3000, 3000),
+                               r.uniform(500, 1500)))
+        plane.setVelocity(Vec3(r.uniform(-50, 50), r.uniform(-50, 50), 0))
+        plane.setThrust(1.0)
+    proximity = SpatialHash(world, 250.0)
+    world.simulate(10.0)
+    planes[-1].destroy()
+    planes.pop()
+
+    def naivePairs(distance):
+        pairs = set()
+        for i, a in enumerate(planes):
+            for b in planes[i+1:]:
+                if (a.position() - b.position()).length() <= distance:
+                    pairs.add(frozenset((a, b)))
+        return pairs
+
+    for distance in (100.0, 250.0, 600.0):
+        pairs = set(frozenset(p) for p in proximity.pairsWithin(distance))
+        assert pairs == naivePairs(distance), distance
+    # moved between steps, the next query has to see it
+    planes[1].setPosition(planes[0].position() + Vec3(10, 0, 0))
+    assert planes[1] in proximity.neighbors(planes[0], 20.0)
+    near = proximity.neighbors(planes[0], 400.0)
+    assert set(near) == set(p for p in planes[1:] if
+            (p.position() - planes[0].position()).length() <= 400.0)
+    print len(proximity.pairsWithin(250.0)), "pairs within 250m,", \
+          len(near), "planes within 400m of the first one"
@@ -0,0 +1,163 @@
+"""Aircraft specifications. Each aircraft type from etc/aeroplanes.ini is
+parsed only once into an immutable AeroplaneSpec, which is shared by all
+planes of that type."""
+
+import os
+from math import radians, pi
+from ConfigParser import SafeConfigParser
+
+from errors import ResourceLoadError
+from utils import ListInterpolator
+
+specs_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, "etc", "aeroplanes.ini")
+
+# density of air: rho = 1.2041 kg m-3
+half_rho = 0.602
+
+
+class AeroplaneSpec(object):
+    """Flight parameters of one aircraft type, together with the constants
+    precalculated from them. Attributes can't be changed after creation.
+    The lift and drag tables are shared as well, so don't modify them.
+    """
+    # values read from the specs file
+    floats = ("mass", "max_speed", "roll_speed", "pitch_speed", "yaw_speed",
+              "max_thrust", "wing_area", "wing_span",
+              "drag_coef_x", "drag_coef_y", "drag_coef_z",
+              "drag_area_x", "drag_area_y", "drag_area_z",
+              "lift_low", "lift_high", "drag_low", "drag_high",
+              "yaw_damping", "pitch_damping", "roll_damping",
+              "terminal_yaw", "terminal_pitch", "terminal_roll",
+              "rudder_coefficient", "elevator_coefficient",
+              "ailerons_coefficient",
+              "pitch_force_coefficient", "heading_force_coefficient",
+              "pitch_torque_coefficient", "heading_torque_coefficient")
+    tables = ("lift_vs_aoa", "drag_vs_aoa")
+    # values calculated from the others
+    constants = ("aspect_ratio", "lift_factor", "lift_induced_drag_factor",
+                 "drag_factor_x", "drag_factor_y", "drag_factor_z",
+                 "liftvsaoa", "dragvsaoa")
+
+    __slots__ = ("name",) + floats + tables + constants
+
+    def __init__(self, name, values):
+        """Arguments:
+        name -- name of the aircraft type
+        values -- dict with a value for each name in floats and tables.
+                  tables are lists of [angle of attack in degrees, value]
+        """
+        s = lambda attr, value: object.__setattr__(self, attr, value)
+        s("name", name)
+        for attr in self.floats:
+            s(attr, float(values[attr]))
+        for attr in self.tables:
+            s(attr, tuple(tuple(p) for p in values[attr]))
+
+        # precalculated values for combinations of variables
+        s("aspect_ratio", self.wing_span * self.wing_span / self.wing_area)
+        s("lift_factor", half_rho * self.wing_area)
+        # could modify lift_induced_drag by a factor of 1.05 to 1.15
+        s("lift_induced_drag_factor", (-1.0) * self.lift_factor /
+                                      (pi*self.aspect_ratio))
+        s("drag_factor_x", (-1.0) * half_rho * self.drag_area_x *
+                                               self.drag_coef_x)
+        s("drag_factor_y", (-1.0) * half_rho * self.drag_area_y *
+                                               self.drag_coef_y)
+        s("drag_factor_z", (-1.0) * half_rho * self.drag_area_z *
+                                               self.drag_coef_z)
+        s("liftvsaoa", ListInterpolator([[radians(a), c] for a, c in
+                                         self.lift_vs_aoa],
+                                        self.lift_low, self.lift_high))
+        s("dragvsaoa", ListInterpolator([[radians(a), c] for a, c in
+                                         self.drag_vs_aoa],
+                                        self.drag_low, self.drag_high))
+
+    def derive(self, name=None, **values):
+        """Return a new spec with some values changed, e.g.
+        spec.derive(roll_damping=-50.0). Lift and drag tables are shared
+        with this spec unless they are changed, too."""
+        for attr in values:
+            if attr not in self.floats + self.tables:
+                raise AttributeError("AeroplaneSpec has no value "
+                                     "{}".format(attr))
+        for attr in self.floats + self.tables:
+            values.setdefault(attr, getattr(self, attr))
+        spec = AeroplaneSpec(name or self.name, values)
+        if (spec.lift_vs_aoa, spec.lift_low, spec.lift_high) == \
+           (self.lift_vs_aoa, self.lift_low, self.lift_high):
+            object.__setattr__(spec, "liftvsaoa", self.liftvsaoa)
+        if (spec.drag_vs_aoa, spec.drag_low, spec.drag_high) == \
+           (self.drag_vs_aoa, self.drag_low, self.drag_high):
+            object.__setattr__(spec, "dragvsaoa", self.dragvsaoa)
+        return spec
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("AeroplaneSpec is read-only")
+
+    def __delattr__(self, attr):
+        raise AttributeError("AeroplaneSpec is read-only")
+
+    def __repr__(self):
+        return "AeroplaneSpec {}".format(self.name)
+
+
+_parser = None
+_specs = {}
+
+def _parseTable(text):
+    """Parse "x: y, x: y, ..." into a list of [x, y]."""
+    table = []
+    for pair in text.split(","):
+        x, y = pair.split(":")
+        table.append([float(x), float(y)])
+    return table
+
+def getSpec(name):
+    """Return the shared spec of an aircraft type. Types not found in the
+    specs file get the default spec."""
+    global _parser
+    if name in _specs:
+        return _specs[name]
+
+    if _parser is None:
+        _parser = SafeConfigParser()
+        if not _parser.read(specs_file):
+            raise ResourceLoadError(specs_file, "can't read aircraft specs")
+    section = name if _parser.has_section(name) else "default"
+    if section != name:
+        spec = getSpec(section)
+        _specs[name] = spec
+        return spec
+
+    values = {}
+    for attr in AeroplaneSpec.floats + AeroplaneSpec.tables:
+        for s in (section, "default"):
+            if _parser.has_option(s, attr):
+                values[attr] = _parser.get(s, attr)
+                break
+        else:
+            raise ResourceLoadError(specs_file, "{} has no value for "
+                                    "{}".format(name, attr))
+    for attr in AeroplaneSpec.tables:
+        values[attr] = _parseTable(values[attr])
+    spec = AeroplaneSpec(name, values)
+    _specs[name] = spec
+    return spec
+
+def reloadSpecs():
+    """Read the specs file again. Existing planes keep their old specs."""
+    global _parser
+    _parser = None
+    _specs.clear()
+
+
+# Test
+if __name__ == "__main__":
+    griffin = getSpec("griffin")
+    assert getSpec("griffin") is griffin
+    assert getSpec("unknown type") is getSpec("default")
+    print griffin, griffin.mass, griffin.lift_factor, griffin.liftvsaoa[0.1]
+    light = griffin.derive(mass=500.0)
+    assert light.mass == 500.0 and light.wing_area == griffin.wing_area
+    assert light.liftvsaoa is griffin.liftvsaoa
@@ -0,0 +1,249 @@
+"""Monte Carlo flight sweeps for tuning aircraft specs.
+
+A sweep flies many headless flights with random control inputs for every
+combination of the given spec values and collects a summary of each flight
+(maximum and minimum G, time of stall onset, top speed). The flights are
+sharded across a pool of processes. Each shard flies its planes together in
+one physics world, they don't interact.
+
+Every combination is flown with the same pilot seeds, so run k of one
+combination flies the same manoeuvres as run k of any other and results can
+be compared pairwise. The first seconds of a flight (warm_up) are not
+recorded, the plane starts in level flight with a set velocity and needs a
+moment to settle into it.
+
+Summaries are appended to a file as JSON lines as soon as their shard is
+done. Run ids that are in the file already are skipped, so an interrupted
+sweep continues where it stopped when started again with the same
+arguments.
+
+    python2 sweep.py --spec griffin --set roll_damping=-50,-100,-150 \\
+                     --set terminal_roll=2,3,4 --runs 1000 --out roll.jsonl
+"""
+
+import os
+import sys
+import json
+import random
+import itertools
+import multiprocessing
+from math import radians
+import numpy
+
+from pandac.PandaModules import Vec3
+
+from errors import *
+from specs import getSpec
+from physics import PhysicsWorld, AeroplanePhysics, gravity_acceleration
+
+movements = ("roll-left", "roll-right", "pitch-up", "pitch-down",
+             "heading-left", "heading-right")
+
+
+class Pilot(object):
+    """Flies random manoeuvres: each one holds a movement (or none) and a
+    thrust for 0.5 - 3 seconds. The same seed flies the same manoeuvres."""
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.steps_left = 0
+        self.movement = None
+
+    def fly(self, plane, step_size):
+        if self.steps_left <= 0:
+            r = self.random
+            self.steps_left = int(r.uniform(0.5, 3.0) / step_size)
+            self.movement = r.choice(movements + (None,))
+            plane.setThrust(r.uniform(0.3, 1.0))
+        self.steps_left -= 1
+        if self.movement is not None:
+            plane.move(self.movement)
+
+
+def stallAngle(spec):
+    """Angle of attack in radians with the highest lift coefficient."""
+    return radians(max(spec.lift_vs_aoa, key=lambda p: p[1])[0])
+
+
+def flyShard(shard):
+    """Fly a shard of runs and return their summaries. Shards are tuples
+    (spec name, changed spec values, [(run id, seed), ...], duration,
+    warm_up). Nothing is recorded in the first warm_up seconds."""
+    spec_name, values, runs, duration, warm_up = shard
+    spec = getSpec(spec_name).derive(**values)
+    world = PhysicsWorld(headless=True)
+    planes = []
+    pilots = []
+    for run, seed in runs:
+        plane = AeroplanePhysics(None, spec, world)
+        plane.setPosition(Vec3(0, 0, 2000))
+        plane.setVelocity(Vec3(0, 70, 0))
+        planes.append(plane)
+        pilots.append(Pilot(seed))
+
+    batch = world.aeroplanes
+    n = len(planes)
+    stall_angle = stallAngle(spec)
+    max_g = numpy.zeros(n) - numpy.inf
+    min_g = numpy.zeros(n) + numpy.inf
+    top_speed = numpy.zeros(n)
+    stall_time = numpy.zeros(n) + numpy.nan
+    up = numpy.zeros((n, 3))
+
+    steps = int(round(duration / world.step_size))
+    warm_up_steps = int(round(warm_up / world.step_size))
+    for step in range(steps):
+        for plane, pilot in zip(planes, pilots):
+            pilot.fly(plane, world.step_size)
+        world.step()
+        if step < warm_up_steps:
+            continue
+
+        # the same as gForce(), angleOfAttack() and speed() of each plane
+        w, x, y, z = batch.quat[:n].T
+        up[:,0] = 2.0 * (x*z + w*y)
+        up[:,1] = 2.0 * (y*z - w*x)
+        up[:,2] = 1.0 - 2.0 * (x*x + y*y)
+        g = (batch.acceleration[:n] * up).sum(axis=1) / gravity_acceleration
+        g += up[:,2]
+        numpy.maximum(max_g, g, out=max_g)
+        numpy.minimum(min_g, g, out=min_g)
+        speed = numpy.sqrt((batch.velocity[:n] ** 2).sum(axis=1))
+        numpy.maximum(top_speed, speed, out=top_speed)
+        stalled = (batch.angle_of_attack[:n] > stall_angle) & \
+                  numpy.isnan(stall_time)
+        stall_time[stalled] = (step + 1) * world.step_size
+
+    summaries = []
+    for i, (run, seed) in enumerate(runs):
+        summaries.append({"run": run,
+                          "seed": seed,
+                          "values": values,
+                          "max_g": float(max_g[i]),
+                          "min_g": float(min_g[i]),
+                          "stall_onset": None if numpy.isnan(stall_time[i])
+                                         else float(stall_time[i]),
+                          "top_speed": float(top_speed[i])})
+    for plane in planes:
+        plane.destroy()
+    return summaries
+
+
+class Sweep(object):
+    """Runs of all combinations of spec values.
+
+    Arguments:
+    spec -- name of the aircraft type to start from
+    values -- dict of spec value name: list of values to try
+    runs -- flights per combination
+    duration -- simulated seconds per flight
+    shard_size -- flights per task of the process pool
+    warm_up -- seconds at the start of each flight that are not recorded
+    """
+    def __init__(self, spec, values, runs=100, duration=60.0, shard_size=50,
+                 warm_up=2.0):
+        for name in values:
+            if name not in getSpec(spec).floats:
+                raise ParamError("Unknown spec value: {}".format(name))
+        self.spec = spec
+        self.values = values
+        self.runs = runs
+        self.duration = duration
+        self.shard_size = shard_size
+        self.warm_up = warm_up
+
+    def combinations(self):
+        """Return a list of dicts, one for each combination of values."""
+        names = sorted(self.values)
+        return [dict(zip(names, combination)) for combination in
+                itertools.product(*[self.values[n] for n in names])]
+
+    def shards(self, done=()):
+        """Yield the shards of all runs whose id is not in done. The seed of
+        the pilot is the number of the run within its combination, so all
+        combinations use the same seeds."""
+        for i, values in enumerate(self.combinations()):
+            first = i * self.runs
+            runs = [(run, run - first) for run in range(first,
+                                                        first + self.runs)
+                    if run not in done]
+            for start in range(0, len(runs), self.shard_size):
+                yield (self.spec, values, runs[start:start+self.shard_size],
+                       self.duration, self.warm_up)
+
+    def run(self, filename, processes=None):
+        """Fly all runs that are not in filename yet and append their
+        summaries to it. Yield each summary when its shard is done.
+        processes defaults to the number of cores."""
+        done = set()
+        if os.path.exists(filename):
+            for line in open(filename):
+                try:
+                    done.add(json.loads(line)["run"])
+                except ValueError:
+                    # the last line of an interrupted sweep may be cut off
+                    pass
+        pool = multiprocessing.Pool(processes)
+        try:
+            with open(filename, "a") as out:
+                for summaries in pool.imap_unordered(flyShard,
+                                                     self.shards(done)):
+                    for summary in summaries:
+                        out.write(json.dumps(summary, sort_keys=True) + "\n")
+                    out.flush()
+                    for summary in summaries:
+                        yield summary
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+# Test
+if __name__ == "__main__":
+    import time
+    import optparse
+
+    parser = optparse.OptionParser()
+    parser.add_option("--spec", default="griffin")
+    parser.add_option("--set", action="append", default=[],
+                      metavar="NAME=VALUE,VALUE,...",
+                      help="spec value to sweep over (repeatable)")
+    parser.add_option("--runs", type="int", default=20,
+                      help="flights per combination")
+    parser.add_option("--duration", type="float", default=30.0)
+    parser.add_option("--warm-up", type="float", default=2.0,
+                      help="seconds at the start of a flight not recorded")
+    parser.add_option("--processes", type="int")
+    parser.add_option("--out", default="sweep.jsonl")
+    options, args = parser.parse_args()
+
+    values = {}
+    for setting in options.set or ["roll_damping=-50,-100"]:
+        name, value_list = setting.split("=")
+        values[name] = [float(v) for v in value_list.split(",")]
+    sweep = Sweep(options.spec, values, options.runs, options.duration,
+                  warm_up=options.warm_up)
+
+    start = time.time()
+    results = {}
+    for summary in sweep.run(options.out, options.processes):
+        key = tuple(sorted(summary["values"].items()))
+        results.setdefault(key, []).append(summary)
+    print "{} flights in {:.1f}s".format(sum(map(len, results.values())),
+                                         time.time() - start)
+    # runs with the same seed flew the same manoeuvres, compare them in
+    # pairs with the first combination
+    first = None
+    for key, summaries in sorted(results.items()):
+        stalls = [s["stall_onset"] for s in summaries
+                  if s["stall_onset"] is not None]
+        max_g = dict((s["seed"], s["max_g"]) for s in summaries)
+        if first is None:
+            first = max_g
+        seeds = set(max_g) & set(first)
+        difference = sum(max_g[s] - first[s] for s in seeds) / \
+                     max(len(seeds), 1)
+        print dict(key), "max G {:.2f} ({:+.2f} paired), top speed {:.1f}, "\
+              "stalled {}/{}".format(max(max_g.values()), difference,
+                                     max(s["top_speed"] for s in summaries),
+                                     len(stalls), len(summaries))
@@ -0,0 +1,175 @@
+"""Ground of the world. The physics asks it for the height and the surface
+normal under each plane.
+
+A Heightfield is a regular grid of heights in a raw file, which is memory
+mapped, so only the pages around the queried points are read. Looking up a
+point takes the same time no matter how large the map is.
+
+Heightfield file layout (little endian): magic "AZHF", version, number of
+columns, number of rows, spacing in metres, world x and y of the first
+sample, padded to 64 bytes; followed by rows * columns float32 heights,
+row by row (y), each row from west to east (x).
+"""
+
+import struct
+from math import sqrt
+import numpy
+
+from errors import *
+
+magic = "AZHF"
+version = 1
+_header = struct.Struct("<4sHIIddd")
+header_size = 64
+
+
+class FlatGround(object):
+    """Flat ground at a fixed height, default ground of physics worlds."""
+    def __init__(self, height=0.0):
+        self.height = height
+
+    def heightAt(self, x, y):
+        return self.height
+
+    def normalAt(self, x, y):
+        return (0.0, 0.0, 1.0)
+
+    def sample(self, xs, ys, heights, normals):
+        """Write heights and normals at the points (xs[i], ys[i]) into the
+        arrays heights (n,) and normals (n, 3)."""
+        heights.fill(self.height)
+        normals.fill(0.0)
+        normals[:,2] = 1.0
+
+
+class Heightfield(object):
+    """Heights on a regular grid. Between the samples the height is
+    interpolated bilinearly. Outside of the grid the height of the nearest
+    edge is used."""
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, "rb") as f:
+                header = f.read(_header.size)
+            (tag, file_version, self.columns, self.rows, self.spacing,
+             self.origin_x, self.origin_y) = _header.unpack(header)
+        except (IOError, struct.error):
+            raise ResourceLoadError(filename, "can't read heightfield")
+        if tag != magic or file_version != version:
+            raise ResourceLoadError(filename, "not a heightfield")
+        if self.columns < 2 or self.rows < 2:
+            raise ResourceLoadError(filename, "heightfield needs at least "
+                                              "2x2 samples")
+        self.heights = numpy.memmap(filename, "<f4", "r", header_size,
+                                    (self.rows, self.columns))
+        self.size_x = (self.columns - 1) * self.spacing
+        self.size_y = (self.rows - 1) * self.spacing
+        self._inverse_spacing = 1.0 / self.spacing
+
+    def _cell(self, x, y):
+        """Return column, row and the fractions within the cell of a point.
+        """
+        u = (x - self.origin_x) * self._inverse_spacing
+        v = (y - self.origin_y) * self._inverse_spacing
+        u = min(max(u, 0.0), self.columns - 1.0)
+        v = min(max(v, 0.0), self.rows - 1.0)
+        col = min(int(u), self.columns - 2)
+        row = min(int(v), self.rows - 2)
+        return col, row, u - col, v - row
+
+    def heightAt(self, x, y):
+        """Height of the ground at world position x, y."""
+        col, row, fu, fv = self._cell(x, y)
+        h = self.heights
+        h00 = float(h[row, col])
+        h10 = float(h[row, col+1])
+        h01 = float(h[row+1, col])
+        h11 = float(h[row+1, col+1])
+        south = h00 + (h10 - h00) * fu
+        north = h01 + (h11 - h01) * fu
+        return south + (north - south) * fv
+
+    def normalAt(self, x, y):
+        """Unit normal of the ground at world position x, y as tuple."""
+        col, row, fu, fv = self._cell(x, y)
+        h = self.heights
+        h00 = float(h[row, col])
+        h10 = float(h[row, col+1])
+        h01 = float(h[row+1, col])
+        h11 = float(h[row+1, col+1])
+        # slopes of the bilinear surface
+        dx = ((h10 - h00) * (1.0 - fv) + (h11 - h01) * fv) * \
+             self._inverse_spacing
+        dy = ((h01 - h00) * (1.0 - fu) + (h11 - h10) * fu) * \
+             self._inverse_spacing
+        length = sqrt(dx*dx + dy*dy + 1.0)
+        return (-dx / length, -dy / length, 1.0 / length)
+
+    def sample(self, xs, ys, heights, normals):
+        """Write heights and normals at the points (xs[i], ys[i]) into the
+        arrays heights (n,) and normals (n, 3)."""
+        u = (xs - self.origin_x) * self._inverse_spacing
+        v = (ys - self.origin_y) * self._inverse_spacing
+        numpy.clip(u, 0.0, self.columns - 1.0, out=u)
+        numpy.clip(v, 0.0, self.rows - 1.0, out=v)
+        col = numpy.minimum(u.astype(int), self.columns - 2)
+        row = numpy.minimum(v.astype(int), self.rows - 2)
+        fu = u - col
+        fv = v - row
+        h = self.heights
+        h00 = h[row, col]
+        h10 = h[row, col+1]
+        h01 = h[row+1, col]
+        h11 = h[row+1, col+1]
+        south = h00 + (h10 - h00) * fu
+        north = h01 + (h11 - h01) * fu
+        heights[:] = south + (north - south) * fv
+        normals[:,0] = ((h00 - h10) * (1.0 - fv) + (h01 - h11) * fv) * \
+                       self._inverse_spacing
+        normals[:,1] = ((h00 - h01) * (1.0 - fu) + (h10 - h11) * fu) * \
+                       self._inverse_spacing
+        normals[:,2] = 1.0
+        normals /= numpy.sqrt((normals * normals).sum(axis=1))[:,None]
+
+
+def writeHeightfield(filename, heights, spacing, origin=(0.0, 0.0)):
+    """Write a 2D array of heights (rows along y, columns along x) as
+    heightfield file."""
+    heights = numpy.asarray(heights, "<f4")
+    rows, columns = heights.shape
+    header = _header.pack(magic, version, columns, rows, spacing,
+                          origin[0], origin[1])
+    with open(filename, "wb") as f:
+        f.write(header.ljust(header_size, "\0"))
+        # write row blocks, so large maps don't need a second copy in memory
+        for start in range(0, rows, 256):
+            f.write(heights[start:start+256].tobytes())
+
+
+# Test
+if __name__ == "__main__":
+    import os
+    import tempfile
+    from timeit import timeit
+
+    filename = os.path.join(tempfile.gettempdir(), "azure-test.azh")
+    for size in (101, 4001):
+        xs = numpy.arange(size) * 10.0
+        writeHeightfield(filename, 100 + 50 * numpy.sin(xs / 300.0) *
+                         numpy.cos(xs / 500.0)[:,None], 10.0,
+                         (-500.0, -500.0))
+        field = Heightfield(filename)
+        x, y = 123.4, 567.8
+        seconds = timeit(lambda: field.heightAt(x, y), number=10000) / 10000
+        print "{0}x{0} samples ({1:.0f} km): heightAt {2:.2f}, normalAt "\
+              "{3}, {4:.1f} us per query".format(size, field.size_x / 1000,
+              field.heightAt(x, y), field.normalAt(x, y), seconds * 1e6)
+        heights = numpy.zeros(2)
+        normals = numpy.zeros((2, 3))
+        field.sample(numpy.array([x, 1e6]), numpy.array([y, -1e6]), heights,
+                     normals)
+        assert abs(heights[0] - field.heightAt(x, y)) < 1e-9
+        assert numpy.allclose(normals[0], field.normalAt(x, y))
+        assert abs(heights[1] - field.heightAt(1e6, -1e6)) < 1e-9
+        del field
+    os.remove(filename)
@@ -1,5 +1,9 @@
 """Utilities which don't suit into any other module."""
 
+from bisect import bisect_left, bisect_right
+
+import numpy
+
 def sign(number):
     """Return the signature of a number. -1, 0 or 1 for negative, 0 and
     positive numbers respectively."""
@@ -10,10 +14,14 @@ def sign(number):
     else:
         return 0
 
+# upper limit of the cells of the lookup grid of ListInterpolator
+max_cells = 4096
+
+
 class ListInterpolator(object):
     """Defines an interpolated data type."""
 
-    def __init__(self, datap, lowval=None, highval=None):
+    def __init__(self, datap, lowval=None, highval=None, resolution=None):
         """arguments:
         datap -- List or tuple. Each element of which should be a list
                  or tuple with 2 values.
@@ -21,11 +29,17 @@ class ListInterpolator(object):
                   the lowest given.
         highval -- (optional), value to return if requesting y for x greater
                    than the highest given.
+        resolution -- (optional), number of points of a uniform lookup table
+                      to use instead of the given points. See
+                      setResolution().
         """
-        self.data = list(datap)
-        self.data.sort()
+        self.data = sorted(list(d) for d in datap)
+        self._xs = [d[0] for d in self.data]
         self.lowval = lowval
         self.highval = highval
+        # buffers of evaluateMany()
+        self._buffers = 0
+        self.setResolution(resolution)
 
     def setHigh(self,val):
         """Set high value default."""
@@ -34,34 +48,62 @@ class ListInterpolator(object):
         """Set low value default."""
         self.lowval = val
 
+    def setResolution(self, resolution):
+        """Precompute the data on a uniform grid with resolution points
+        between the lowest and highest x. Lookups then take constant time,
+        but are only as exact as the grid. None turns the table off."""
+        self.resolution = resolution
+        self._table = None
+        self._segments = None
+        if resolution is None or len(self.data) < 2:
+            return
+        if resolution < 2:
+            raise ValueError("resolution needs at least 2 points")
+        x0 = self._xs[0]
+        x1 = self._xs[-1]
+        grid = numpy.linspace(x0, x1, resolution)
+        values = numpy.array([self._exact(x) for x in grid], dtype=float)
+        # table, offset and inverse step width
+        self._table = (values, x0, (resolution - 1) / float(x1 - x0))
+
     def __setitem__(self,x,y):
         """Allows additional values to be placed it the data with syntax like
         values[x] = y.
         """
-        self.data.append([x,y])
-        self.data.sort()
+        i = bisect_right(self._xs, x)
+        self._xs.insert(i, x)
+        self.data.insert(i, [x,y])
+        self._segments = None
+        if self.resolution is not None:
+            self.setResolution(self.resolution)
 
     def __getitem__(self,x):
         """Returns y values for any value of x in low_x <= x <= high_x."""
 
-        if x < self.data[0][0]:
+        if x < self._xs[0]:
             if self.lowval is None:
                 raise ValueError
             else: return self.lowval
-        elif x > self.data[-1][0]:
+        elif x > self._xs[-1]:
             if self.highval is None:
                 raise ValueError
             else: return self.highval
 
+        if self._table is not None:
+            values, x0, inv_step = self._table
+            pos = (x - x0) * inv_step
+            i = min(int(pos), len(values) - 2)
+            return values[i] + (values[i+1] - values[i]) * (pos - i)
+        return self._exact(x)
+
+    def _exact(self, x):
+        """Interpolate between the given points for low_x <= x <= high_x."""
         # find the neighbouring points
-        for d in range(len(self.data)):
-            if self.data[d][0] >= x:
-                highx,highy = self.data[d]
-                if self.data[d][0] == x:
-                    return float(highy)
-                else:
-                    lowx,lowy = self.data[d-1]
-                break
+        d = bisect_left(self._xs, x)
+        highx,highy = self.data[d]
+        if highx == x:
+            return float(highy)
+        lowx,lowy = self.data[d-1]
 
         # interpolate between the points
         if lowx == highx:
@@ -70,6 +112,105 @@ class ListInterpolator(object):
             gradient = float(highy - lowy)/(highx - lowx)
         return lowy + gradient*(x - lowx)
 
+    def evaluateMany(self, xs, out=None):
+        """Return a numpy array with the y values for a whole array of x
+        values, all interpolated in one call. The values are written into
+        the array out if given. Apart from that, a call allocates no arrays
+        once it has seen this many values."""
+        xs = numpy.asarray(xs, dtype=float)
+        if out is None:
+            out = numpy.empty(len(xs))
+        n = len(xs)
+        self._reserve(n)
+        pos = self._pos[:n]
+        cell = self._cell[:n]
+        segment = self._segment[:n]
+        mask = self._mask[:n]
+        points, values, slopes, ends, cells, x0, inv_width, steps = \
+                self._segmentTable()
+
+        # start in the segment at the start of the cell of a uniform grid,
+        # move on over the few points within the cell
+        numpy.subtract(xs, x0, out=pos)
+        pos *= inv_width
+        numpy.clip(pos, 0, len(cells) - 1, out=pos)
+        cell[:] = pos
+        numpy.take(cells, cell, out=segment, mode="clip")
+        for step in range(steps):
+            numpy.take(ends, segment, out=pos, mode="clip")
+            # into an int array, adding bools to ints would copy them
+            numpy.greater_equal(xs, pos, out=cell)
+            segment += cell
+
+        # the same as numpy.interp()
+        numpy.take(points, segment, out=pos, mode="clip")
+        numpy.subtract(xs, pos, out=pos)
+        numpy.take(slopes, segment, out=out, mode="clip")
+        out *= pos
+        numpy.take(values, segment, out=pos, mode="clip")
+        out += pos
+
+        for compare, limit, value in ((numpy.less, self._xs[0],
+                                       self.lowval),
+                                      (numpy.greater, self._xs[-1],
+                                       self.highval)):
+            compare(xs, limit, out=mask)
+            if mask.any():
+                if value is None:
+                    raise ValueError
+                numpy.putmask(out, mask, value)
+        return out
+
+    def _reserve(self, n):
+        """Make the buffers of evaluateMany() hold at least n values."""
+        if self._buffers >= n:
+            return
+        self._buffers = max(n, 2 * self._buffers)
+        self._pos = numpy.empty(self._buffers)
+        self._cell = numpy.empty(self._buffers, int)
+        self._segment = numpy.empty(self._buffers, int)
+        self._mask = numpy.empty(self._buffers, bool)
+
+    def _segmentTable(self):
+        """Return what evaluateMany() needs: the points (x values), values,
+        slopes and ends of the segments (the last one has a slope of 0 and
+        no end), the segment at the start of each cell of a uniform grid
+        with the x of the first cell and the inverse cell width, and how
+        many points lie within a cell at most. With a resolution, the
+        segments are those of the grid."""
+        if self._segments is not None:
+            return self._segments
+        if self._table is not None:
+            values = self._table[0]
+            points = numpy.linspace(self._xs[0], self._xs[-1], len(values))
+        else:
+            points = numpy.array(self._xs, dtype=float)
+            values = numpy.array([d[1] for d in self.data], dtype=float)
+        if len(points) < 2 or points[-1] == points[0]:
+            points = numpy.array([points[0], points[0] + 1.0])
+            values = numpy.array([values[-1], values[-1]])
+        widths = numpy.diff(points)
+        # segments between points with the same x are never used, values
+        # at that x come from the last of the points like in numpy.interp()
+        used = widths > 0
+        slopes = numpy.zeros(len(points))
+        slopes[:-1][used] = numpy.diff(values)[used] / widths[used]
+        ends = numpy.append(points[1:], numpy.inf)
+
+        # cells as wide as the narrowest segment, within reason
+        x0 = points[0]
+        span = points[-1] - x0
+        cell_count = int(min(numpy.ceil(span / widths[used].min()),
+                             max_cells))
+        inv_width = cell_count / span
+        starts = x0 + numpy.arange(cell_count + 1) / inv_width
+        first = numpy.searchsorted(points, starts) - 1
+        numpy.clip(first, 0, len(points) - 2, out=first)
+        steps = int((first[1:] - first[:-1]).max()) + 1
+        self._segments = (points, values, slopes, ends,
+                          first[:-1].astype(int), x0, inv_width, steps)
+        return self._segments
+
 if __name__ == '__main__':
     intdata = ListInterpolator([[-1,-1],[0,0],[1,2]],0.0,0.0)
 
@@ -78,4 +219,8 @@ if __name__ == '__main__':
     for i in (-1.5,-1.0,-0.5,0.0,0.5,1.0,1.5,2.0,2.5,3.0,3.5):
         print intdata[i]
 
+    print intdata.evaluateMany((-1.5,-0.5,0.5,2.5,3.5))
+    intdata.setResolution(101)
+    print intdata.evaluateMany((-1.5,-0.5,0.5,2.5,3.5))
+
 
@@ -236,10 +236,11 @@ class PlaneView(FSM, DirectObject):
 
     def updateThirdPersonCam(self, task):
         """Updates camera position and rotation for ThirdPerson camera."""
-        speed = self.parent.physics.speed()
-        velocity = self.parent.physics.velocity()
-        #v = Point3(self.parent.physics.angVelVector())
-        v = Point3(self.parent.physics.angVelBodyHpr())
+        telemetry = self.parent.physics.telemetry()
+        speed = telemetry.speed
+        velocity = Vec3(*telemetry.velocity)
+        #v = Point3(*telemetry.angular_velocity)
+        v = Point3(*telemetry.body_rates)
         print round(v.getX(), 2), round(v.getY(), 2), round(v.getZ(), 2)
 
         #self.segs = LineSegs("lines");
@@ -248,7 +249,7 @@ class PlaneView(FSM, DirectObject):
         #self.segsnode = self.segs.create()
         #render2d.attachNewNode(self.segsnode) 
 
-        vec = Point3(self.parent.physics.angVelBodyHpr())
+        vec = Point3(*telemetry.body_rates)
         # Y hiervon ist pitch, Z ist roll
         #print round(vec.getY(), 2), round(vec.getZ(), 2)
         self.camera.lookAt(self.parent.node)
@@ -0,0 +1,132 @@
+"""Memory allocated by one call of a function, for the benchmarks.
+
+The first of these that works is used (see method):
+
+tracemalloc -- Python 3.4 or newer. Counts all memory, numpy reports its
+               array buffers to it.
+numpy -- numpy's allocation event hook, through ctypes. Works on Python 2
+         with numpy 1.7 or newer and counts the array buffers only, which
+         is what the physics allocates per step. numpy older than 1.22
+         hands out freed buffers below 1 KB again without telling the hook,
+         so measure with at least 128 planes there.
+
+Without either, measure() returns None and the benchmarks print "n/a" along
+with a note.
+
+    import allocations
+    peak, retained = allocations.measure(world.step)
+"""
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+def _numpyEventHook():
+    """Return numpy's PyDataMem_SetEventHook() as a ctypes function, or None
+    if this numpy doesn't have it."""
+    try:
+        import ctypes
+        import numpy
+        from numpy.core import multiarray
+        api = multiarray._ARRAY_API
+    except (ImportError, AttributeError):
+        return None
+    if not (1, 7) <= tuple(map(int, numpy.__version__.split(".")[:2])) < \
+           (2, 0):
+        return None
+    # the C API table is a PyCObject on Python 2, a PyCapsule on Python 3
+    if type(api).__name__ == "PyCapsule":
+        get_pointer = ctypes.pythonapi.PyCapsule_GetPointer
+        get_pointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+        arguments = (api, None)
+    else:
+        get_pointer = ctypes.pythonapi.PyCObject_AsVoidPtr
+        get_pointer.argtypes = [ctypes.py_object]
+        arguments = (api,)
+    get_pointer.restype = ctypes.c_void_p
+    table = ctypes.cast(get_pointer(*arguments),
+                        ctypes.POINTER(ctypes.c_void_p))
+    # PyDataMem_SetEventHook is number 291 of the table, see numpy_api.py
+    return ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p,
+                            ctypes.c_void_p,
+                            ctypes.POINTER(ctypes.c_void_p))(table[291])
+
+_set_event_hook = None if tracemalloc else _numpyEventHook()
+
+if tracemalloc:
+    method = "tracemalloc"
+elif _set_event_hook:
+    method = "numpy"
+else:
+    method = None
+available = method is not None
+note = "allocation figures need Python 3 (tracemalloc) or numpy 1.7 - 1.26 " \
+       "for the numpy event hook, shown as n/a"
+
+
+class _ArrayBuffers(object):
+    """Keeps track of the array buffers numpy allocates while installed as
+    its event hook."""
+    def __init__(self):
+        import ctypes
+        self.sizes = {}
+        self.current = self.peak = 0
+        self.callback = ctypes.CFUNCTYPE(None, ctypes.c_void_p,
+                                         ctypes.c_void_p, ctypes.c_size_t,
+                                         ctypes.c_void_p)(self.event)
+        self._old_data = ctypes.c_void_p()
+        self._byref = ctypes.byref
+
+    def event(self, old, new, size, user_data):
+        """Called by numpy on malloc (old is None), free (new is None) and
+        realloc."""
+        if old is not None:
+            # buffers from before install() were never counted
+            self.current -= self.sizes.pop(old, 0)
+        if new is not None:
+            self.sizes[new] = size
+            self.current += size
+            if self.current > self.peak:
+                self.peak = self.current
+
+    def install(self):
+        self.sizes.clear()
+        self.current = self.peak = 0
+        self._old = _set_event_hook(self.callback, None,
+                                    self._byref(self._old_data))
+
+    def uninstall(self):
+        _set_event_hook(self._old, self._old_data, self._byref(self._old_data))
+
+
+def measure(function, samples=20):
+    """Call function samples times and return the average peak and retained
+    bytes allocated during one call, or (None, None) if nothing can count
+    them."""
+    if method == "tracemalloc":
+        start = tracemalloc.start
+        stop = tracemalloc.stop
+        traced = tracemalloc.get_traced_memory
+    elif method == "numpy":
+        buffers = _ArrayBuffers()
+        start = buffers.install
+        stop = buffers.uninstall
+        traced = lambda: (buffers.current, buffers.peak)
+    else:
+        return None, None
+    retained = peak = 0
+    for i in range(samples):
+        start()
+        function()
+        current, highest = traced()
+        stop()
+        retained += current
+        peak += highest
+    return peak // samples, retained // samples
+
+
+def formatBytes(value, width=0):
+    """Right align a number of bytes, or "n/a" for None."""
+    return "{:>{}}".format("n/a" if value is None else value, width)
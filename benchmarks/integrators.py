@@ -0,0 +1,69 @@
+#!/usr/bin/env python2
+"""Compares the integrators of the physics (see azure/integrators.py).
+
+Flies the same fleet with each integrator in a headless world and prints the
+time per step in milliseconds, the time per aircraft-step in microseconds
+and how far the planes end up from where the ODE integrator put them.
+
+    python2 benchmarks/integrators.py --planes 1,10,100,1000
+"""
+
+import sys
+import os
+import time
+import optparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+
+parser = optparse.OptionParser()
+parser.add_option("--planes", default="1,10,100,1000",
+                  help="comma separated plane counts")
+parser.add_option("--duration", type="float", default=10.0,
+                  help="simulated seconds per measurement")
+
+
+def fly(integrator, count, duration):
+    """Return seconds per step and the final positions of count planes."""
+    import numpy
+    from pandac.PandaModules import Vec3
+    from azure.physics import PhysicsWorld, AeroplanePhysics
+    world = PhysicsWorld(headless=True, integrator=integrator)
+    planes = []
+    for i in range(count):
+        plane = AeroplanePhysics(None, "griffin", world)
+        plane.setPosition(Vec3(i * 100.0, 0, 1000))
+        plane.setVelocity(Vec3(0, 60, 0))
+        plane.setThrust(0.8)
+        planes.append(plane)
+    steps = int(duration / world.step_size)
+    start = time.time()
+    for step in range(steps):
+        for i, plane in enumerate(planes):
+            if (step + i * 7) % 100 < 30:
+                plane.move("roll-left")
+        world.step()
+    per_step = (time.time() - start) / steps
+    return per_step, numpy.array(world.aeroplanes.position[:count])
+
+
+if __name__ == "__main__":
+    options, args = parser.parse_args()
+    import numpy
+    from azure.integrators import integrators
+
+    names = sorted(integrators)
+    header = "{:>6}".format("planes")
+    for name in names:
+        header += " {:>14} {:>10}".format(name + " ms", "us/plane")
+    print header + " {:>12}".format("max offset")
+    for count in map(int, options.planes.split(",")):
+        line = "{:>6}".format(count)
+        positions = {}
+        for name in names:
+            per_step, positions[name] = fly(name, count, options.duration)
+            line += " {:>14.3f} {:>10.2f}".format(per_step * 1000,
+                                                 per_step / count * 1e6)
+        offsets = [numpy.sqrt(((positions[name] - positions["ode"]) ** 2).
+                              sum(axis=1)).max() for name in names]
+        print line + " {:>11.4f}m".format(max(offsets))
@@ -0,0 +1,129 @@
+#!/usr/bin/env python2
+"""Micro-benchmark of the aerodynamic force kernel.
+
+Steps the physics world with a number of planes and prints the time per step
+and the memory allocated for temporaries during one step, see allocations.py
+for how that is measured. Use --root to benchmark another checkout, e.g. an
+older revision, for comparison. Checkouts from before PhysicsWorld are
+stepped through the physics task of each plane.
+
+    python2 benchmarks/kernel.py --planes 1,10,100
+    git worktree add /tmp/old HEAD~1
+    python2 benchmarks/kernel.py --root /tmp/old
+"""
+
+import sys
+import os
+import time
+import optparse
+
+import allocations
+
+parser = optparse.OptionParser()
+parser.add_option("--planes", default="1,10,100",
+                  help="comma separated numbers of planes to benchmark")
+parser.add_option("--steps", type="int", default=1000,
+                  help="physics steps per measurement")
+parser.add_option("--root", default=os.path.join(os.path.dirname(
+                  os.path.abspath(__file__)), os.pardir),
+                  help="root directory of the checkout to benchmark")
+
+
+def setup(root):
+    """Make the azure package importable and open a ShowBase without window,
+    which provides render and taskMgr."""
+    from pandac.PandaModules import loadPrcFileData
+    loadPrcFileData("", "window-type none\naudio-library-name null")
+    from direct.showbase.ShowBase import ShowBase
+    ShowBase()
+    sys.path.insert(0, os.path.abspath(root))
+
+
+def makePlanes(count):
+    """Create count flying planes in the default physics world."""
+    from pandac.PandaModules import NodePath, Vec3
+    from azure.physics import AeroplanePhysics
+    planes = []
+    for i in range(count):
+        node = NodePath("plane {}".format(i))
+        node.reparentTo(render)
+        node.setPos(i * 100.0, 0, 1000)
+        plane = AeroplanePhysics(node)
+        plane.setVelocity(Vec3(0, 60, 0))
+        plane.setThrust(0.8)
+        planes.append(plane)
+    return planes
+
+
+def stepper(planes, step_size=0.02):
+    """Return a function that does one physics step of the planes. Older
+    checkouts are stepped the way they stepped themselves: through the
+    aeroplane batch before PhysicsWorld, and before that through the task
+    of every plane, which steps the shared ODE world by the time of the
+    last frame. That time is fixed to step_size here."""
+    from azure import physics
+    world = physics.Physical.world
+    if hasattr(world, "addForceHook"):
+        return world.step
+    batch = getattr(physics.AeroplanePhysics, "batch", None)
+    if batch is not None:
+        return batch.step
+    from pandac.PandaModules import ClockObject
+    from direct.task import Task
+    clock = ClockObject.getGlobalClock()
+    clock.setMode(ClockObject.MNonRealTime)
+    clock.setDt(step_size)
+    def step():
+        # the task uses nothing of its task object but Task.cont
+        for plane in planes:
+            plane.simulationTask(Task)
+    return step
+
+
+def destroy(planes):
+    """Remove the planes from the world. Before PhysicsWorld they couldn't
+    be removed, their bodies are disabled and they are no longer stepped."""
+    for plane in planes:
+        if hasattr(plane, "simulationTask"):
+            plane.ode_body.disable()
+        else:
+            plane.destroy()
+
+
+def measure(count, steps):
+    """Return seconds per step, and peak and retained bytes allocated during
+    one step (None if they can't be measured, see allocations.py)."""
+    planes = makePlanes(count)
+    step = stepper(planes)
+    for i in range(50):
+        planes[i % count].move("roll-left")
+        step()
+
+    start = time.time()
+    for i in range(steps):
+        planes[i % count].move("roll-left")
+        step()
+    per_step = (time.time() - start) / steps
+
+    peak, retained = allocations.measure(step)
+
+    destroy(planes)
+    return per_step, peak, retained
+
+
+if __name__ == "__main__":
+    options, args = parser.parse_args()
+    setup(options.root)
+    if allocations.available:
+        print "Allocations measured with", allocations.method
+    else:
+        print "Note:", allocations.note
+    print "{:>8} {:>14} {:>16} {:>16} {:>14}".format(
+            "planes", "us/step", "us/plane-step", "peak bytes/step",
+            "retained bytes")
+    for count in map(int, options.planes.split(",")):
+        per_step, peak, retained = measure(count, options.steps)
+        print "{:>8} {:>14.1f} {:>16.2f} {} {}".format(
+                count, per_step * 1e6, per_step * 1e6 / count,
+                allocations.formatBytes(peak, 16),
+                allocations.formatBytes(retained, 14))
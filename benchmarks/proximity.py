@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+"""Compares the spatial hash with checking every pair of planes.
+
+Planes are spread at the same density for every count, so the number of
+close pairs grows linearly. Times are per query (or per update of the hash
+after a world step), in milliseconds.
+
+    python2 benchmarks/proximity.py --planes 100,300,1000
+"""
+
+import sys
+import os
+import time
+import random
+import optparse
+from timeit import repeat
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                os.pardir)))
+
+parser = optparse.OptionParser()
+parser.add_option("--planes", default="100,300,1000,3000",
+                  help="comma separated plane counts")
+parser.add_option("--distance", type="float", default=200.0,
+                  help="distance of the pair query in metres")
+parser.add_option("--density", type="float", default=4.0,
+                  help="planes per square kilometre")
+
+
+def naivePairs(planes, distance):
+    """The O(n^2) baseline: compare the positions of all pairs."""
+    pairs = []
+    positions = [plane.position() for plane in planes]
+    for i in range(len(planes)):
+        a = positions[i]
+        for j in range(i + 1, len(planes)):
+            if (a - positions[j]).length() <= distance:
+                pairs.append((planes[i], planes[j]))
+    return pairs
+
+
+def numpyPairs(batch, distance):
+    """The O(n^2) baseline with numpy: all distances at once."""
+    import numpy
+    n = len(batch)
+    p = batch.position[:n]
+    offsets = p[:,None,:] - p[None,:,:]
+    close = (offsets * offsets).sum(axis=2) <= distance * distance
+    a, b = numpy.nonzero(numpy.triu(close, 1))
+    return [(batch.planes[i], batch.planes[j]) for i, j in zip(a, b)]
+
+
+def best(function, number):
+    return min(repeat(function, number=number, repeat=5)) / number * 1000
+
+
+if __name__ == "__main__":
+    options, args = parser.parse_args()
+    from pandac.PandaModules import Vec3
+    from azure.physics import PhysicsWorld, AeroplanePhysics
+    from azure.spatialhash import SpatialHash
+
+    print "{:>6} {:>7} {:>10} {:>10} {:>12} {:>12}".format("planes",
+            "pairs", "update", "hash", "numpy n^2", "python n^2")
+    for count in map(int, options.planes.split(",")):
+        world = PhysicsWorld(headless=True)
+        r = random.Random(count)
+        side = (count / options.density) ** 0.5 * 1000.0
+        planes = []
+        for i in range(count):
+            plane = AeroplanePhysics(None, "griffin", world)
+            plane.setPosition(Vec3(r.uniform(0, side), r.uniform(0, side),
+                                   r.uniform(500, 1500)))
+            plane.setVelocity(Vec3(r.uniform(-80, 80), r.uniform(-80, 80), 0))
+            planes.append(plane)
+        proximity = SpatialHash(world, options.distance)
+        world.simulate(2.0)
+
+        distance = options.distance
+        pairs = proximity.pairsWithin(distance)
+        # time only the hash updates of 100 world steps
+        world.removeStepHook(proximity.update)
+        update = 0.0
+        for i in range(100):
+            world.step()
+            start = time.time()
+            proximity.update()
+            update += time.time() - start
+        update = update / 100 * 1000
+        hashed = best(lambda: proximity.pairsWithin(distance), 20)
+        brute = best(lambda: numpyPairs(world.aeroplanes, distance), 3)
+        if count <= 1000:
+            naive = "{:12.2f}".format(best(lambda: naivePairs(planes,
+                                                              distance), 1))
+        else:
+            naive = "{:>12}".format("-")
+        print "{:>6} {:>7} {:>10.3f} {:>10.3f} {:>12.2f} {}".format(count,
+                len(pairs), update, hashed, brute, naive)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2
+"""Flight dynamics benchmark suite.
+
+Flies 1, 10, 100 and 1000 griffins with scripted control inputs in a headless
+physics world and reports steps per second, time per aircraft-step, memory
+allocated per step and peak resident memory. Each fleet size runs in its own
+process, so the peak memory belongs to that size only. Memory per step is
+counted with tracemalloc on Python 3 and numpy's allocation hook on Python 2
+(see allocations.py, the JSON names the method). Where neither works it is
+null in the JSON and n/a otherwise.
+
+Results can be written as JSON and compared against a stored baseline:
+
+    python2 benchmarks/scaling.py --output results.json
+    python2 benchmarks/scaling.py --baseline results.json
+"""
+
+import sys
+import os
+import json
+import time
+import platform
+import resource
+import optparse
+import subprocess
+from math import sin
+
+import allocations
+
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+
+parser = optparse.OptionParser()
+parser.add_option("--aircraft", default="1,10,100,1000",
+                  help="comma separated fleet sizes")
+parser.add_option("--duration", type="float", default=20.0,
+                  help="simulated seconds per fleet size")
+parser.add_option("--spec", default="griffin", help="aircraft type")
+parser.add_option("--output", help="write results as JSON to this file")
+parser.add_option("--baseline", help="compare against this JSON file")
+parser.add_option("--tolerance", type="float", default=0.1,
+                  help="allowed slowdown against the baseline (0.1 = 10%)")
+parser.add_option("--single", type="int", help=optparse.SUPPRESS_HELP)
+
+
+def flyControls(planes, step):
+    """Scripted control inputs. Every plane flies the same manoeuvres, but
+    shifted in time."""
+    for i, plane in enumerate(planes):
+        t = (step + i * 7) % 250
+        if t < 40:
+            plane.move("roll-left")
+        elif 60 <= t < 100:
+            plane.move("roll-right")
+        elif 120 <= t < 150:
+            plane.move("pitch-up")
+        elif 200 <= t < 210:
+            plane.move("heading-left")
+        if t == 0:
+            plane.setThrust(0.6 + 0.4 * sin(step * 0.01 + i))
+
+
+def run(count, duration, spec):
+    """Benchmark one fleet size and return a dict of results."""
+    sys.path.insert(0, root)
+    from pandac.PandaModules import Vec3
+    from azure.physics import PhysicsWorld, AeroplanePhysics
+
+    world = PhysicsWorld(headless=True)
+    planes = []
+    for i in range(count):
+        plane = AeroplanePhysics(None, spec, world)
+        plane.setPosition(Vec3((i % 32) * 200.0, (i // 32) * 200.0, 1500.0))
+        plane.setVelocity(Vec3(0, 70, 0))
+        plane.setThrust(0.8)
+        planes.append(plane)
+
+    # warm up
+    for step in range(50):
+        flyControls(planes, step)
+        world.step()
+
+    steps = int(round(duration / world.step_size))
+    start = time.time()
+    for step in range(steps):
+        flyControls(planes, step)
+        world.step()
+    seconds = time.time() - start
+
+    controlled = iter(range(20))
+    def step():
+        flyControls(planes, next(controlled))
+        world.step()
+    peak_bytes = allocations.measure(step)[0]
+
+    # ru_maxrss is in kilobytes on Linux, but bytes on Mac OS X
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024
+
+    return {"aircraft": count,
+            "steps": steps,
+            "seconds": seconds,
+            "steps_per_second": steps / seconds,
+            "us_per_aircraft_step": seconds * 1e6 / (steps * count),
+            "peak_bytes_per_step": peak_bytes,
+            "peak_rss_kb": rss}
+
+
+def runAll(options):
+    """Run every fleet size in a subprocess and collect the results."""
+    results = []
+    for count in map(int, options.aircraft.split(",")):
+        output = subprocess.check_output([sys.executable,
+                os.path.abspath(__file__), "--single", str(count),
+                "--duration", str(options.duration), "--spec", options.spec])
+        results.append(json.loads(output.splitlines()[-1]))
+    version = open(os.path.join(root, "VERSION")).read().strip()
+    return {"benchmark": "flight scaling",
+            "version": version,
+            "spec": options.spec,
+            "duration": options.duration,
+            "python": platform.python_version(),
+            "allocations": allocations.method,
+            "machine": platform.machine(),
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "results": results}
+
+
+def compare(report, baseline, tolerance):
+    """Print the change of time per aircraft-step against the baseline.
+    Return False if any fleet size got slower than the tolerance allows."""
+    old = dict((r["aircraft"], r) for r in baseline["results"])
+    ok = True
+    for r in report["results"]:
+        if r["aircraft"] not in old:
+            continue
+        before = old[r["aircraft"]]["us_per_aircraft_step"]
+        change = r["us_per_aircraft_step"] / before - 1.0
+        regression = change > tolerance
+        ok = ok and not regression
+        print "{:>6} aircraft: {:8.2f} -> {:8.2f} us/aircraft-step {:+.1%}{}".\
+              format(r["aircraft"], before, r["us_per_aircraft_step"],
+                     change, "  REGRESSION" if regression else "")
+    return ok
+
+
+if __name__ == "__main__":
+    options, args = parser.parse_args()
+    if options.single:
+        print json.dumps(run(options.single, options.duration, options.spec))
+        sys.exit()
+
+    report = runAll(options)
+    if allocations.available:
+        print "Allocations measured with", allocations.method
+    else:
+        print "Note:", allocations.note
+    print "{:>8} {:>12} {:>20} {:>16} {:>12}".format("aircraft",
+            "steps/s", "us/aircraft-step", "peak bytes/step", "peak RSS kB")
+    for r in report["results"]:
+        print "{:>8} {:>12.1f} {:>20.2f} {} {:>12}".format(r["aircraft"],
+                r["steps_per_second"], r["us_per_aircraft_step"],
+                allocations.formatBytes(r["peak_bytes_per_step"], 16),
+                r["peak_rss_kb"])
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if options.baseline:
+        with open(options.baseline) as f:
+            if not compare(report, json.load(f), options.tolerance):
+                sys.exit(1)